@@ -0,0 +1,116 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Chunks/sec of the dataprep ingestion, sequential vs pipelined (comps/dataprep/pipeline.py), per stage.
+
+A synthetic corpus of `--docs` text files is ingested with a simulated embedding server and vector store:
+an embedding request takes `--embed-ms` plus `--embed-us-per-chunk` per chunk and a write takes `--write-ms`
+plus `--write-us-per-chunk`, both release the GIL like network calls do. Parsing burns `--parse-us-per-chunk`
+of CPU per chunk, as PDF parsing would.
+
+- sequential: the former ingestion, each file parsed in the service process, then one batch embedded and
+  written at a time
+- pipelined: each file parsed in the parse pool, `--inflight` embedding requests in flight and the writes
+  overlapped with the embedding
+
+Usage:
+    python benchmarks/dataprep/bench_dataprep_pipeline.py --docs 20 --chunks-per-doc 200 --inflight 1 4 8
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from comps.dataprep.pipeline import PipelineStats, embed_and_write, parse_document
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--docs", type=int, default=20)
+parser.add_argument("--chunks-per-doc", type=int, default=200)
+parser.add_argument("--chunk-words", type=int, default=100)
+parser.add_argument("--batch-size", type=int, default=32)
+parser.add_argument("--inflight", type=int, nargs="+", default=[1, 4, 8])
+parser.add_argument("--embed-ms", type=float, default=20, help="fixed latency of an embedding request")
+parser.add_argument("--embed-us-per-chunk", type=float, default=500)
+parser.add_argument("--write-ms", type=float, default=5, help="fixed latency of a vector store write")
+parser.add_argument("--write-us-per-chunk", type=float, default=100)
+parser.add_argument("--parse-us-per-chunk", type=float, default=200)
+parser.add_argument("--dims", type=int, default=768)
+args = parser.parse_args()
+
+WORDS = "the of and to in is for on with as by at from this that data model vector index search query".split()
+
+
+def make_corpus(folder: str) -> list:
+    paths = []
+    for i in range(args.docs):
+        words = random.choices(WORDS, k=args.chunks_per_doc * args.chunk_words)
+        path = os.path.join(folder, f"doc_{i}.txt")
+        with open(path, "w") as f:
+            f.write(" ".join(words))
+        paths.append(path)
+    return paths
+
+
+def parse_file(path: str, chunk_words: int, parse_us_per_chunk: float) -> list:
+    """Split the file in chunks of `chunk_words` words, burning CPU like a PDF parser."""
+    with open(path) as f:
+        words = f.read().split()
+    chunks = [" ".join(words[i : i + chunk_words]) for i in range(0, len(words), chunk_words)]
+    deadline = time.perf_counter() + len(chunks) * parse_us_per_chunk / 1e6
+    while time.perf_counter() < deadline:
+        pass
+    return chunks
+
+
+def embed(texts: list) -> list:
+    time.sleep((args.embed_ms * 1000 + args.embed_us_per_chunk * len(texts)) / 1e6)
+    return [[0.0] * args.dims for _ in texts]
+
+
+def write(texts: list, vectors: list):
+    time.sleep((args.write_ms * 1000 + args.write_us_per_chunk * len(texts)) / 1e6)
+
+
+def sequential(paths: list) -> dict:
+    stats = PipelineStats()
+    for path in paths:
+        start = time.perf_counter()
+        chunks = parse_file(path, args.chunk_words, args.parse_us_per_chunk)
+        stats["parse"].add(len(chunks), time.perf_counter() - start)
+        for i in range(0, len(chunks), args.batch_size):
+            texts = chunks[i : i + args.batch_size]
+            start = time.perf_counter()
+            vectors = embed(texts)
+            stats["embed"].add(len(texts), time.perf_counter() - start)
+            start = time.perf_counter()
+            write(texts, vectors)
+            stats["write"].add(len(texts), time.perf_counter() - start)
+    stats.end = time.perf_counter()
+    return stats.to_dict()
+
+
+def pipelined(paths: list, inflight: int) -> dict:
+    stats = PipelineStats()
+    for path in paths:
+        chunks = parse_document(parse_file, path, args.chunk_words, args.parse_us_per_chunk, stats=stats)
+        embed_and_write(chunks, embed, write, batch_size=args.batch_size, max_inflight=inflight, stats=stats)
+    stats.end = time.perf_counter()
+    return stats.to_dict()
+
+
+def main():
+    with tempfile.TemporaryDirectory() as folder:
+        paths = make_corpus(folder)
+        # start the parse pool outside of the measures
+        parse_document(parse_file, paths[0], args.chunk_words, 0)
+        results = {"chunks": args.docs * args.chunks_per_doc, "sequential": sequential(paths)}
+        for inflight in args.inflight:
+            results[f"pipelined_inflight_{inflight}"] = pipelined(paths, inflight)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
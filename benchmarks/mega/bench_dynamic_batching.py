@@ -0,0 +1,114 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Latency and throughput of MicroService dynamic batching under open-loop load.
+
+dynamic_batching_infer is faked with a sleep of `--infer-base + --infer-per-item * batch size` seconds.
+
+Usage:
+    python benchmarks/mega/bench_dynamic_batching.py --rate 500 --duration 10 --timeout 0.005
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from enum import Enum
+
+import aiohttp
+
+from comps import ServiceType, TextDoc, opea_microservices, register_microservice
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--rate", type=float, default=500, help="mean request arrival rate (req/s), Poisson arrivals")
+parser.add_argument("--duration", type=float, default=10, help="seconds of load")
+parser.add_argument("--timeout", type=float, default=0.005, help="dynamic_batching_timeout in seconds")
+parser.add_argument("--max-batch-size", type=int, default=32)
+parser.add_argument("--max-inflight", type=int, default=1)
+parser.add_argument("--infer-base", type=float, default=0.01, help="fixed seconds per batch")
+parser.add_argument("--infer-per-item", type=float, default=0.0005, help="seconds per request in a batch")
+parser.add_argument("--port", type=int, default=9390)
+args = parser.parse_args()
+
+
+async def fake_batching_infer(service_type: Enum, batch: list[dict]):
+    await asyncio.sleep(args.infer_base + args.infer_per_item * len(batch))
+    return [{"text": req["request"].text} for req in batch]
+
+
+@register_microservice(
+    name="bench_batching",
+    host="0.0.0.0",
+    port=args.port,
+    endpoint="/v1/embeddings",
+    service_type=ServiceType.EMBEDDING,
+    dynamic_batching=True,
+    dynamic_batching_timeout=args.timeout,
+    dynamic_batching_max_batch_size=args.max_batch_size,
+    dynamic_batching_max_inflight=args.max_inflight,
+)
+async def bench_embedding(request: TextDoc) -> dict:
+    cur_microservice = opea_microservices["bench_batching"]
+    cur_microservice.dynamic_batching_infer = fake_batching_infer
+    return await cur_microservice.dynamic_batching_submit(ServiceType.EMBEDDING, request)
+
+
+async def one_request(session, url, latencies):
+    start = time.perf_counter()
+    async with session.post(url, json={"text": "hello"}) as response:
+        await response.read()
+        if response.status == 200:
+            latencies.append(time.perf_counter() - start)
+
+
+async def metric_sum_count(session, base_url, name):
+    async with session.get(f"{base_url}/metrics") as response:
+        text = await response.text()
+    values = {}
+    for suffix in ["sum", "count"]:
+        match = re.search(rf"^{name}_{suffix}{{[^}}]*}} (\S+)$", text, re.MULTILINE)
+        values[suffix] = float(match.group(1)) if match else 0.0
+    return values
+
+
+async def main():
+    await asyncio.sleep(2)
+    base_url = f"http://localhost:{args.port}"
+    latencies = []
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await one_request(session, f"{base_url}/v1/embeddings", [])
+        before = await metric_sum_count(session, base_url, "microservice_batch_size")
+        tasks = []
+        start = time.perf_counter()
+        while time.perf_counter() - start < args.duration:
+            tasks.append(asyncio.create_task(one_request(session, f"{base_url}/v1/embeddings", latencies)))
+            await asyncio.sleep(random.expovariate(args.rate))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        after = await metric_sum_count(session, base_url, "microservice_batch_size")
+
+    latencies.sort()
+    batches = after["count"] - before["count"]
+    result = {
+        "args": vars(args),
+        "requests": len(tasks),
+        "completed": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_latency_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_latency_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+        "batches": int(batches),
+        "mean_batch_size": round((after["sum"] - before["sum"]) / batches, 2) if batches else 0,
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    service = opea_microservices["bench_batching"]
+    service.start()
+    try:
+        asyncio.run(main())
+    finally:
+        service.stop()
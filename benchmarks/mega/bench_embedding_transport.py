@@ -0,0 +1,66 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Serialization cost and payload size of EmbedDoc messages with JSON float lists vs binary embeddings.
+
+Each message is serialized as an embedding microservice replies (`model_dump_json()`) and parsed as the
+retriever reads its input (`EmbedDoc.model_validate_json()`), with the embeddings sent as JSON floats or
+base64 float32/float16 (see comps/cores/proto/embedding_encoding.py).
+
+Usage:
+    python benchmarks/mega/bench_embedding_transport.py --dims 384 768 1024 --batch 1 16
+"""
+
+import argparse
+import json
+import random
+import time
+
+from comps import EmbedDoc
+from comps.cores.proto.embedding_encoding import embedding_encoding
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dims", type=int, nargs="+", default=[384, 768, 1024])
+parser.add_argument("--batch", type=int, nargs="+", default=[1, 16], help="vectors per message")
+parser.add_argument("--iterations", type=int, default=500)
+args = parser.parse_args()
+
+
+def measure(doc: EmbedDoc, dtype):
+    token = embedding_encoding.set({"dtype": dtype, "used": False} if dtype else None)
+    try:
+        payload = doc.model_dump_json()
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            doc.model_dump_json()
+        encode = (time.perf_counter() - start) / args.iterations
+    finally:
+        embedding_encoding.reset(token)
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        EmbedDoc.model_validate_json(payload)
+    decode = (time.perf_counter() - start) / args.iterations
+    return {
+        "bytes": len(payload),
+        "encode_us": round(encode * 1e6, 1),
+        "decode_us": round(decode * 1e6, 1),
+    }
+
+
+def main():
+    results = []
+    for dims in args.dims:
+        for batch in args.batch:
+            vectors = [[random.uniform(-1, 1) for _ in range(dims)] for _ in range(batch)]
+            doc = EmbedDoc(
+                text=["query"] * batch if batch > 1 else "query", embedding=vectors if batch > 1 else vectors[0]
+            )
+            row = {"dims": dims, "batch": batch}
+            for name, dtype in (("json", None), ("float32", "float32"), ("float16", "float16")):
+                row[name] = measure(doc, dtype)
+            results.append(row)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
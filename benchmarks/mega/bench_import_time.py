@@ -0,0 +1,70 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Cold import time of the comps package, from `python -X importtime` in a fresh interpreter.
+
+For each statement the total import time is the sum of the self times of all the imported modules (the
+interpreter startup excluded), the best of `--repeat` runs. The heaviest top-level packages are listed with
+their cumulative time. tests/cores/mega/test_import_time.py enforces a budget on the same measure.
+
+Usage:
+    python benchmarks/mega/bench_import_time.py --repeat 5
+    python benchmarks/mega/bench_import_time.py --statement "from comps import TextDoc"
+"""
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+
+STATEMENTS = [
+    "import comps",
+    "from comps import CustomLogger",
+    "from comps import TextDoc",
+    "from comps import register_microservice",
+    "from comps import ServiceOrchestrator",
+    "from comps import ChatQnAGateway",
+]
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--statement", nargs="+", default=STATEMENTS)
+parser.add_argument("--repeat", type=int, default=3)
+parser.add_argument("--top", type=int, default=8, help="heaviest top-level packages listed")
+args = parser.parse_args()
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(statement: str) -> list:
+    """(self us, cumulative us, depth, module) of the modules imported by `statement`."""
+    # the modules imported at startup are imported again with -X importtime, only those after the marker count
+    code = f"import sys; sys.stderr.write('--\\n'); {statement}"
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True
+    ).stderr
+    stderr = stderr[stderr.index("--\n") + 3 :]
+    return [
+        (int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2, m.group(4))
+        for m in map(LINE.match, stderr.splitlines())
+        if m
+    ]
+
+
+def measure(statement: str) -> dict:
+    runs = [import_times(statement) for _ in range(args.repeat)]
+    best = min(runs, key=lambda modules: sum(m[0] for m in modules))
+    top_level = sorted((m for m in best if m[2] == 0), key=lambda m: -m[1])
+    return {
+        "total_ms": round(sum(m[0] for m in best) / 1000, 1),
+        "modules": len(best),
+        "heaviest_ms": {m[3]: round(m[1] / 1000, 1) for m in top_level[: args.top]},
+    }
+
+
+def main():
+    print(json.dumps({statement: measure(statement) for statement in args.statement}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
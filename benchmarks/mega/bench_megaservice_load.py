@@ -0,0 +1,257 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""End-to-end load test of Gateway + ServiceOrchestrator with stub microservices.
+
+The stubs replace the model servers of a ChatQnA (embedding -> retriever -> reranking -> LLM), DocSum (LLM)
+or AudioQnA (ASR -> LLM -> TTS) pipeline. Each stub sleeps a fixed or sampled latency, the LLM stub streams
+`--tokens` tokens at `--token-rate` tokens/s. The gateway is driven with closed-loop load (`--concurrency`
+clients sending back-to-back requests) or open-loop load (Poisson arrivals at `--rate` req/s), and the RPS,
+p50/p99 latency, time to first token (TTFT) and inter-token latency (ITL) of every load level are reported
+as JSON.
+
+Usage:
+    python benchmarks/mega/bench_megaservice_load.py --pipeline chatqna --mode closed --concurrency 1 8 32
+    python benchmarks/mega/bench_megaservice_load.py --pipeline audioqna --mode open --rate 10 50 --output r.json
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+
+import aiohttp
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from comps import (
+    AudioQnAGateway,
+    ChatQnAGateway,
+    DocSumGateway,
+    ServiceOrchestrator,
+    ServiceType,
+    opea_microservices,
+    register_microservice,
+)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--pipeline", choices=["chatqna", "docsum", "audioqna"], default="chatqna")
+parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="clients of the closed loop")
+parser.add_argument("--rate", type=float, nargs="+", default=[5, 20], help="req/s of the open loop")
+parser.add_argument("--duration", type=float, default=10, help="seconds of load per level")
+parser.add_argument("--no-stream", action="store_true", help="non-streaming LLM requests")
+parser.add_argument("--latency", type=float, default=0.01, help="mean seconds per call of the non-LLM stubs")
+parser.add_argument(
+    "--stage-latency",
+    nargs="*",
+    default=[],
+    metavar="STAGE=SECONDS",
+    help="per-stub mean latency overrides, e.g. retriever=0.05 llm=0.2 (llm: time before the first token)",
+)
+parser.add_argument("--distribution", choices=["fixed", "exponential", "lognormal"], default="fixed")
+parser.add_argument("--tokens", type=int, default=64, help="tokens generated per LLM request")
+parser.add_argument("--token-rate", type=float, default=50, help="tokens/s of the LLM stub")
+parser.add_argument("--port", type=int, default=9400, help="first port, stubs use the next ones")
+parser.add_argument("--output", help="also write the JSON results to this file")
+args = parser.parse_args()
+
+stage_latency = {stage: float(seconds) for stage, seconds in (item.split("=") for item in args.stage_latency)}
+
+
+def sample_latency(stage: str) -> float:
+    mean = stage_latency.get(stage, args.latency)
+    if args.distribution == "exponential":
+        return random.expovariate(1 / mean) if mean > 0 else 0.0
+    if args.distribution == "lognormal":
+        # sigma=0.5, mu chosen so that the mean is `mean`
+        return random.lognormvariate(0, 0.5) * mean / 1.1331 if mean > 0 else 0.0
+    return mean
+
+
+def stub(name: str, port: int, endpoint: str, service_type: ServiceType, make_output):
+    @register_microservice(
+        name=f"bench_{name}", host="0.0.0.0", port=port, endpoint=endpoint, service_type=service_type
+    )
+    async def handler(request: Request):
+        data = await request.json()
+        await asyncio.sleep(sample_latency(name))
+        return make_output(data)
+
+    return opea_microservices[f"bench_{name}"]
+
+
+def llm_stub(port: int):
+    @register_microservice(
+        name="bench_llm", host="0.0.0.0", port=port, endpoint="/v1/chat/completions", service_type=ServiceType.LLM
+    )
+    async def handler(request: Request):
+        data = await request.json()
+        await asyncio.sleep(sample_latency("llm"))
+        if not data.get("streaming", True):
+            await asyncio.sleep(args.tokens / args.token_rate)
+            return {"text": " ".join(f"tok{i}" for i in range(args.tokens))}
+
+        async def stream():
+            for i in range(args.tokens):
+                if i:
+                    await asyncio.sleep(1 / args.token_rate)
+                yield f"data: {repr(f' tok{i}'.encode('utf-8'))}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return opea_microservices["bench_llm"]
+
+
+DOCUMENTS = [{"text": f"document {i} " + "lorem ipsum " * 40} for i in range(4)]
+AUDIO = base64.b64encode(b"\0" * 32000).decode()
+
+services = {
+    "embedding": stub(
+        "embedding",
+        args.port + 1,
+        "/v1/embeddings",
+        ServiceType.EMBEDDING,
+        lambda data: {"text": data["text"], "embedding": [0.1] * 768},
+    ),
+    "retriever": stub(
+        "retriever",
+        args.port + 2,
+        "/v1/retrieval",
+        ServiceType.RETRIEVER,
+        lambda data: {"initial_query": data["text"], "retrieved_docs": DOCUMENTS},
+    ),
+    "reranking": stub(
+        "reranking",
+        args.port + 3,
+        "/v1/reranking",
+        ServiceType.RERANK,
+        lambda data: {"query": data["initial_query"], "documents": [d["text"] for d in data["retrieved_docs"][:1]]},
+    ),
+    "llm": llm_stub(args.port + 4),
+    "asr": stub(
+        "asr", args.port + 5, "/v1/asr", ServiceType.ASR, lambda data: {"text": "what is the weather like today"}
+    ),
+    "tts": stub("tts", args.port + 6, "/v1/tts", ServiceType.TTS, lambda data: {"byte_str": AUDIO}),
+}
+
+PIPELINES = {
+    "chatqna": (["embedding", "retriever", "reranking", "llm"], ChatQnAGateway),
+    "docsum": (["llm"], DocSumGateway),
+    "audioqna": (["asr", "llm", "tts"], AudioQnAGateway),
+}
+
+
+def request_body(stream: bool) -> dict:
+    if args.pipeline == "chatqna":
+        return {"messages": "What is OPEA?", "stream": stream}
+    if args.pipeline == "docsum":
+        return {"type": "text", "messages": "lorem ipsum dolor sit amet " * 200, "stream": stream}
+    return {"audio": AUDIO}
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(len(values) * q / 100), len(values) - 1)] * 1000, 2)
+
+
+async def one_request(session, url, body, results):
+    start = time.perf_counter()
+    events = []
+    try:
+        async with session.post(url, json=body) as response:
+            if response.content_type == "text/event-stream":
+                async for line in response.content:
+                    if line.startswith(b"data:") and line.strip() != b"data: [DONE]":
+                        events.append(time.perf_counter())
+            else:
+                await response.read()
+            ok = response.status == 200
+    except aiohttp.ClientError:
+        ok = False
+    end = time.perf_counter()
+    if not ok:
+        results["errors"] += 1
+        return
+    results["latencies"].append(end - start)
+    if events:
+        results["ttft"].append(events[0] - start)
+        results["itl"] += [b - a for a, b in zip(events, events[1:])]
+
+
+async def closed_loop(session, url, body, concurrency, results):
+    deadline = time.perf_counter() + args.duration
+
+    async def client():
+        while time.perf_counter() < deadline:
+            await one_request(session, url, body, results)
+
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+
+
+async def open_loop(session, url, body, rate, results):
+    tasks = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.duration:
+        tasks.append(asyncio.create_task(one_request(session, url, body, results)))
+        await asyncio.sleep(random.expovariate(rate))
+    await asyncio.gather(*tasks)
+
+
+async def main(url):
+    await asyncio.sleep(2)
+    body = request_body(not args.no_stream)
+    levels = args.concurrency if args.mode == "closed" else args.rate
+    level_key = "concurrency" if args.mode == "closed" else "rate"
+    report = []
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+        await one_request(session, url, body, {"errors": 0, "latencies": [], "ttft": [], "itl": []})
+        for level in levels:
+            results = {"errors": 0, "latencies": [], "ttft": [], "itl": []}
+            start = time.perf_counter()
+            if args.mode == "closed":
+                await closed_loop(session, url, body, level, results)
+            else:
+                await open_loop(session, url, body, level, results)
+            elapsed = time.perf_counter() - start
+            report.append(
+                {
+                    level_key: level,
+                    "completed": len(results["latencies"]),
+                    "errors": results["errors"],
+                    "rps": round(len(results["latencies"]) / elapsed, 2),
+                    "p50_latency_ms": percentile(results["latencies"], 50),
+                    "p99_latency_ms": percentile(results["latencies"], 99),
+                    "p50_ttft_ms": percentile(results["ttft"], 50),
+                    "p99_ttft_ms": percentile(results["ttft"], 99),
+                    "p50_itl_ms": percentile(results["itl"], 50),
+                    "p99_itl_ms": percentile(results["itl"], 99),
+                }
+            )
+    result = {"args": vars(args), "levels": report}
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    stages, gateway_class = PIPELINES[args.pipeline]
+    orchestrator = ServiceOrchestrator()
+    for stage in stages:
+        services[stage].start()
+        orchestrator.add(services[stage])
+    for prev, cur in zip(stages, stages[1:]):
+        orchestrator.flow_to(services[prev], services[cur])
+    gateway = gateway_class(orchestrator, port=args.port)
+    try:
+        asyncio.run(main(f"http://localhost:{args.port}{gateway.endpoint}"))
+    finally:
+        gateway.stop()
+        for stage in stages:
+            services[stage].stop()
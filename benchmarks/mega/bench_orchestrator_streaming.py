@@ -0,0 +1,97 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Concurrent-stream throughput of ServiceOrchestrator (LLM streaming -> TTS-like downstream).
+
+Usage:
+    python benchmarks/mega/bench_orchestrator_streaming.py --concurrency 64 --tokens 40
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from comps import ServiceOrchestrator, ServiceType, opea_microservices, register_microservice
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--concurrency", type=int, default=64)
+parser.add_argument("--rounds", type=int, default=3)
+parser.add_argument("--tokens", type=int, default=40, help="tokens generated per stream")
+parser.add_argument("--sentence-len", type=int, default=8, help="tokens per sentence")
+parser.add_argument("--token-delay", type=float, default=0.01, help="seconds between LLM tokens")
+parser.add_argument("--downstream-delay", type=float, default=0.05, help="seconds per downstream call")
+parser.add_argument("--port", type=int, default=9380)
+args = parser.parse_args()
+
+
+@register_microservice(
+    name="bench_llm", host="0.0.0.0", port=args.port, endpoint="/v1/llm", service_type=ServiceType.LLM
+)
+async def bench_llm(request: Request):
+    async def stream():
+        for i in range(args.tokens):
+            await asyncio.sleep(args.token_delay)
+            token = f" tok{i}." if (i + 1) % args.sentence_len == 0 else f" tok{i}"
+            yield f"data: {repr(token.encode('utf-8'))}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@register_microservice(name="bench_tts", host="0.0.0.0", port=args.port + 1, endpoint="/v1/tts")
+async def bench_tts(request: Request):
+    data = json.loads(await request.body())
+    await asyncio.sleep(args.downstream_delay)
+    return {"text": data["text"]}
+
+
+async def one_stream(orchestrator):
+    start = time.perf_counter()
+    result_dict, _ = await orchestrator.schedule(initial_inputs={"text": "hello"})
+    response = next(r for r in result_dict.values() if isinstance(r, StreamingResponse))
+    first_token = None
+    events = 0
+    async for _ in response.body_iterator:
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        events += 1
+    return time.perf_counter() - start, first_token, events
+
+
+async def main(orchestrator):
+    await asyncio.sleep(2)
+    results = []
+    for _ in range(args.rounds):
+        start = time.perf_counter()
+        stats = await asyncio.gather(*[one_stream(orchestrator) for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - start
+        latencies = sorted(s[0] for s in stats)
+        ttfts = sorted(s[1] for s in stats)
+        results.append(
+            {
+                "elapsed_s": round(elapsed, 3),
+                "streams_per_s": round(args.concurrency / elapsed, 2),
+                "events_per_s": round(sum(s[2] for s in stats) / elapsed, 1),
+                "p50_latency_s": round(latencies[len(latencies) // 2], 3),
+                "p50_ttft_s": round(ttfts[len(ttfts) // 2], 3),
+            }
+        )
+    print(json.dumps({"args": vars(args), "rounds": results}, indent=2))
+
+
+if __name__ == "__main__":
+    llm, tts = opea_microservices["bench_llm"], opea_microservices["bench_tts"]
+    llm.start()
+    tts.start()
+    orchestrator = ServiceOrchestrator()
+    orchestrator.add(llm).add(tts)
+    orchestrator.flow_to(llm, tts)
+    try:
+        asyncio.run(main(orchestrator))
+    finally:
+        llm.stop()
+        tts.stop()
@@ -0,0 +1,100 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Per-message cost of the default vs the fast serialization path of the protocol classes.
+
+For each model type:
+- decode: a request body parsed with `json.loads` then validated, as FastAPI does, vs validated from the
+  raw bytes by a precompiled TypeAdapter (`MicroService(fast_serialization=True)`)
+- encode: a model result through `jsonable_encoder` + `json.dumps`, as FastAPI does without a response
+  model (e.g. the gateways), vs `model_dump_json()` (see comps/cores/mega/serialization.py)
+- forward: an already validated model sent by the orchestrator as `.dict()` + `json.dumps`, vs
+  `model_dump_json()` with the null fields excluded
+- reply: a JSON reply decoded by the orchestrator with `json.loads` vs `json_loads` (orjson when installed)
+
+Usage:
+    python benchmarks/mega/bench_proto_serialization.py --iterations 2000
+"""
+
+import argparse
+import json
+import random
+import time
+import warnings
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from comps import EmbedDoc, LLMParamsDoc, SearchedDoc, TextDoc
+from comps.cores.mega.serialization import json_loads, orjson
+from comps.cores.proto.api_protocol import ChatCompletionRequest
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--iterations", type=int, default=2000)
+parser.add_argument("--dims", type=int, default=768, help="EmbedDoc embedding size")
+args = parser.parse_args()
+# the orchestrator still calls the deprecated `.dict()`
+warnings.simplefilter("ignore", DeprecationWarning)
+
+PASSAGE = "OPEA microservices are composed into megaservices by the orchestrator. " * 8
+
+
+def messages():
+    return {
+        "TextDoc": TextDoc(text=PASSAGE),
+        "EmbedDoc": EmbedDoc(text="what is OPEA?", embedding=[random.uniform(-1, 1) for _ in range(args.dims)]),
+        "SearchedDoc": SearchedDoc(
+            retrieved_docs=[TextDoc(text=PASSAGE) for _ in range(4)], initial_query="what is OPEA?"
+        ),
+        "LLMParamsDoc": LLMParamsDoc(query="what is OPEA?", documents=[PASSAGE] * 4),
+        "ChatCompletionRequest": ChatCompletionRequest(
+            model="Intel/neural-chat-7b-v3-3",
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": PASSAGE},
+            ],
+            max_tokens=256,
+        ),
+    }
+
+
+def timed(fn):
+    fn()
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        fn()
+    return round((time.perf_counter() - start) / args.iterations * 1e6, 1)
+
+
+def measure(model):
+    cls = type(model)
+    adapter = TypeAdapter(cls)
+    body = model.model_dump_json(exclude_none=True)
+    exclude = {k for k, v in model if v is None}
+    return {
+        "bytes": len(body),
+        "decode_us": {
+            "default": timed(lambda: cls.model_validate(json.loads(body))),
+            "fast": timed(lambda: adapter.validate_json(body)),
+        },
+        "encode_us": {
+            "default": timed(lambda: json.dumps(jsonable_encoder(model))),
+            "fast": timed(lambda: model.model_dump_json(by_alias=True)),
+        },
+        "forward_us": {
+            "default": timed(lambda: json.dumps({k: v for k, v in model.dict().items() if v is not None})),
+            "fast": timed(lambda: model.model_dump_json(exclude=exclude)),
+        },
+        "reply_us": {"default": timed(lambda: json.loads(body)), "fast": timed(lambda: json_loads(body))},
+    }
+
+
+def main():
+    results = {"orjson": orjson is not None}
+    for name, model in messages().items():
+        results[name] = measure(model)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Per-request scheduling overhead of ServiceOrchestrator.schedule() for 5-50 node graphs.
+
+execute() is replaced by a no-op, so the numbers only contain DAG bookkeeping and task scheduling.
+
+Usage:
+    python benchmarks/mega/bench_schedule_overhead.py --requests 2000
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+from comps import ServiceOrchestrator, ServiceType
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--requests", type=int, default=2000)
+parser.add_argument("--sizes", type=int, nargs="+", default=[5, 10, 20, 50])
+args = parser.parse_args()
+
+
+class NoopOrchestrator(ServiceOrchestrator):
+    async def execute(self, session, req_start, cur_node, inputs, runtime_graph, llm_parameters=None, **kwargs):
+        return {"text": cur_node}, cur_node
+
+
+def build(shape: str, size: int) -> NoopOrchestrator:
+    orchestrator = NoopOrchestrator()
+    services = [SimpleNamespace(name=f"s{i}", service_type=ServiceType.UNDEFINED) for i in range(size)]
+    for service in services:
+        orchestrator.add(service)
+    if shape == "chain":
+        for prev, cur in zip(services, services[1:]):
+            orchestrator.flow_to(prev, cur)
+    else:
+        # layers of 5 nodes, every node feeds every node of the next layer
+        layers = [services[i : i + 5] for i in range(0, size, 5)]
+        for prev_layer, cur_layer in zip(layers, layers[1:]):
+            for prev in prev_layer:
+                for cur in cur_layer:
+                    orchestrator.flow_to(prev, cur)
+    return orchestrator
+
+
+async def main():
+    results = []
+    for shape in ["chain", "layered"]:
+        for size in args.sizes:
+            orchestrator = build(shape, size)
+            await orchestrator.schedule(initial_inputs={"text": "warmup"})
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                await orchestrator.schedule(initial_inputs={"text": "hello"})
+            elapsed = time.perf_counter() - start
+            results.append(
+                {
+                    "shape": shape,
+                    "nodes": size,
+                    "edges": sum(len(v) for v in orchestrator.graph.values()),
+                    "us_per_request": round(elapsed / args.requests * 1e6, 1),
+                }
+            )
+            await orchestrator.connection_pool.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
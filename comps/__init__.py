@@ -3,73 +3,105 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
-# Document
-from comps.cores.proto.docarray import (
-    Audio2TextDoc,
-    Base64ByteStrDoc,
-    DocPath,
-    EmbedDoc,
-    GeneratedDoc,
-    LLMParamsDoc,
-    SearchedDoc,
-    SearchedMultimodalDoc,
-    LVMSearchedMultimodalDoc,
-    RerankedDoc,
-    TextDoc,
-    MetadataTextDoc,
-    RAGASParams,
-    RAGASScores,
-    GraphDoc,
-    LVMDoc,
-    LVMVideoDoc,
-    ImagePath,
-    ImagesPath,
-    VideoPath,
-    ImageDoc,
-    SDInputs,
-    SDImg2ImgInputs,
-    SDOutputs,
-    TextImageDoc,
-    MultimodalDoc,
-    EmbedMultimodalDoc,
-    FactualityDoc,
-    ScoreDoc,
-    PIIRequestDoc,
-    PIIResponseDoc,
-    Audio2text,
-    DocSumDoc,
-)
+# The public names are imported on first access (PEP 562), so that `from comps import CustomLogger` does not
+# pull in FastAPI, docarray, aiohttp and all the gateways. See tests/cores/mega/test_import_time.py.
+import importlib
 
-# Constants
-from comps.cores.mega.constants import MegaServiceEndpoint, ServiceRoleType, ServiceType
+_EXPORTS = {
+    # Document
+    "comps.cores.proto.docarray": (
+        "Audio2TextDoc",
+        "Base64ByteStrDoc",
+        "DocPath",
+        "EmbedDoc",
+        "GeneratedDoc",
+        "LLMParamsDoc",
+        "SearchedDoc",
+        "SearchedMultimodalDoc",
+        "LVMSearchedMultimodalDoc",
+        "RerankedDoc",
+        "TextDoc",
+        "MetadataTextDoc",
+        "RAGASParams",
+        "RAGASScores",
+        "GraphDoc",
+        "LVMDoc",
+        "LVMVideoDoc",
+        "ImagePath",
+        "ImagesPath",
+        "VideoPath",
+        "ImageDoc",
+        "SDInputs",
+        "SDImg2ImgInputs",
+        "SDOutputs",
+        "TextImageDoc",
+        "MultimodalDoc",
+        "EmbedMultimodalDoc",
+        "FactualityDoc",
+        "ScoreDoc",
+        "PIIRequestDoc",
+        "PIIResponseDoc",
+        "Audio2text",
+        "DocSumDoc",
+    ),
+    # Constants
+    "comps.cores.mega.constants": ("MegaServiceEndpoint", "ServiceRoleType", "ServiceType"),
+    # Microservice
+    "comps.cores.mega.orchestrator": ("ServiceOrchestrator",),
+    "comps.cores.mega.orchestrator_with_yaml": ("ServiceOrchestratorWithYaml",),
+    "comps.cores.mega.load_balancer": ("ReplicaSet",),
+    "comps.cores.mega.micro_service": ("MicroService", "register_microservice", "opea_microservices"),
+    "comps.cores.mega.streaming": ("sse_response",),
+    "comps.cores.mega.gateway": (
+        "Gateway",
+        "ChatQnAGateway",
+        "CodeGenGateway",
+        "CodeTransGateway",
+        "DocSumGateway",
+        "TranslationGateway",
+        "SearchQnAGateway",
+        "AudioQnAGateway",
+        "RetrievalToolGateway",
+        "FaqGenGateway",
+        "VideoQnAGateway",
+        "VisualQnAGateway",
+        "MultimodalQnAGateway",
+        "GraphragGateway",
+        "AvatarChatbotGateway",
+    ),
+    # Admission control
+    "comps.cores.mega.admission": ("AdmissionController", "AdmissionRejected"),
+    # Cache
+    "comps.cores.mega.cache": ("BaseCache", "InMemoryCache", "RedisCache"),
+    "comps.cores.mega.embedding_cache": (
+        "EmbeddingCache",
+        "SQLiteEmbeddingCache",
+        "RedisEmbeddingCache",
+        "CachedEmbeddings",
+        "cached_embeddings",
+        "get_embedding_cache",
+    ),
+    # Telemetry
+    "comps.cores.telemetry.opea_telemetry": ("opea_telemetry",),
+    # Statistics
+    "comps.cores.mega.base_statistics": ("statistics_dict", "register_statistics"),
+    # Logger
+    "comps.cores.mega.logger": ("CustomLogger",),
+}
 
-# Microservice
-from comps.cores.mega.orchestrator import ServiceOrchestrator
-from comps.cores.mega.orchestrator_with_yaml import ServiceOrchestratorWithYaml
-from comps.cores.mega.micro_service import MicroService, register_microservice, opea_microservices
-from comps.cores.mega.gateway import (
-    Gateway,
-    ChatQnAGateway,
-    CodeGenGateway,
-    CodeTransGateway,
-    DocSumGateway,
-    TranslationGateway,
-    SearchQnAGateway,
-    AudioQnAGateway,
-    RetrievalToolGateway,
-    FaqGenGateway,
-    VideoQnAGateway,
-    VisualQnAGateway,
-    MultimodalQnAGateway,
-    GraphragGateway,
-    AvatarChatbotGateway,
-)
+_LAZY_IMPORTS = {name: module for module, names in _EXPORTS.items() for name in names}
 
-# Telemetry
-from comps.cores.telemetry.opea_telemetry import opea_telemetry
+__all__ = list(_LAZY_IMPORTS)
 
-# Statistics
-from comps.cores.mega.base_statistics import statistics_dict, register_statistics
 
-# Logger
-from comps.cores.mega.logger import CustomLogger
+def __getattr__(name):
+    module = _LAZY_IMPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,212 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from typing import Dict, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+PRIORITY_HEADER = "x-priority-class"
+
+
+class AdmissionMetrics:
+    # Metrics are class members for the same reasons as OrchestratorMetrics,
+    # limited endpoints are told apart with the "service" and "endpoint" labels
+    inflight = Gauge("admission_requests_inflight", "Requests being served (gauge)", ["service", "endpoint"])
+    queued = Gauge("admission_requests_queued", "Requests waiting for a slot (gauge)", ["service", "endpoint"])
+    limit = Gauge("admission_max_concurrency", "Max concurrent requests (gauge)", ["service", "endpoint"])
+    rejected = Counter(
+        "admission_requests_rejected",
+        "Count of requests rejected by the admission control (counter)",
+        ["service", "endpoint", "reason"],
+    )
+    queue_latency = Histogram(
+        "admission_queue_latency",
+        "Time an admitted request waited for a slot (histogram)",
+        ["service", "endpoint"],
+        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+    )
+
+    def __init__(self, controller: "AdmissionController", service: str, endpoint: str) -> None:
+        self.labels = (service, endpoint)
+        self.inflight.labels(*self.labels).set_function(lambda: controller.inflight)
+        self.queued.labels(*self.labels).set_function(lambda: controller.queued)
+        self.limit.labels(*self.labels).set(controller.max_concurrency)
+
+    def reject_update(self, reason: str) -> None:
+        self.rejected.labels(*self.labels, reason).inc()
+
+    def admit_update(self, wait_start: float) -> None:
+        self.queue_latency.labels(*self.labels).observe(time.monotonic() - wait_start)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted, answered with `status_code` and a Retry-After header."""
+
+    def __init__(self, detail: str, status_code: int, retry_after: int):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bound the requests served concurrently by an endpoint, the others wait in a bounded priority queue.
+
+    A request is admitted while less than `max_concurrency` requests are served, otherwise it waits for a
+    slot in a queue of at most `max_queue_size` requests, served by priority then in arrival order. Requests
+    are rejected fast instead of piling up behind a slow backend:
+    - 429 when the queue is full, unless a waiting request of a lower priority can be shed to make room,
+    - 503 for a shed request or one which waited more than `queue_timeout` seconds.
+    Both carry a Retry-After header estimated from the queue length and the recent service time.
+
+    The priority class of a request is the class of its API key (`Authorization: Bearer <key>`) in
+    `api_key_classes`, else the value of its `X-Priority-Class` header. `priority_classes` maps the class
+    names to priorities, the higher the sooner, unknown classes get priority 0.
+
+    `pending_gauge` also counts the waiting requests, e.g. the megaservice_request_pending gauge of the
+    gateway. The limits apply per process, each worker of a multi-worker microservice has its own.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue_size: int = 0,
+        queue_timeout: Optional[float] = None,
+        priority_classes: Optional[Dict[str, int]] = None,
+        api_key_classes: Optional[Dict[str, str]] = None,
+        pending_gauge: Optional[Gauge] = None,
+    ):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.queue_timeout = queue_timeout
+        self.priority_classes = priority_classes or {}
+        self.api_key_classes = api_key_classes or {}
+        self.pending_gauge = pending_gauge
+        self.inflight = 0
+        self.queued = 0
+        self.service_time = None  # moving average of the seconds a request holds its slot
+        self._queue = []  # heap of [-priority, arrival, future], entries of gone requests are skipped
+        self._arrivals = itertools.count()
+        self.metrics = None
+
+    @classmethod
+    def from_env(cls, prefix: str, pending_gauge: Optional[Gauge] = None) -> Optional["AdmissionController"]:
+        """Controller configured by the `<prefix>_MAX_CONCURRENCY`, `<prefix>_MAX_QUEUE_SIZE`,
+        `<prefix>_QUEUE_TIMEOUT`, `<prefix>_PRIORITY_CLASSES` ("interactive:10,batch:-10") and
+        `<prefix>_PRIORITY_API_KEYS` ("<key>:interactive,...") variables, None when the concurrency is
+        not limited."""
+        max_concurrency = int(os.getenv(f"{prefix}_MAX_CONCURRENCY", 0))
+        if max_concurrency <= 0:
+            return None
+        queue_timeout = os.getenv(f"{prefix}_QUEUE_TIMEOUT")
+
+        def pairs(variable):
+            items = [item.rsplit(":", 1) for item in os.getenv(variable, "").split(",") if item.strip()]
+            return {key.strip(): value.strip() for key, value in items}
+
+        return cls(
+            max_concurrency,
+            max_queue_size=int(os.getenv(f"{prefix}_MAX_QUEUE_SIZE", 0)),
+            queue_timeout=float(queue_timeout) if queue_timeout else None,
+            priority_classes={name: int(p) for name, p in pairs(f"{prefix}_PRIORITY_CLASSES").items()},
+            api_key_classes=pairs(f"{prefix}_PRIORITY_API_KEYS"),
+            pending_gauge=pending_gauge,
+        )
+
+    def bind(self, service: str, endpoint: str) -> None:
+        """Label the metrics of the controller with the endpoint it limits."""
+        self.metrics = AdmissionMetrics(self, service, endpoint)
+
+    def priority(self, headers: Dict[str, str]) -> int:
+        """Priority of a request from its lower-cased headers."""
+        authorization = headers.get("authorization", "")
+        priority_class = None
+        if authorization.startswith("Bearer "):
+            priority_class = self.api_key_classes.get(authorization[len("Bearer ") :])
+        if priority_class is None:
+            priority_class = headers.get(PRIORITY_HEADER)
+        return self.priority_classes.get(priority_class, 0)
+
+    def retry_after(self) -> int:
+        """Seconds until the queue is expected to be drained, at least 1."""
+        if self.service_time is None:
+            return 1
+        return max(1, math.ceil((self.queued + 1) * self.service_time / self.max_concurrency))
+
+    def _reject(self, detail: str, status_code: int, reason: str) -> AdmissionRejected:
+        if self.metrics:
+            self.metrics.reject_update(reason)
+        return AdmissionRejected(detail, status_code, self.retry_after())
+
+    def _shed_lowest(self, priority: int) -> bool:
+        """Reject the latest waiting request of the lowest priority if it is lower than `priority`."""
+        waiting = [entry for entry in self._queue if not entry[2].done()]
+        if not waiting:
+            return False
+        lowest = max(waiting, key=lambda entry: (entry[0], entry[1]))
+        if -lowest[0] >= priority:
+            return False
+        lowest[2].set_exception(self._reject("Shed by a request of a higher priority", 503, "shed"))
+        return True
+
+    async def acquire(self, priority: int = 0) -> None:
+        """Wait for a slot, raises AdmissionRejected when the request is not admitted."""
+        # a slot is only free when no request is waiting, release() hands the slots over
+        if self.inflight < self.max_concurrency:
+            self.inflight += 1
+            return
+        if sum(not entry[2].done() for entry in self._queue) >= self.max_queue_size:
+            if not self._shed_lowest(priority):
+                raise self._reject("Too many requests", 429, "queue_full")
+        wait_start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, [-priority, next(self._arrivals), future])
+        self.queued += 1
+        if self.pending_gauge is not None:
+            self.pending_gauge.inc()
+        try:
+            await asyncio.wait({future}, timeout=self.queue_timeout)
+            if not future.done():
+                future.cancel()
+                raise self._reject("Timed out waiting to be served", 503, "queue_timeout")
+            # raises AdmissionRejected when the request was shed
+            future.result()
+        except asyncio.CancelledError:
+            # the client went away, a slot handed over meanwhile is passed on
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            future.cancel()
+            raise
+        finally:
+            self.queued -= 1
+            if self.pending_gauge is not None:
+                self.pending_gauge.dec()
+            self._compact()
+        if self.metrics:
+            self.metrics.admit_update(wait_start)
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        """Free the slot of a served request, it is handed over to the first waiting request."""
+        if service_time is not None:
+            self.service_time = (
+                service_time if self.service_time is None else 0.9 * self.service_time + 0.1 * service_time
+            )
+        while self._queue:
+            future = heapq.heappop(self._queue)[2]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.inflight -= 1
+
+    def _compact(self) -> None:
+        if len(self._queue) > 2 * self.queued + 8:
+            self._queue = [entry for entry in self._queue if not entry[2].done()]
+            heapq.heapify(self._queue)
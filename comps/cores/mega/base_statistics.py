@@ -1,67 +1,207 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
-import numpy as np
+import asyncio
+import json
+import math
+import os
+import time
 
 # name => statistic dict
 statistics_dict = {}
+# directory shared by the workers of a multi-worker microservice, see set_statistics_dir()
+statistics_dir = None
+_dumped_versions = {}  # name => version of the statistic last written by this worker
+_shared_statistics = {}  # file name => (file stamp, {name: BaseStatistics}) of the other workers
+
+# sliding windows reported next to the all-time statistics, name => seconds
+WINDOWS = {"1m": 60, "5m": 300, "1h": 3600}
+SLOT_SECONDS = 10  # time granularity of the windows
+
+
+class LatencySketch:
+    """Constant-memory distribution of latencies with a bounded relative error on its quantiles.
+
+    Values are counted in logarithmic buckets (as in HDR histograms or DDSketch): bucket `k` holds the
+    values in (GAMMA^(k-1), GAMMA^k], so any quantile is estimated within 1% and sketches are merged
+    by adding their bucket counts.
+    """
+
+    GAMMA = 1.02
+    MIN_VALUE = 1e-6  # smaller values, e.g. 0, are counted in the bucket of MIN_VALUE
+
+    def __init__(self):
+        self.buckets = {}  # bucket index => count
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float):
+        index = math.ceil(math.log(max(value, self.MIN_VALUE)) / math.log(self.GAMMA))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "LatencySketch"):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+        for bound, pick in (("min", min), ("max", max)):
+            value = getattr(other, bound)
+            if value is not None:
+                setattr(self, bound, value if getattr(self, bound) is None else pick(getattr(self, bound), value))
+
+    def quantile(self, q: float):
+        if not self.count:
+            return None
+        if q >= 1:
+            return self.max
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # middle of the bucket, clamped by the exact extremes
+                value = 2 * self.GAMMA**index / (self.GAMMA + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def average(self):
+        return self.sum / self.count if self.count else None
+
+    def state(self) -> dict:
+        return {"buckets": self.buckets, "count": self.count, "sum": self.sum, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "LatencySketch":
+        sketch = cls()
+        # JSON turned the bucket indexes into strings
+        sketch.buckets = {int(index): count for index, count in state["buckets"].items()}
+        sketch.count, sketch.sum, sketch.min, sketch.max = state["count"], state["sum"], state["min"], state["max"]
+        return sketch
+
+
+class SlidingLatencySketch:
+    """All-time LatencySketch plus one sketch per SLOT_SECONDS time slot of the longest window."""
+
+    def __init__(self):
+        self.total = LatencySketch()
+        self.slots = {}  # slot index (time // SLOT_SECONDS) => LatencySketch
+
+    def add(self, value: float, now: float = None):
+        slot = int((now if now is not None else time.time()) // SLOT_SECONDS)
+        self.total.add(value)
+        if slot not in self.slots:
+            self.slots[slot] = LatencySketch()
+            self._expire(slot)
+        self.slots[slot].add(value)
+
+    def _expire(self, slot: int):
+        oldest = slot - max(WINDOWS.values()) // SLOT_SECONDS
+        for expired in [s for s in self.slots if s < oldest]:
+            del self.slots[expired]
+
+    def window(self, seconds: float, now: float = None) -> LatencySketch:
+        """Sketch of the values added in the last `seconds`, rounded up to whole slots."""
+        oldest = int(((now if now is not None else time.time()) - seconds) // SLOT_SECONDS)
+        sketch = LatencySketch()
+        for slot, slot_sketch in self.slots.items():
+            if slot >= oldest:
+                sketch.merge(slot_sketch)
+        return sketch
+
+    def merge(self, other: "SlidingLatencySketch"):
+        self.total.merge(other.total)
+        for slot, slot_sketch in other.slots.items():
+            self.slots.setdefault(slot, LatencySketch()).merge(slot_sketch)
+        if self.slots:
+            self._expire(max(self.slots))
+
+    def state(self) -> dict:
+        return {"total": self.total.state(), "slots": {slot: s.state() for slot, s in self.slots.items()}}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "SlidingLatencySketch":
+        sketch = cls()
+        sketch.total = LatencySketch.from_state(state["total"])
+        sketch.slots = {int(slot): LatencySketch.from_state(s) for slot, s in state["slots"].items()}
+        return sketch
 
 
 class BaseStatistics:
-    """Base class to store in-memory statistics of an entity for measurement in one service."""
+    """Base class to store in-memory statistics of an entity for measurement in one service.
+
+    Memory is bounded: latencies are kept in sketches, for all time and for the sliding `WINDOWS`.
+    """
 
     def __init__(
         self,
     ):
-        self.response_times = []  # store responses time for all requests
-        self.first_token_latencies = []  # store first token latencies for all requests
+        self.response_times = SlidingLatencySketch()  # responses time of the requests
+        self.first_token_latencies = SlidingLatencySketch()  # first token latencies of streamed requests
+        self.inter_token_latencies = SlidingLatencySketch()  # latencies between two streamed tokens
+        self.version = 0  # incremented on every change, to only share changed statistics
 
-    def append_latency(self, latency, first_token_latency=None):
-        self.response_times.append(latency)
+    def append_latency(self, latency, first_token_latency=None, inter_token_latencies=None):
+        now = time.time()
+        self.response_times.add(latency, now)
         if first_token_latency:
-            self.first_token_latencies.append(first_token_latency)
+            self.first_token_latencies.add(first_token_latency, now)
+        for inter_token_latency in inter_token_latencies or []:
+            self.inter_token_latencies.add(inter_token_latency, now)
+        self.version += 1
 
-    def calculate_statistics(self):
-        if not self.response_times:
-            return {
-                "p50_latency": None,
-                "p99_latency": None,
-                "average_latency": None,
-            }
-        # Calculate the P50 (median)
-        p50 = np.percentile(self.response_times, 50)
+    def _sketches(self):
+        return {
+            "response_times": self.response_times,
+            "first_token_latencies": self.first_token_latencies,
+            "inter_token_latencies": self.inter_token_latencies,
+        }
 
-        # Calculate the P99
-        p99 = np.percentile(self.response_times, 99)
+    def state(self) -> dict:
+        """JSON serializable state, merged by the workers of a multi-worker microservice."""
+        return {key: sketch.state() for key, sketch in self._sketches().items()}
 
-        avg = np.average(self.response_times)
+    def merge(self, state: dict):
+        for key, sketch in self._sketches().items():
+            sketch.merge(SlidingLatencySketch.from_state(state[key]))
+        self.version += 1
 
-        return {
-            "p50_latency": p50,
-            "p99_latency": p99,
-            "average_latency": avg,
-        }
+    @staticmethod
+    def _summary(sketch: LatencySketch, suffix: str = "", quantiles=(50, 99)) -> dict:
+        result = {f"p{q}_latency{suffix}": sketch.quantile(q / 100) for q in quantiles}
+        result[f"average_latency{suffix}"] = sketch.average()
+        return result
 
-    def calculate_first_token_statistics(self):
-        if not self.first_token_latencies:
-            return {
-                "p50_latency_first_token": None,
-                "p99_latency_first_token": None,
-                "average_latency_first_token": None,
-            }
-        # Calculate the P50 (median)
-        p50 = np.percentile(self.first_token_latencies, 50)
+    def calculate_statistics(self):
+        return self._summary(self.response_times.total)
 
-        # Calculate the P99
-        p99 = np.percentile(self.first_token_latencies, 99)
+    def calculate_first_token_statistics(self):
+        return self._summary(self.first_token_latencies.total, "_first_token")
 
-        avg = np.average(self.first_token_latencies)
+    def calculate_inter_token_statistics(self):
+        return self._summary(self.inter_token_latencies.total, "_inter_token")
 
-        return {
-            "p50_latency_first_token": p50,
-            "p99_latency_first_token": p99,
-            "average_latency_first_token": avg,
-        }
+    def calculate_window_statistics(self, now: float = None):
+        """p50/p90/p99/max latencies and throughput (requests per second) of each sliding window."""
+        now = now if now is not None else time.time()
+        results = {}
+        for window, seconds in WINDOWS.items():
+            responses = self.response_times.window(seconds, now)
+            result = {"requests": responses.count, "throughput": responses.count / seconds}
+            for sketch, suffix in (
+                (responses, ""),
+                (self.first_token_latencies.window(seconds, now), "_first_token"),
+                (self.inter_token_latencies.window(seconds, now), "_inter_token"),
+            ):
+                result.update(self._summary(sketch, suffix, quantiles=(50, 90, 99)))
+                result[f"max_latency{suffix}"] = sketch.max
+            results[window] = result
+        return results
 
 
 def register_statistics(
@@ -75,11 +215,83 @@ def register_statistics(
     return decorator
 
 
+def set_statistics_dir(directory):
+    """Share the statistics of this process with the other workers through files in `directory`."""
+    global statistics_dir
+    statistics_dir = directory
+    _dumped_versions.clear()
+    _shared_statistics.clear()
+
+
+def dump_statistics():
+    """Write the statistics of this worker to its file if they changed since the last dump.
+
+    The state of a statistic is bounded, so the whole file is rewritten and replaced atomically.
+    """
+    if statistics_dir is None:
+        return
+    versions = {name: statistic.version for name, statistic in statistics_dict.items()}
+    if versions == _dumped_versions:
+        return
+    states = {name: statistic.state() for name, statistic in statistics_dict.items()}
+    path = os.path.join(statistics_dir, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(states, f)
+    os.replace(path + ".tmp", path)
+    _dumped_versions.clear()
+    _dumped_versions.update(versions)
+
+
+async def dump_statistics_periodically(interval: float = 1.0):
+    while True:
+        dump_statistics()
+        await asyncio.sleep(interval)
+
+
+def _read_shared_statistics():
+    """Reload the files of the other workers which changed since the last call, files of stopped workers are
+    kept."""
+    own_file = f"{os.getpid()}.json"
+    for file_name in os.listdir(statistics_dir):
+        if not file_name.endswith(".json") or file_name == own_file:
+            continue
+        path = os.path.join(statistics_dir, file_name)
+        try:
+            stat = os.stat(path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if file_name in _shared_statistics and _shared_statistics[file_name][0] == stamp:
+                continue
+            with open(path) as f:
+                states = json.load(f)
+        except (OSError, ValueError):
+            continue
+        statistics = {}
+        for name, state in states.items():
+            statistics[name] = BaseStatistics()
+            statistics[name].merge(state)
+        _shared_statistics[file_name] = (stamp, statistics)
+
+
+def merged_statistics():
+    """Statistics of this process merged with the ones shared by the other workers."""
+    if statistics_dir is None:
+        return statistics_dict
+    _read_shared_statistics()
+    merged = {}
+    sources = [statistics_dict] + [statistics for _, statistics in _shared_statistics.values()]
+    for source in sources:
+        for name, statistic in source.items():
+            merged.setdefault(name, BaseStatistics()).merge(statistic.state())
+    return merged
+
+
 def collect_all_statistics():
     results = {}
     if statistics_dict:
-        for name, statistic in statistics_dict.items():
+        for name, statistic in merged_statistics().items():
             tmp_dict = statistic.calculate_statistics()
             tmp_dict.update(statistic.calculate_first_token_statistics())
+            tmp_dict.update(statistic.calculate_inter_token_statistics())
+            tmp_dict["windows"] = statistic.calculate_window_statistics()
             results.update({name: tmp_dict})
     return results
@@ -0,0 +1,185 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from prometheus_client import Counter, Gauge
+
+from .logger import CustomLogger
+
+logger = CustomLogger("comps-core-cache")
+LOGFLAG = os.getenv("LOGFLAG", False)
+
+
+class CacheMetrics:
+    # Metrics are class members for the same reasons as OrchestratorMetrics,
+    # caches are told apart with the "cache" label
+    hits = Counter("megaservice_cache_hits", "Count of cache hits (counter)", ["cache"])
+    misses = Counter("megaservice_cache_misses", "Count of cache misses (counter)", ["cache"])
+    evictions = Counter("megaservice_cache_evictions", "Count of entries evicted or expired (counter)", ["cache"])
+    size = Gauge("megaservice_cache_size_bytes", "Size of the cached values, when tracked (gauge)", ["cache"])
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def hit_update(self, hit: bool) -> None:
+        if hit:
+            self.hits.labels(self.name).inc()
+        else:
+            self.misses.labels(self.name).inc()
+
+    def eviction_update(self, count: int = 1) -> None:
+        self.evictions.labels(self.name).inc(count)
+
+    def size_update(self, nbytes: int) -> None:
+        self.size.labels(self.name).set(nbytes)
+
+
+class BaseCache:
+    """Base class of the key-value caches used by the megaservice."""
+
+    def __init__(self, name: str = "response", ttl: Optional[float] = None):
+        """:param name: name of the cache, used as "cache" label of the metrics.
+        :param ttl: default time to live of an entry in seconds, None means no expiry.
+        """
+        self.name = name
+        self.ttl = ttl
+        self.metrics = CacheMetrics(name)
+
+    def rename(self, name: str) -> None:
+        """Change the name of the cache, e.g. to label an unnamed node cache after its node."""
+        self.name = name
+        self.metrics = CacheMetrics(name)
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Return the cached value or None."""
+        raise NotImplementedError("Subclasses must implement this method")
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError("Subclasses must implement this method")
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError("Subclasses must implement this method")
+
+    async def clear(self) -> None:
+        raise NotImplementedError("Subclasses must implement this method")
+
+
+class InMemoryCache(BaseCache):
+    """Size bounded LRU cache with per-entry expiry, local to the process.
+
+    With `max_bytes`, the values must support len() (e.g. bytes or str) and the least recently used
+    entries are also evicted once their total length exceeds it.
+    """
+
+    def __init__(
+        self,
+        name: str = "response",
+        max_size: int = 1024,
+        ttl: Optional[float] = 3600,
+        max_bytes: Optional[int] = None,
+    ):
+        super().__init__(name, ttl)
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.nbytes = 0  # total length of the values, only tracked with max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _size(self, value: Any) -> int:
+        return len(value) if self.max_bytes is not None else 0
+
+    def _pop(self, key: str) -> None:
+        self.nbytes -= self._size(self._entries.pop(key)[1])
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is not None and entry[0] < time.monotonic():
+            self._pop(key)
+            self.metrics.eviction_update()
+            entry = None
+        self.metrics.hit_update(entry is not None)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = ttl if ttl is not None else self.ttl
+        if key in self._entries:
+            self._pop(key)
+        self._entries[key] = (time.monotonic() + ttl if ttl is not None else None, value)
+        self.nbytes += self._size(value)
+        while len(self._entries) > self.max_size or (self.max_bytes is not None and self.nbytes > self.max_bytes):
+            # the least recently used entry
+            self._pop(next(iter(self._entries)))
+            self.metrics.eviction_update()
+
+    async def delete(self, key: str) -> None:
+        if key in self._entries:
+            self._pop(key)
+
+    async def clear(self) -> None:
+        self._entries.clear()
+        self.nbytes = 0
+
+
+class RedisCache(BaseCache):
+    """Cache shared by several processes or replicas, stored in Redis.
+
+    Values must be JSON serializable. The size bound is enforced by Redis itself, e.g. with
+    `maxmemory` and `maxmemory-policy allkeys-lru`, so evictions are not counted here.
+    """
+
+    def __init__(
+        self,
+        name: str = "response",
+        url: str = os.getenv("REDIS_URL", "redis://localhost:6379"),
+        ttl: Optional[float] = 3600,
+        prefix: str = "opea:cache:",
+    ):
+        super().__init__(name, ttl)
+        self.url = url
+        self.key_prefix = prefix
+        self.prefix = f"{prefix}{name}:"
+        self._client = None
+
+    def rename(self, name: str) -> None:
+        super().rename(name)
+        self.prefix = f"{self.key_prefix}{name}:"
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis.asyncio as redis
+
+            self._client = redis.from_url(self.url)
+        return self._client
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = await self.client.get(self.prefix + key)
+        self.metrics.hit_update(value is not None)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = ttl if ttl is not None else self.ttl
+        try:
+            data = json.dumps(value)
+        except TypeError as e:
+            if LOGFLAG:
+                logger.info(f"skip caching a value that is not JSON serializable: {e}")
+            return
+        await self.client.set(self.prefix + key, data, px=int(ttl * 1000) if ttl is not None else None)
+
+    async def delete(self, key: str) -> None:
+        await self.client.delete(self.prefix + key)
+
+    async def clear(self) -> None:
+        async for key in self.client.scan_iter(match=self.prefix + "*"):
+            await self.client.delete(key)
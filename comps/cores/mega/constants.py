@@ -67,6 +67,7 @@ class MegaServiceEndpoint(Enum):
     # COMMON
     LIST_SERVICE = "/v1/list_service"
     LIST_PARAMETERS = "/v1/list_parameters"
+    INVALIDATE_CACHE = "/v1/invalidate_cache"
 
     def __str__(self):
         return self.value
@@ -2,7 +2,6 @@
 # SPDX-License-Identifier: Apache-2.0
 
 from collections import OrderedDict, defaultdict
-from copy import deepcopy
 
 
 class DAG(object):
@@ -14,6 +13,7 @@ class DAG(object):
         if node_name in graph:
             raise KeyError("node %s already exists" % node_name)
         graph[node_name] = set()
+        self._plan = None
 
     def add_node_if_not_exists(self, node_name):
         try:
@@ -30,6 +30,7 @@ class DAG(object):
         for node, edges in graph.items():
             if node_name in edges:
                 edges.remove(node_name)
+        self._plan = None
 
     def delete_node_if_exists(self, node_name):
         try:
@@ -41,19 +42,29 @@ class DAG(object):
         graph = self.graph
         if ind_node not in graph or dep_node not in graph:
             raise KeyError("one or more nodes do not exist in graph")
-        test_graph = deepcopy(graph)
-        test_graph[ind_node].add(dep_node)
-        is_valid = self.validate(test_graph)
-        if is_valid:
-            graph[ind_node].add(dep_node)
-        else:
+        # the new edge closes a cycle iff ind_node is already reachable from dep_node
+        if ind_node == dep_node or ind_node in self._reachable(dep_node):
             raise Exception("validation error!")
+        graph[ind_node].add(dep_node)
+        self._plan = None
 
     def delete_edge(self, ind_node, dep_node):
         graph = self.graph
         if dep_node not in graph.get(ind_node, []):
             raise KeyError("this edge does not exist in graph")
         graph[ind_node].remove(dep_node)
+        self._plan = None
+
+    def _reachable(self, node):
+        graph = self.graph
+        seen = set()
+        stack = [node]
+        while stack:
+            for downstream_node in graph[stack.pop()]:
+                if downstream_node not in seen:
+                    seen.add(downstream_node)
+                    stack.append(downstream_node)
+        return seen
 
     def predecessors(self, node):
         graph = self.graph
@@ -95,6 +106,13 @@ class DAG(object):
 
     def reset_graph(self):
         self.graph = OrderedDict()
+        self._plan = None
+
+    def compile(self):
+        """Get the ExecutionPlan of the current graph, it is rebuilt only after the graph changed."""
+        if self._plan is None:
+            self._plan = ExecutionPlan(self.graph)
+        return self._plan
 
     def ind_nodes(self, graph=None):
         graph = graph if graph is not None else self.graph
@@ -140,3 +158,106 @@ class DAG(object):
 
     def size(self):
         return len(self.graph)
+
+
+class ExecutionPlan(object):
+    """Immutable, precompiled form of a DAG.
+
+    Nodes are kept in their insertion order and addressed by index, successors/predecessors are index tuples.
+    """
+
+    def __init__(self, graph):
+        self.nodes = tuple(graph.keys())
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+        self.successors = tuple(tuple(self.index[v] for v in graph[u]) for u in self.nodes)
+        predecessors = [[] for _ in self.nodes]
+        for u, successors in enumerate(self.successors):
+            for v in successors:
+                predecessors[v].append(u)
+        self.predecessors = tuple(tuple(p) for p in predecessors)
+        self.in_degree = tuple(len(p) for p in self.predecessors)
+        self.ind_nodes = tuple(i for i, degree in enumerate(self.in_degree) if degree == 0)
+
+
+class RuntimeDAG(DAG):
+    """Per-request overlay of an ExecutionPlan.
+
+    It only records the edges and nodes pruned while serving one request. The full `graph` is materialized lazily,
+    the first time a method without a fast path needs it.
+    """
+
+    def __init__(self, plan: ExecutionPlan):
+        self.plan = plan
+        self.pruned_edges = set()  # {(ind index, dep index)}
+        self.pruned_nodes = set()  # {node index}
+        self.status = {}  # node -> HTTP status of its reply
+        self._graph = None
+        self._plan = None
+
+    @property
+    def graph(self):
+        if self._graph is None:
+            plan = self.plan
+            graph = OrderedDict()
+            for u, node in enumerate(plan.nodes):
+                if u not in self.pruned_nodes:
+                    graph[node] = {plan.nodes[v] for v in self._successors(u)}
+            self._graph = graph
+        return self._graph
+
+    @graph.setter
+    def graph(self, graph):
+        self._graph = graph
+
+    def _successors(self, u):
+        return [v for v in self.plan.successors[u] if v not in self.pruned_nodes and (u, v) not in self.pruned_edges]
+
+    def delete_edge(self, ind_node, dep_node):
+        if self._graph is not None:
+            return super().delete_edge(ind_node, dep_node)
+        index = self.plan.index
+        u, v = index.get(ind_node), index.get(dep_node)
+        if u is None or v is None or u in self.pruned_nodes or v not in self._successors(u):
+            raise KeyError("this edge does not exist in graph")
+        self.pruned_edges.add((u, v))
+
+    def downstream(self, node) -> list:
+        if self._graph is not None:
+            return super().downstream(node)
+        u = self.plan.index.get(node)
+        if u is None or u in self.pruned_nodes:
+            raise KeyError("node %s is not in graph" % node)
+        return [self.plan.nodes[v] for v in self._successors(u)]
+
+    def predecessors(self, node):
+        if self._graph is not None:
+            return super().predecessors(node)
+        v = self.plan.index[node]
+        return [
+            self.plan.nodes[u]
+            for u in self.plan.predecessors[v]
+            if u not in self.pruned_nodes and (u, v) not in self.pruned_edges
+        ]
+
+    def all_leaves(self):
+        if self._graph is not None:
+            return super().all_leaves()
+        return [
+            node for u, node in enumerate(self.plan.nodes) if u not in self.pruned_nodes and not self._successors(u)
+        ]
+
+    def prune_unreachable(self):
+        """Drop the nodes that cannot be reached from an independent node of the plan anymore."""
+        reachable = {self.plan.nodes[u] for u in self.plan.ind_nodes}
+        stack = list(reachable)
+        while stack:
+            for downstream_node in self.downstream(stack.pop()):
+                if downstream_node not in reachable:
+                    reachable.add(downstream_node)
+                    stack.append(downstream_node)
+        for u, node in enumerate(self.plan.nodes):
+            if node not in reachable:
+                if self._graph is not None:
+                    self.delete_node_if_exists(node)
+                else:
+                    self.pruned_nodes.add(u)
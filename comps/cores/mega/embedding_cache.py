@@ -0,0 +1,385 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Persistent cache of the embeddings, shared by the dataprep, embedding and retriever microservices.
+
+An embedding is keyed by the id of the model and the hash of the normalized text (Unicode NFC, whitespace
+collapsed), so a chunk ingested again or a query asked again is not sent to the embedding model. The cache is
+selected with `EMBEDDING_CACHE`:
+
+- "sqlite": a SQLite file at `EMBEDDING_CACHE_PATH`, local to the host, several processes may share it
+- "redis": the Redis server at `EMBEDDING_CACHE_REDIS_URL`, shared by all the services and replicas
+- unset: no cache
+
+Both evict the least recently used embeddings once the cached vectors exceed `EMBEDDING_CACHE_MAX_BYTES`.
+The services must use the same `EMBEDDING_CACHE_MODEL_ID` to share the embeddings of a model.
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+from .cache import CacheMetrics
+from .logger import CustomLogger
+
+logger = CustomLogger("comps-core-embedding-cache")
+LOGFLAG = os.getenv("LOGFLAG", False)
+
+EMBEDDING_CACHE = os.getenv("EMBEDDING_CACHE", "").lower()
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.db")
+EMBEDDING_CACHE_REDIS_URL = os.getenv("EMBEDDING_CACHE_REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379"))
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", 1 << 30))
+EMBEDDING_CACHE_MODEL_ID = os.getenv("EMBEDDING_CACHE_MODEL_ID")
+
+# eviction frees down to this fraction of max_bytes, so that it does not run on every insert
+_LOW_WATER = 0.9
+# the access time of an entry is only refreshed when older, to keep the reads from writing
+_ACCESS_RESOLUTION = 60
+# SQLite limits the number of parameters of a statement
+_SQL_BATCH = 500
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model_id: str, text: str) -> str:
+    return hashlib.sha256(f"{model_id}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+def _encode(vector: Sequence[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _decode(data: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(data)
+    return vector.tolist()
+
+
+class EmbeddingCache:
+    """Base class of the embedding caches, the vectors are stored as float32."""
+
+    def __init__(self, name: str = "embedding", max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        """:param name: name of the cache, used as "cache" label of the metrics.
+        :param max_bytes: size of the cached vectors above which the least recently used ones are evicted.
+        """
+        self.name = name
+        self.max_bytes = max_bytes
+        self.metrics = CacheMetrics(name)
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[List[float]]]:
+        """The cached vectors of `keys`, None for the missing ones."""
+        found = self._get(list(dict.fromkeys(keys)))
+        vectors = []
+        for key in keys:
+            data = found.get(key)
+            self.metrics.hit_update(data is not None)
+            vectors.append(_decode(data) if data is not None else None)
+        return vectors
+
+    def set_many(self, keys: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        self._set({key: _encode(vector) for key, vector in zip(keys, vectors)})
+
+    def _get(self, keys: List[str]) -> Dict[str, bytes]:
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def _set(self, items: Dict[str, bytes]) -> None:
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def clear(self) -> None:
+        raise NotImplementedError("Subclasses must implement this method")
+
+
+class SQLiteEmbeddingCache(EmbeddingCache):
+    """Embedding cache in a SQLite file, in WAL mode so that several processes of the host can share it.
+
+    The size of the cached vectors is tracked by the process, it is recounted from the file before evicting so
+    that the inserts of the other processes are accounted for.
+    """
+
+    def __init__(
+        self, path: str = EMBEDDING_CACHE_PATH, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES, name: str = "embedding"
+    ):
+        super().__init__(name, max_bytes)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)")
+        self.nbytes = self._count_bytes()
+        self.metrics.size_update(self.nbytes)
+
+    def _count_bytes(self) -> int:
+        return int(self._conn.execute("SELECT total(length(vector)) FROM embeddings").fetchone()[0])
+
+    def _get(self, keys: List[str]) -> Dict[str, bytes]:
+        found = {}
+        now = time.time()
+        with self._lock:
+            stale = []
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i : i + _SQL_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, vector, accessed FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                )
+                for key, vector, accessed in rows:
+                    found[key] = vector
+                    if accessed < now - _ACCESS_RESOLUTION:
+                        stale.append((now, key))
+            if stale:
+                with self._conn:
+                    self._conn.executemany("UPDATE embeddings SET accessed = ? WHERE key = ?", stale)
+        return found
+
+    def _set(self, items: Dict[str, bytes]) -> None:
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.executemany(
+                    "INSERT OR IGNORE INTO embeddings (key, vector, accessed) VALUES (?, ?, ?)",
+                    [(key, data, now) for key, data in items.items()],
+                )
+            if cursor.rowcount == len(items):
+                self.nbytes += sum(len(data) for data in items.values())
+            else:
+                self.nbytes = self._count_bytes()
+            if self.nbytes > self.max_bytes:
+                self.nbytes = self._count_bytes()
+                if self.nbytes > self.max_bytes:
+                    self._evict()
+            self.metrics.size_update(self.nbytes)
+
+    def _evict(self) -> None:
+        """Delete the least recently used vectors down to the low water mark."""
+        excess = self.nbytes - int(self.max_bytes * _LOW_WATER)
+        evicted = []
+        cursor = self._conn.execute("SELECT key, length(vector) FROM embeddings ORDER BY accessed")
+        for key, size in cursor:
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+            self.nbytes -= size
+        cursor.close()
+        with self._conn:
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+        self.metrics.eviction_update(len(evicted))
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM embeddings")
+            self.nbytes = 0
+            self.metrics.size_update(0)
+
+
+class RedisEmbeddingCache(EmbeddingCache):
+    """Embedding cache in Redis, shared by all the services and their replicas.
+
+    Next to the vectors, a sorted set orders the keys by last access and a counter sums the size of the vectors.
+    Keys evicted by Redis itself (`maxmemory`) are not subtracted from the counter, keep `max_bytes` below it.
+    """
+
+    def __init__(
+        self,
+        url: str = EMBEDDING_CACHE_REDIS_URL,
+        max_bytes: int = EMBEDDING_CACHE_MAX_BYTES,
+        prefix: str = "opea:embedding:",
+        name: str = "embedding",
+    ):
+        super().__init__(name, max_bytes)
+        self.url = url
+        self.prefix = prefix
+        self.lru_key = f"{prefix}__lru__"
+        self.bytes_key = f"{prefix}__bytes__"
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+
+            self._client = redis.from_url(self.url)
+        return self._client
+
+    def _get(self, keys: List[str]) -> Dict[str, bytes]:
+        if not keys:
+            return {}
+        values = self.client.mget([self.prefix + key for key in keys])
+        found = {key: value for key, value in zip(keys, values) if value is not None}
+        if found:
+            now = time.time()
+            self.client.zadd(self.lru_key, {key: now for key in found})
+        return found
+
+    def _set(self, items: Dict[str, bytes]) -> None:
+        if not items:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for key, data in items.items():
+            pipe.set(self.prefix + key, data, nx=True)
+        added = [key for key, ok in zip(items, pipe.execute()) if ok]
+        if not added:
+            return
+        now = time.time()
+        pipe.zadd(self.lru_key, {key: now for key in added})
+        pipe.incrby(self.bytes_key, sum(len(items[key]) for key in added))
+        nbytes = pipe.execute()[-1]
+        if nbytes > self.max_bytes:
+            nbytes = self._evict(nbytes)
+        self.metrics.size_update(nbytes)
+
+    def _evict(self, nbytes: int, batch_size: int = 256) -> int:
+        """Delete the least recently used vectors down to the low water mark, return the size left."""
+        target = int(self.max_bytes * _LOW_WATER)
+        evicted = 0
+        while nbytes > target:
+            popped = self.client.zpopmin(self.lru_key, batch_size)
+            if not popped:
+                break
+            pipe = self.client.pipeline(transaction=False)
+            keys = [self.prefix + member.decode() for member, _ in popped]
+            for key in keys:
+                pipe.strlen(key)
+            pipe.delete(*keys)
+            freed = sum(pipe.execute()[:-1])
+            nbytes = self.client.decrby(self.bytes_key, freed)
+            evicted += len(keys)
+        self.metrics.eviction_update(evicted)
+        return nbytes
+
+    def clear(self) -> None:
+        for key in self.client.scan_iter(match=self.prefix + "*"):
+            self.client.delete(key)
+        self.metrics.size_update(0)
+
+
+def _plan(cache: EmbeddingCache, model_id: str, texts: Sequence[str]):
+    """The cached vectors of `texts` and the positions of the missing ones, by key."""
+    keys = [cache_key(model_id, text) for text in texts]
+    try:
+        vectors = cache.get_many(keys)
+    except Exception as e:
+        # the cache is an optimization, an unavailable cache falls back to the embedding model
+        logger.warning(f"embedding cache {cache.name} unavailable: {e}")
+        vectors = [None] * len(texts)
+    missing: Dict[str, List[int]] = {}
+    for position, (key, vector) in enumerate(zip(keys, vectors)):
+        if vector is None:
+            missing.setdefault(key, []).append(position)
+    return vectors, missing
+
+
+def _fill(cache: EmbeddingCache, vectors: list, missing: Dict[str, List[int]], new_vectors: Sequence) -> None:
+    for positions, vector in zip(missing.values(), new_vectors):
+        for position in positions:
+            vectors[position] = vector
+    try:
+        cache.set_many(list(missing), new_vectors)
+    except Exception as e:
+        logger.warning(f"embedding cache {cache.name} unavailable: {e}")
+
+
+def embed_cached(
+    cache: EmbeddingCache,
+    model_id: str,
+    texts: Sequence[str],
+    embed_fn: Callable[[List[str]], List[List[float]]],
+) -> List[List[float]]:
+    """Embeddings of `texts`, only the texts missing from the cache are embedded with `embed_fn`, once each."""
+    vectors, missing = _plan(cache, model_id, texts)
+    if missing:
+        new_vectors = embed_fn([texts[positions[0]] for positions in missing.values()])
+        _fill(cache, vectors, missing, new_vectors)
+    return vectors
+
+
+async def aembed_cached(
+    cache: EmbeddingCache,
+    model_id: str,
+    texts: Sequence[str],
+    embed_fn: Callable[[List[str]], Awaitable[List[List[float]]]],
+) -> List[List[float]]:
+    """Async version of `embed_cached`, the cache is accessed in a worker thread."""
+    vectors, missing = await asyncio.to_thread(_plan, cache, model_id, texts)
+    if missing:
+        new_vectors = await embed_fn([texts[positions[0]] for positions in missing.values()])
+        await asyncio.to_thread(_fill, cache, vectors, missing, new_vectors)
+    return vectors
+
+
+class CachedEmbeddings:
+    """Langchain embeddings served from an embedding cache.
+
+    Queries are cached under `query_model_id`, for the models that embed a query differently from a document
+    (e.g. HuggingFaceBgeEmbeddings prepends an instruction to the queries). It defaults to `model_id`, as for
+    a TEI endpoint which embeds both the same way.
+    """
+
+    def __init__(self, embeddings, cache: EmbeddingCache, model_id: str, query_model_id: Optional[str] = None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_id = model_id
+        self.query_model_id = query_model_id or model_id
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return embed_cached(self.cache, self.model_id, texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return embed_cached(
+            self.cache, self.query_model_id, [text], lambda texts: [self.embeddings.embed_query(texts[0])]
+        )[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await aembed_cached(self.cache, self.model_id, texts, self.embeddings.aembed_documents)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        async def embed(texts):
+            return [await self.embeddings.aembed_query(texts[0])]
+
+        return (await aembed_cached(self.cache, self.query_model_id, [text], embed))[0]
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """The embedding cache of the process selected by `EMBEDDING_CACHE`, None when disabled."""
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None and EMBEDDING_CACHE:
+            if EMBEDDING_CACHE == "sqlite":
+                _embedding_cache = SQLiteEmbeddingCache()
+            elif EMBEDDING_CACHE == "redis":
+                _embedding_cache = RedisEmbeddingCache()
+            else:
+                raise ValueError(f"EMBEDDING_CACHE must be 'sqlite' or 'redis', not {EMBEDDING_CACHE!r}")
+            if LOGFLAG:
+                logger.info(f"embedding cache: {EMBEDDING_CACHE}")
+        return _embedding_cache
+
+
+def cached_embeddings(embeddings, model_id: str, separate_queries: bool = False):
+    """`embeddings` wrapped in CachedEmbeddings when the embedding cache is enabled, else `embeddings`.
+
+    `model_id` is the default of `EMBEDDING_CACHE_MODEL_ID`, `separate_queries` caches the queries apart from the
+    documents, for a local model which embeds them differently.
+    """
+    cache = get_embedding_cache()
+    if cache is None:
+        return embeddings
+    model_id = EMBEDDING_CACHE_MODEL_ID or model_id
+    return CachedEmbeddings(
+        embeddings, cache, model_id, query_model_id=f"{model_id}:query" if separate_queries else None
+    )
@@ -1,15 +1,23 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
 import base64
+import hmac
+import json
 import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from io import BytesIO
-from typing import List, Union
+from typing import Dict, List, Union
 
-import requests
-from fastapi import File, Request, UploadFile
+import aiohttp
+from fastapi import File, HTTPException, Request, UploadFile
 from fastapi.responses import StreamingResponse
 from PIL import Image
+from pydantic import ValidationError
 
 from ..proto.api_protocol import (
     AudioChatCompletionRequest,
@@ -22,8 +30,11 @@ from ..proto.api_protocol import (
     UsageInfo,
 )
 from ..proto.docarray import DocSumDoc, LLMParams, LLMParamsDoc, RerankedDoc, RerankerParms, RetrieverParms, TextDoc
+from .admission import AdmissionController
+from .cache import InMemoryCache
 from .constants import MegaServiceEndpoint, ServiceRoleType, ServiceType
 from .micro_service import MicroService
+from .orchestrator import OrchestratorMetrics
 
 
 def read_pdf(file):
@@ -34,33 +45,170 @@ def read_pdf(file):
     return docs
 
 
-def read_text_from_file(file, save_file_name):
-    import docx2txt
-    from langchain.text_splitter import CharacterTextSplitter
-
+def parse_file(path: str, content_type: str):
+    """Text of an uploaded file, run in the parsing process pool of DocSumGateway."""
     # read text file
-    if file.headers["content-type"] == "text/plain":
-        file.file.seek(0)
-        content = file.file.read().decode("utf-8")
+    if content_type == "text/plain":
+        from langchain.text_splitter import CharacterTextSplitter
+
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
         # Split text
         text_splitter = CharacterTextSplitter()
         texts = text_splitter.split_text(content)
         # Create multiple documents
         file_content = texts
     # read pdf file
-    elif file.headers["content-type"] == "application/pdf":
-        documents = read_pdf(save_file_name)
+    elif content_type == "application/pdf":
+        documents = read_pdf(path)
         file_content = [doc.page_content for doc in documents]
     # read docx file
     elif (
-        file.headers["content-type"] == "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        or file.headers["content-type"] == "application/octet-stream"
+        content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        or content_type == "application/octet-stream"
     ):
-        file_content = docx2txt.process(save_file_name)
+        import docx2txt
+
+        file_content = docx2txt.process(path)
+    else:
+        raise ValueError(f"Unsupported file type: {content_type}")
 
     return file_content
 
 
+def read_text_from_file(file, save_file_name):
+    return parse_file(save_file_name, file.headers["content-type"])
+
+
+async def save_upload(file: UploadFile, chunk_size: int = 1024 * 1024) -> str:
+    """Copy an upload to a new temporary file chunk by chunk, without holding it in memory."""
+    import aiofiles
+
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(file.filename or "")[1])
+    os.close(fd)
+    try:
+        async with aiofiles.open(path, "wb") as f:
+            while chunk := await file.read(chunk_size):
+                await f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def _exit_with_parent(parent_pid: int):
+    """Initializer of the parse pool workers: exit once the gateway process is gone.
+
+    A gateway stopped with SIGTERM does not run its shutdown events, its workers would be left behind.
+    """
+
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def split_text(text: str, chunk_size: int, chunk_overlap: int = 0) -> List[str]:
+    """Split `text` in chunks of at most `chunk_size` characters, cut at whitespace when possible."""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            cut = max(text.rfind("\n", start, end), text.rfind(" ", start, end))
+            if cut > start + chunk_size // 2:
+                end = cut + 1
+        chunks.append(text[start:end])
+        if end == len(text):
+            break
+        start = max(end - chunk_overlap, start + 1)
+    return chunks
+
+
+def encode_image(data: bytes) -> str:
+    """Base64 of the image as PNG, PNG images are passed through without being decoded."""
+    image = Image.open(BytesIO(data))
+    if image.format != "PNG":
+        image_bytes = BytesIO()
+        image.convert("RGBA").save(image_bytes, format="PNG")
+        data = image_bytes.getvalue()
+    return base64.b64encode(data).decode()
+
+
+def read_image_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return encode_image(f.read())
+
+
+class ImageLoader:
+    """Turn the image references of chat messages (URL, local path or base64) into base64 PNG images.
+
+    The images of a message are fetched concurrently over one shared HTTP session, decoded and
+    re-encoded in a thread pool so that the event loop keeps serving the other requests, and the
+    encoded images of the URLs are kept in an LRU cache bounded by `GATEWAY_IMAGE_CACHE_BYTES`.
+    """
+
+    def __init__(
+        self,
+        cache_bytes: int = int(os.getenv("GATEWAY_IMAGE_CACHE_BYTES", 64 * 1024 * 1024)),
+        max_workers: int = int(os.getenv("GATEWAY_IMAGE_WORKERS", 4)),
+        timeout: float = float(os.getenv("GATEWAY_IMAGE_TIMEOUT", 30)),
+    ):
+        self.cache = InMemoryCache(name="gateway_images", max_bytes=cache_bytes, ttl=None)
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        # threads are only started on the first submit, i.e. in the gateway process
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image")
+        # a session is bound to the loop that created it
+        self._sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+        self._closing = set()
+
+    def session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            # the sessions of the loops that are gone are closed here, they would leak their connector
+            for stale_loop in [stale_loop for stale_loop in self._sessions if stale_loop.is_closed()]:
+                task = loop.create_task(self._sessions.pop(stale_loop).close())
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+            session = self._sessions[loop] = aiohttp.ClientSession(timeout=self.timeout, trust_env=True)
+        return session
+
+    async def close(self) -> None:
+        loop = asyncio.get_running_loop()
+        sessions, self._sessions = self._sessions, {}
+        for session_loop, session in sessions.items():
+            if session_loop is not loop and session_loop.is_running():
+                # still running in another thread
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.close(), session_loop))
+            else:
+                await session.close()
+        await asyncio.gather(*[task for task in self._closing if task.get_loop() is loop])
+
+    async def load(self, img: str) -> str:
+        loop = asyncio.get_running_loop()
+        # URL
+        if img.startswith("http://") or img.startswith("https://"):
+            img_b64_str = await self.cache.get(img)
+            if img_b64_str is None:
+                async with self.session().get(img) as response:
+                    response.raise_for_status()
+                    data = await response.read()
+                img_b64_str = await loop.run_in_executor(self.executor, encode_image, data)
+                await self.cache.set(img, img_b64_str)
+            return img_b64_str
+        # Local Path
+        if os.path.exists(img):
+            return await loop.run_in_executor(self.executor, read_image_file, img)
+        # Bytes
+        return img
+
+    async def load_all(self, images: List[str]) -> List[str]:
+        return list(await asyncio.gather(*[self.load(img) for img in images]))
+
+
 class Gateway:
     def __init__(
         self,
@@ -77,6 +225,7 @@ class Gateway:
         self.endpoint = endpoint
         self.input_datatype = input_datatype
         self.output_datatype = output_datatype
+        self.image_loader = ImageLoader()
         self.service = MicroService(
             self.__class__.__name__,
             service_role=ServiceRoleType.MEGASERVICE,
@@ -87,18 +236,38 @@ class Gateway:
             input_datatype=self.input_datatype,
             output_datatype=self.output_datatype,
         )
+        # GATEWAY_MAX_CONCURRENCY etc., the waiting requests are counted as pending megaservice requests
+        self.admission_control = AdmissionController.from_env(
+            "GATEWAY", pending_gauge=OrchestratorMetrics.request_pending
+        )
+        if self.admission_control is not None:
+            self.service.add_admission_control(self.endpoint, self.admission_control)
         self.define_routes()
+        self.define_lifespan_events()
         self.service.start()
 
+    def define_lifespan_events(self):
+        @self.service.app.on_event("startup")
+        async def open_connection_pool():
+            await self.megaservice.connection_pool.open()
+
+        @self.service.app.on_event("shutdown")
+        async def close_connection_pool():
+            await self.megaservice.connection_pool.close()
+            await self.image_loader.close()
+
     def define_routes(self):
-        self.service.app.router.add_api_route(self.endpoint, self.handle_request, methods=["POST"])
+        self.service.add_route(self.endpoint, self.handle_request, methods=["POST"])
         self.service.app.router.add_api_route(str(MegaServiceEndpoint.LIST_SERVICE), self.list_service, methods=["GET"])
         self.service.app.router.add_api_route(
             str(MegaServiceEndpoint.LIST_PARAMETERS), self.list_parameter, methods=["GET"]
         )
+        self.service.app.router.add_api_route(
+            str(MegaServiceEndpoint.INVALIDATE_CACHE), self.invalidate_cache, methods=["POST"]
+        )
 
     def add_route(self, endpoint, handler, methods=["POST"]):
-        self.service.app.router.add_api_route(endpoint, handler, methods=methods)
+        self.service.add_route(endpoint, handler, methods=methods)
 
     def stop(self):
         self.service.stop()
@@ -126,7 +295,44 @@ class Gateway:
     def list_parameter(self):
         pass
 
-    def _handle_message(self, messages):
+    async def invalidate_cache(self, request: Request):
+        """Clear the megaservice caches, the optional body selects the nodes.
+
+        e.g. {"service_types": ["EMBEDDING", "RETRIEVER"]} or {"nodes": ["retriever"]}
+
+        Requests must carry `Authorization: Bearer <MEGASERVICE_CACHE_INVALIDATE_TOKEN>`, the endpoint is
+        disabled when that variable is not set.
+        """
+        token = os.getenv("MEGASERVICE_CACHE_INVALIDATE_TOKEN")
+        if not token:
+            raise HTTPException(status_code=403, detail="Cache invalidation is disabled")
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+            raise HTTPException(status_code=401, detail="Invalid cache invalidation token")
+        body = await request.body()
+        try:
+            data = json.loads(body) if body else {}
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e}")
+        if not isinstance(data, dict):
+            raise HTTPException(status_code=400, detail="The body must be a JSON object")
+        service_types, nodes = data.get("service_types"), data.get("nodes")
+        for field, values in (("service_types", service_types), ("nodes", nodes)):
+            if values is not None and not (isinstance(values, list) and all(isinstance(v, str) for v in values)):
+                raise HTTPException(status_code=400, detail=f"{field} must be a list of strings")
+        try:
+            if service_types is not None:
+                service_types = [ServiceType[service_type.upper()] for service_type in service_types]
+        except KeyError as e:
+            raise HTTPException(status_code=400, detail=f"Unknown service type {e}")
+        cleared = []
+        for megaservice in self._megaservices():
+            cleared += await megaservice.invalidate_cache(nodes=nodes, service_types=service_types)
+        return {"cleared": cleared}
+
+    def _megaservices(self):
+        return [self.megaservice]
+
+    async def _handle_message(self, messages):
         images = []
         if isinstance(messages, str):
             prompt = messages
@@ -166,32 +372,15 @@ class Gateway:
                         prompt += role + ": " + text + "\n"
                     else:
                         prompt += role + ":"
-                    for img in image_list:
-                        # URL
-                        if img.startswith("http://") or img.startswith("https://"):
-                            response = requests.get(img)
-                            image = Image.open(BytesIO(response.content)).convert("RGBA")
-                            image_bytes = BytesIO()
-                            image.save(image_bytes, format="PNG")
-                            img_b64_str = base64.b64encode(image_bytes.getvalue()).decode()
-                        # Local Path
-                        elif os.path.exists(img):
-                            image = Image.open(img).convert("RGBA")
-                            image_bytes = BytesIO()
-                            image.save(image_bytes, format="PNG")
-                            img_b64_str = base64.b64encode(image_bytes.getvalue()).decode()
-                        # Bytes
-                        else:
-                            img_b64_str = img
-
-                        images.append(img_b64_str)
+                    images += image_list
                 else:
                     if message:
                         prompt += role + ": " + message + "\n"
                     else:
                         prompt += role + ":"
         if images:
-            return prompt, images
+            # fetched and encoded concurrently
+            return prompt, await self.image_loader.load_all(images)
         else:
             return prompt
 
@@ -208,7 +397,7 @@ class ChatQnAGateway(Gateway):
         stream_opt = data.get("stream", True)
         chat_request = ChatCompletionRequest.parse_obj(data)
         print("chat request in handle request", chat_request)
-        prompt = self._handle_message(chat_request.messages)
+        prompt = await self._handle_message(chat_request.messages)
         print("prompt in gateway", prompt)
         parameters = LLMParams(
             max_tokens=chat_request.max_tokens if chat_request.max_tokens else 1024,
@@ -270,7 +459,7 @@ class CodeGenGateway(Gateway):
         data = await request.json()
         stream_opt = data.get("stream", True)
         chat_request = ChatCompletionRequest.parse_obj(data)
-        prompt = self._handle_message(chat_request.messages)
+        prompt = await self._handle_message(chat_request.messages)
         parameters = LLMParams(
             max_tokens=chat_request.max_tokens if chat_request.max_tokens else 1024,
             top_k=chat_request.top_k if chat_request.top_k else 10,
@@ -413,7 +602,18 @@ class TranslationGateway(Gateway):
 
 
 class DocSumGateway(Gateway):
+    """Summarize text, or uploaded text/PDF/DOCX files.
+
+    Uploads are copied to disk chunk by chunk and parsed in a process pool (`DOCSUM_PARSE_WORKERS`).
+    With `"summary_type": "map_reduce"`, the document is split in chunks of `chunk_size` characters which
+    are summarized concurrently (at most `DOCSUM_MAP_CONCURRENCY` at a time), then the partial summaries
+    are summarized together. Streaming clients then get `{"progress": ...}` events before the final summary.
+    """
+
     def __init__(self, megaservice, host="0.0.0.0", port=8888):
+        self.parse_workers = int(os.getenv("DOCSUM_PARSE_WORKERS", 2))
+        self.map_concurrency = int(os.getenv("DOCSUM_MAP_CONCURRENCY", 8))
+        self._parse_pool = None
         super().__init__(
             megaservice,
             host,
@@ -423,13 +623,86 @@ class DocSumGateway(Gateway):
             output_datatype=ChatCompletionResponse,
         )
 
+    def define_lifespan_events(self):
+        super().define_lifespan_events()
+
+        @self.service.app.on_event("shutdown")
+        async def shutdown_parse_pool():
+            if self._parse_pool is not None:
+                self._parse_pool.shutdown(wait=True, cancel_futures=True)
+                self._parse_pool = None
+
+    @property
+    def parse_pool(self) -> ProcessPoolExecutor:
+        # created in the gateway process on the first upload
+        if self._parse_pool is None:
+            self._parse_pool = ProcessPoolExecutor(
+                max_workers=self.parse_workers, initializer=_exit_with_parent, initargs=(os.getpid(),)
+            )
+        return self._parse_pool
+
+    async def read_files(self, files: List[UploadFile]) -> List[str]:
+        """Texts of the uploaded files, the files are saved and parsed concurrently."""
+
+        async def read_file(file):
+            file_path = await save_upload(file)
+            try:
+                loop = asyncio.get_running_loop()
+                docs = await loop.run_in_executor(self.parse_pool, parse_file, file_path, file.content_type)
+            finally:
+                os.remove(file_path)
+            return docs if isinstance(docs, list) else [docs]
+
+        texts = []
+        for docs in await asyncio.gather(*[read_file(file) for file in files]):
+            texts.extend(docs)
+        return texts
+
+    async def summarize(self, key: str, text: str, parameters: LLMParams) -> str:
+        """Non-streamed summary of one chunk."""
+        result_dict, runtime_graph = await self.megaservice.schedule(
+            initial_inputs={key: text}, llm_parameters=parameters.model_copy(update={"streaming": False})
+        )
+        return result_dict[runtime_graph.all_leaves()[-1]]["text"]
+
+    async def map_reduce(self, key: str, text: str, parameters: LLMParams, chunk_size: int, chunk_overlap: int):
+        """Summarize the chunks of `text` concurrently, then their summaries, until they fit in one chunk.
+
+        Yields the progress events, then {"summary": <text>} with the text to summarize last.
+        """
+        semaphore = asyncio.Semaphore(self.map_concurrency)
+
+        async def summarize_chunk(index, chunk):
+            async with semaphore:
+                return index, await self.summarize(key, chunk, parameters)
+
+        chunks = split_text(text, chunk_size, chunk_overlap)
+        level = 0
+        while len(chunks) > 1:
+            summaries = [None] * len(chunks)
+            tasks = [asyncio.create_task(summarize_chunk(i, chunk)) for i, chunk in enumerate(chunks)]
+            try:
+                for done, task in enumerate(asyncio.as_completed(tasks), 1):
+                    index, summaries[index] = await task
+                    yield {"progress": {"level": level, "done": done, "total": len(chunks)}}
+            finally:
+                for task in tasks:
+                    task.cancel()
+            text, previous = "\n".join(summaries), text
+            if len(text) >= len(previous):
+                # the summaries do not get shorter, summarize them at once
+                break
+            chunks = split_text(text, chunk_size)
+            level += 1
+        yield {"summary": text}
+
     async def handle_request(self, request: Request, files: List[UploadFile] = File(default=None)):
 
         if "application/json" in request.headers.get("content-type"):
             data = await request.json()
             stream_opt = data.get("stream", True)
             chat_request = ChatCompletionRequest.model_validate(data)
-            prompt = self._handle_message(chat_request.messages)
+            prompt = await self._handle_message(chat_request.messages)
 
             initial_inputs_data = {data["type"]: prompt}
 
@@ -442,32 +715,16 @@ class DocSumGateway(Gateway):
 
             file_summaries = []
             if files:
-                for file in files:
-                    file_path = f"/tmp/{file.filename}"
-
-                    if data_type is not None and data_type in ["audio", "video"]:
-                        raise ValueError(
-                            "Audio and Video file uploads are not supported in docsum with curl request, please use the UI."
-                        )
-
-                    else:
-                        import aiofiles
-
-                        async with aiofiles.open(file_path, "wb") as f:
-                            await f.write(await file.read())
-
-                        docs = read_text_from_file(file, file_path)
-                        os.remove(file_path)
-
-                        if isinstance(docs, list):
-                            file_summaries.extend(docs)
-                        else:
-                            file_summaries.append(docs)
+                if data_type is not None and data_type in ["audio", "video"]:
+                    raise ValueError(
+                        "Audio and Video file uploads are not supported in docsum with curl request, please use the UI."
+                    )
+                file_summaries = await self.read_files(files)
 
             if file_summaries:
-                prompt = self._handle_message(chat_request.messages) + "\n".join(file_summaries)
+                prompt = (await self._handle_message(chat_request.messages)) + "\n".join(file_summaries)
             else:
-                prompt = self._handle_message(chat_request.messages)
+                prompt = await self._handle_message(chat_request.messages)
 
             data_type = data.get("type")
             if data_type is not None:
@@ -479,6 +736,13 @@ class DocSumGateway(Gateway):
         else:
             raise ValueError(f"Unknown request type: {request.headers.get('content-type')}")
 
+        try:
+            options = DocSumChatCompletionRequest.model_validate(
+                {field: data[field] for field in ("summary_type", "chunk_size", "chunk_overlap") if field in data}
+            )
+        except ValidationError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid summary options: {e}")
+
         parameters = LLMParams(
             max_tokens=chat_request.max_tokens if chat_request.max_tokens else 1024,
             top_k=chat_request.top_k if chat_request.top_k else 10,
@@ -492,6 +756,17 @@ class DocSumGateway(Gateway):
             language=chat_request.language if chat_request.language else "auto",
         )
 
+        if options.summary_type == "map_reduce":
+            key, text = next(iter(initial_inputs_data.items()))
+            events = self.map_reduce(key, text, parameters, options.chunk_size, options.chunk_overlap)
+            if stream_opt:
+                return StreamingResponse(
+                    self.stream_map_reduce(key, events, parameters), media_type="text/event-stream"
+                )
+            async for event in events:
+                pass
+            initial_inputs_data = {key: event["summary"]}
+
         result_dict, runtime_graph = await self.megaservice.schedule(
             initial_inputs=initial_inputs_data, llm_parameters=parameters
         )
@@ -517,6 +792,23 @@ class DocSumGateway(Gateway):
         )
         return ChatCompletionResponse(model="docsum", choices=choices, usage=usage)
 
+    async def stream_map_reduce(self, key: str, events, parameters: LLMParams):
+        """SSE stream of the map-reduce progress followed by the streamed final summary."""
+        async for event in events:
+            if "progress" in event:
+                yield f"data: {json.dumps(event)}\n\n"
+                continue
+            result_dict, runtime_graph = await self.megaservice.schedule(
+                initial_inputs={key: event["summary"]}, llm_parameters=parameters
+            )
+            response = result_dict[runtime_graph.all_leaves()[-1]]
+            if isinstance(response, StreamingResponse):
+                async for chunk in response.body_iterator:
+                    yield chunk
+            else:
+                yield f"data: {repr(response['text'].encode('utf-8'))}\n\n"
+                yield "data: [DONE]\n\n"
+
 
 class AudioQnAGateway(Gateway):
     def __init__(self, megaservice, host="0.0.0.0", port=8888):
@@ -564,7 +856,7 @@ class SearchQnAGateway(Gateway):
         data = await request.json()
         stream_opt = data.get("stream", True)
         chat_request = ChatCompletionRequest.parse_obj(data)
-        prompt = self._handle_message(chat_request.messages)
+        prompt = await self._handle_message(chat_request.messages)
         parameters = LLMParams(
             max_tokens=chat_request.max_tokens if chat_request.max_tokens else 1024,
             top_k=chat_request.top_k if chat_request.top_k else 10,
@@ -627,9 +919,9 @@ class FaqGenGateway(Gateway):
                     file_summaries.append(docs)
 
         if file_summaries:
-            prompt = self._handle_message(chat_request.messages) + "\n".join(file_summaries)
+            prompt = (await self._handle_message(chat_request.messages)) + "\n".join(file_summaries)
         else:
-            prompt = self._handle_message(chat_request.messages)
+            prompt = await self._handle_message(chat_request.messages)
 
         parameters = LLMParams(
             max_tokens=chat_request.max_tokens if chat_request.max_tokens else 1024,
@@ -677,7 +969,7 @@ class VisualQnAGateway(Gateway):
         data = await request.json()
         stream_opt = data.get("stream", False)
         chat_request = ChatCompletionRequest.parse_obj(data)
-        prompt, images = self._handle_message(chat_request.messages)
+        prompt, images = await self._handle_message(chat_request.messages)
         parameters = LLMParams(
             max_new_tokens=chat_request.max_tokens if chat_request.max_tokens else 1024,
             top_k=chat_request.top_k if chat_request.top_k else 10,
@@ -728,7 +1020,7 @@ class VideoQnAGateway(Gateway):
         data = await request.json()
         stream_opt = data.get("stream", False)
         chat_request = ChatCompletionRequest.parse_obj(data)
-        prompt = self._handle_message(chat_request.messages)
+        prompt = await self._handle_message(chat_request.messages)
         parameters = LLMParams(
             max_new_tokens=chat_request.max_tokens if chat_request.max_tokens else 1024,
             top_k=chat_request.top_k if chat_request.top_k else 10,
@@ -848,8 +1140,22 @@ class MultimodalQnAGateway(Gateway):
             ChatCompletionResponse,
         )
 
+    def define_lifespan_events(self):
+        super().define_lifespan_events()
+
+        @self.service.app.on_event("startup")
+        async def open_lvm_connection_pool():
+            await self.lvm_megaservice.connection_pool.open()
+
+        @self.service.app.on_event("shutdown")
+        async def close_lvm_connection_pool():
+            await self.lvm_megaservice.connection_pool.close()
+
+    def _megaservices(self):
+        return [self.megaservice, self.lvm_megaservice]
+
     # this overrides _handle_message method of Gateway
-    def _handle_message(self, messages):
+    async def _handle_message(self, messages):
         images = []
         messages_dicts = []
         if isinstance(messages, str):
@@ -900,25 +1206,7 @@ class MultimodalQnAGateway(Gateway):
                                 prompt += role.upper() + ": " + text + "\n"
                             else:
                                 prompt += role.upper() + ":"
-                        for img in image_list:
-                            # URL
-                            if img.startswith("http://") or img.startswith("https://"):
-                                response = requests.get(img)
-                                image = Image.open(BytesIO(response.content)).convert("RGBA")
-                                image_bytes = BytesIO()
-                                image.save(image_bytes, format="PNG")
-                                img_b64_str = base64.b64encode(image_bytes.getvalue()).decode()
-                            # Local Path
-                            elif os.path.exists(img):
-                                image = Image.open(img).convert("RGBA")
-                                image_bytes = BytesIO()
-                                image.save(image_bytes, format="PNG")
-                                img_b64_str = base64.b64encode(image_bytes.getvalue()).decode()
-                            # Bytes
-                            else:
-                                img_b64_str = img
-
-                            images.append(img_b64_str)
+                        images += image_list
                     else:
                         if i == 0:
                             # do not add role for the very first message.
@@ -931,7 +1219,8 @@ class MultimodalQnAGateway(Gateway):
                             else:
                                 prompt += role.upper() + ":"
         if images:
-            return prompt, images
+            # fetched and encoded concurrently
+            return prompt, await self.image_loader.load_all(images)
         else:
             return prompt
 
@@ -943,7 +1232,7 @@ class MultimodalQnAGateway(Gateway):
             stream_opt = False
         chat_request = ChatCompletionRequest.model_validate(data)
         # Multimodal RAG QnA With Videos has not yet accepts image as input during QnA.
-        prompt_and_image = self._handle_message(chat_request.messages)
+        prompt_and_image = await self._handle_message(chat_request.messages)
         if isinstance(prompt_and_image, tuple):
             # print(f"This request include image, thus it is a follow-up query. Using lvm megaservice")
             prompt, images = prompt_and_image
@@ -1074,7 +1363,7 @@ class GraphragGateway(Gateway):
             raise ValueError(f"Unknown request type: {data}")
         if chat_request is None:
             raise ValueError(f"Unknown request type: {data}")
-        prompt = self._handle_message(chat_request.messages)
+        prompt = await self._handle_message(chat_request.messages)
         parameters = LLMParams(
             max_tokens=chat_request.max_tokens if chat_request.max_tokens else 1024,
             top_k=chat_request.top_k if chat_request.top_k else 10,
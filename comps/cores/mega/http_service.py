@@ -1,17 +1,129 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import inspect
 import logging
 import re
+import time
 from typing import Optional
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+from opentelemetry import propagate, trace
 from prometheus_fastapi_instrumentator import Instrumentator
 from uvicorn import Config, Server
 
+from ..proto.embedding_encoding import EMBEDDING_MEDIA_TYPE, accepted_dtype, embedding_encoding
+from ..telemetry.opea_telemetry import recent_spans, request_span
+from .admission import AdmissionController, AdmissionRejected
 from .base_service import BaseService
 from .base_statistics import collect_all_statistics
 
+# recent FastAPI versions open a server span per request themselves, continuing the trace of the caller
+_FASTAPI_TRACING = "telemetry" in inspect.signature(FastAPI.__init__).parameters
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware reporting the time spent in the app in a `Server-Timing: app;dur=<ms>` header.
+
+    The megaservice subtracts it from the time of the call to split each hop into service and network time.
+    With request tracing enabled and a FastAPI version not tracing requests, the request is also served in a
+    span continuing the trace of the caller.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                duration = (time.perf_counter() - start) * 1000
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", f"app;dur={duration:.3f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        if _FASTAPI_TRACING:
+            await self.app(scope, receive, send_with_timing)
+            return
+        carrier = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        with request_span(
+            f"{scope['method']} {scope['path']}", context=propagate.extract(carrier), kind=trace.SpanKind.SERVER
+        ):
+            await self.app(scope, receive, send_with_timing)
+
+
+class EmbeddingEncodingMiddleware:
+    """ASGI middleware serving binary embeddings to the clients which accept them, see embedding_encoding.
+
+    The negotiated dtype is set for the EmbedDoc serializers of the request, a reply in which a vector was
+    encoded gets the `application/vnd.opea.embedding+json` content type.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        dtype = None
+        if scope["type"] == "http":
+            for key, value in scope.get("headers", []):
+                if key == b"accept":
+                    dtype = accepted_dtype(value.decode("latin-1"))
+                    break
+        if dtype is None:
+            await self.app(scope, receive, send)
+            return
+        encoding = {"dtype": dtype, "used": False}
+
+        async def send_with_content_type(message):
+            if message["type"] == "http.response.start" and encoding["used"]:
+                headers = [(key, value) for key, value in message.get("headers", []) if key != b"content-type"]
+                headers.append((b"content-type", EMBEDDING_MEDIA_TYPE.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = embedding_encoding.set(encoding)
+        try:
+            await self.app(scope, receive, send_with_content_type)
+        finally:
+            embedding_encoding.reset(token)
+
+
+class AdmissionMiddleware:
+    """ASGI middleware admitting the requests of the limited paths through their AdmissionController.
+
+    The slot is held until the whole response is sent, streamed responses included.
+    """
+
+    def __init__(self, app, controllers: dict):
+        self.app = app
+        self.controllers = controllers  # path => AdmissionController, filled after the app is created
+
+    async def __call__(self, scope, receive, send):
+        controller = self.controllers.get(scope["path"]) if scope["type"] == "http" else None
+        if controller is None:
+            await self.app(scope, receive, send)
+            return
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers", [])}
+        try:
+            await controller.acquire(controller.priority(headers))
+        except AdmissionRejected as e:
+            response = JSONResponse(
+                {"detail": e.detail}, status_code=e.status_code, headers={"Retry-After": str(e.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(time.perf_counter() - start)
+
 
 class HTTPService(BaseService):
     """FastAPI HTTP service based on BaseService class.
@@ -34,6 +146,7 @@ class HTTPService(BaseService):
         super().__init__(**kwargs)
         self.uvicorn_kwargs = uvicorn_kwargs or {}
         self.cors = cors
+        self.admission_controllers = {}
         self._app = self._create_app()
         Instrumentator().instrument(self._app).expose(self._app)
 
@@ -49,6 +162,9 @@ class HTTPService(BaseService):
         :return: a FastAPI application.
         """
         app = FastAPI(title=self.title, description=self.description)
+        app.add_middleware(EmbeddingEncodingMiddleware)
+        app.add_middleware(AdmissionMiddleware, controllers=self.admission_controllers)
+        app.add_middleware(ServerTimingMiddleware)
 
         if self.cors:
             from fastapi.middleware.cors import CORSMiddleware
@@ -81,10 +197,30 @@ class HTTPService(BaseService):
             result = collect_all_statistics()
             return result
 
+        @app.get(
+            path="/v1/debug/traces",
+            summary="Get the last finished spans of the in-memory trace exporter",
+            tags=["Debug"],
+        )
+        async def _get_traces(limit: int = 100, trace_id: Optional[str] = None):
+            """Get the last `limit` spans, of the trace `trace_id` (hex) if given."""
+            spans = recent_spans(limit, trace_id)
+            if spans is None:
+                raise HTTPException(status_code=404, detail="The in-memory trace exporter is disabled")
+            return spans
+
         return app
 
-    async def initialize_server(self):
-        """Initialize and return HTTP server."""
+    def add_admission_control(self, path: str, controller: AdmissionController):
+        """Limit the concurrent requests to `path`, see AdmissionController."""
+        controller.bind(self.title, path)
+        self.admission_controllers[path] = controller
+
+    async def initialize_server(self, sockets=None):
+        """Initialize and return HTTP server.
+
+        :param sockets: already listening sockets to serve on, e.g. inherited by a forked worker.
+        """
         self.logger.info("Setting up HTTP server")
 
         class UviServer(Server):
@@ -123,9 +259,18 @@ class HTTPService(BaseService):
         )
         logging.getLogger("uvicorn.access").addFilter(lambda record: "/v1/health_check" not in record.getMessage())
         self.logger.info(f"Uvicorn server setup on port {self.primary_port}")
-        await self.server.setup_server()
+        await self.server.setup_server(sockets=sockets)
         self.logger.info("HTTP server setup successful")
 
+    @property
+    def listening_sockets(self):
+        """The listening sockets of the server, shared by the workers of a multi-worker service."""
+        return [sock for server in self.server.servers for sock in server.sockets]
+
+    def request_exit(self):
+        """Stop the serving loop, safe to call from a signal handler."""
+        self.server.should_exit = True
+
     async def execute_server(self):
         """Run the HTTP server indefinitely."""
         await self.server.start_server()
@@ -0,0 +1,240 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import itertools
+import random
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple, Union
+
+from prometheus_client import Counter
+
+from .base_statistics import LatencySketch
+from .logger import CustomLogger
+
+logger = CustomLogger("comps-core-load-balancer")
+
+
+class LoadBalancerMetrics:
+    # Metrics are class members for the same reasons as OrchestratorMetrics,
+    # nodes are told apart with the "service" label
+    requests = Counter(
+        "megaservice_replica_requests", "Count of requests sent to a replica (counter)", ["service", "replica"]
+    )
+    ejections = Counter(
+        "megaservice_replica_ejections", "Count of replica ejections after failures (counter)", ["service", "replica"]
+    )
+    hedges = Counter("megaservice_hedged_requests", "Count of hedged requests sent (counter)", ["service"])
+    hedge_wins = Counter(
+        "megaservice_hedge_wins", "Count of hedged requests which replied first (counter)", ["service"]
+    )
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def request_update(self, replica: str) -> None:
+        self.requests.labels(self.name, replica).inc()
+
+    def ejection_update(self, replica: str) -> None:
+        self.ejections.labels(self.name, replica).inc()
+
+    def hedge_update(self) -> None:
+        self.hedges.labels(self.name).inc()
+
+    def hedge_win_update(self) -> None:
+        self.hedge_wins.labels(self.name).inc()
+
+
+class Replica:
+    """One endpoint of a replicated service and what the balancer knows about it."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0  # requests sent and not answered yet
+        self.latency = None  # moving average of the latencies in seconds
+        self.failures = 0  # consecutive failures
+        self.ejected_until = 0.0
+
+    def available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+
+class BalancingPolicy:
+    """Choose the replica of the next request among the available ones."""
+
+    def choose(self, replicas: List[Replica]) -> Replica:
+        raise NotImplementedError("Subclasses must implement this method")
+
+
+class RoundRobinPolicy(BalancingPolicy):
+    def __init__(self):
+        self._counter = itertools.count()
+
+    def choose(self, replicas: List[Replica]) -> Replica:
+        return replicas[next(self._counter) % len(replicas)]
+
+
+class LeastOutstandingPolicy(BalancingPolicy):
+    """The replica with the fewest requests in flight, ties are broken at random."""
+
+    def choose(self, replicas: List[Replica]) -> Replica:
+        fewest = min(replica.outstanding for replica in replicas)
+        return random.choice([replica for replica in replicas if replica.outstanding == fewest])
+
+
+class LatencyEWMAPolicy(BalancingPolicy):
+    """The replica with the lowest expected wait: latency average times (requests in flight + 1).
+
+    Replicas without a latency yet are tried first.
+    """
+
+    def choose(self, replicas: List[Replica]) -> Replica:
+        unknown = [replica for replica in replicas if replica.latency is None]
+        if unknown:
+            return random.choice(unknown)
+        return min(replicas, key=lambda replica: replica.latency * (replica.outstanding + 1))
+
+
+BALANCING_POLICIES = {
+    "round_robin": RoundRobinPolicy,
+    "least_outstanding": LeastOutstandingPolicy,
+    "latency_ewma": LatencyEWMAPolicy,
+}
+
+
+class ReplicaSet:
+    """Endpoints of the replicas of a service node, requests are spread by a BalancingPolicy.
+
+    Passive health checks: a replica failing `max_failures` times in a row (connection error, timeout or 5xx
+    reply) is ejected for `ejection_time` seconds, then a single failure ejects it again. When every replica
+    is ejected, they are all used anyway.
+
+    With `hedge`, only for idempotent nodes, a second request is sent to another replica once the first one
+    has been pending for the `hedge_quantile` of the recent latencies, the first reply wins and the other
+    request is cancelled. Hedging starts once `hedge_min_samples` latencies were measured.
+    """
+
+    LATENCY_DECAY = 0.2  # weight of a new latency in the moving averages
+    HEDGE_WINDOW = 1000  # the latency quantile is computed over the last HEDGE_WINDOW samples at most
+
+    def __init__(
+        self,
+        endpoints: List[str],
+        policy: Union[str, BalancingPolicy] = "round_robin",
+        max_failures: int = 3,
+        ejection_time: float = 30,
+        hedge: bool = False,
+        hedge_quantile: float = 0.95,
+        hedge_min_samples: int = 20,
+    ):
+        if not endpoints:
+            raise ValueError("A ReplicaSet needs at least one endpoint")
+        self.replicas = [Replica(url) for url in endpoints]
+        self.policy = BALANCING_POLICIES[policy]() if isinstance(policy, str) else policy
+        self.max_failures = max_failures
+        self.ejection_time = ejection_time
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies = LatencySketch()
+        self._previous_latencies = None  # sketch of the previous window, used until the current one is full
+        self.metrics = LoadBalancerMetrics("replicas")
+
+    def bind(self, name: str) -> None:
+        """Label the metrics after the node of the replicas."""
+        self.metrics = LoadBalancerMetrics(name)
+
+    @property
+    def endpoints(self) -> List[str]:
+        return [replica.url for replica in self.replicas]
+
+    def acquire(self, exclude: Optional[Replica] = None) -> Optional[Replica]:
+        """Choose the replica of a new request, None when only `exclude` could be chosen."""
+        now = time.monotonic()
+        candidates = [replica for replica in self.replicas if replica is not exclude]
+        available = [replica for replica in candidates if replica.available(now)] or candidates
+        if not available:
+            return None
+        replica = self.policy.choose(available)
+        replica.outstanding += 1
+        self.metrics.request_update(replica.url)
+        return replica
+
+    def release(self, replica: Replica, latency: Optional[float], ok: bool = True) -> None:
+        """Account the end of a request, a None latency for a cancelled request."""
+        replica.outstanding -= 1
+        if latency is None:
+            return
+        if not ok:
+            replica.failures += 1
+            if replica.failures >= self.max_failures and replica.available(time.monotonic()):
+                logger.warning(f"{replica.url} failed {replica.failures} times in a row, ejected")
+                replica.ejected_until = time.monotonic() + self.ejection_time
+                # on its return, the replica is ejected again by its next failure
+                replica.failures = self.max_failures - 1
+                self.metrics.ejection_update(replica.url)
+            return
+        replica.failures = 0
+        replica.latency = (
+            latency
+            if replica.latency is None
+            else (1 - self.LATENCY_DECAY) * replica.latency + self.LATENCY_DECAY * latency
+        )
+        if self.hedge:
+            if self._latencies.count >= self.HEDGE_WINDOW:
+                self._previous_latencies, self._latencies = self._latencies, LatencySketch()
+            self._latencies.add(latency)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds before a hedged request is sent, None while too few latencies were measured."""
+        sketch = self._latencies
+        if sketch.count < self.hedge_min_samples and self._previous_latencies is not None:
+            sketch = self._previous_latencies
+        if sketch.count < self.hedge_min_samples:
+            return None
+        return sketch.quantile(self.hedge_quantile)
+
+    async def _attempt(self, replica: Replica, send: Callable[[str], Awaitable[Tuple]]) -> Tuple:
+        start = time.perf_counter()
+        try:
+            result = await send(replica.url)
+        except asyncio.CancelledError:
+            self.release(replica, None)
+            raise
+        except Exception:
+            self.release(replica, time.perf_counter() - start, ok=False)
+            raise
+        self.release(replica, time.perf_counter() - start, ok=result[0] < 500)
+        return result
+
+    async def call(self, send: Callable[[str], Awaitable[Tuple]]) -> Tuple:
+        """Run `send(url)` on a replica, hedged if enabled. `send` returns a tuple whose first item is the
+        HTTP status of the reply."""
+        first = self.acquire()
+        delay = self.hedge_delay() if self.hedge and len(self.replicas) > 1 else None
+        if delay is None:
+            return await self._attempt(first, send)
+        pending = {asyncio.create_task(self._attempt(first, send))}
+        hedged = None
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                second = self.acquire(exclude=first)
+                if second is not None:
+                    hedged = asyncio.create_task(self._attempt(second, send))
+                    pending.add(hedged)
+                    self.metrics.hedge_update()
+            last = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    last = task
+                    if task.exception() is None and task.result()[0] < 500:
+                        if task is hedged:
+                            self.metrics.hedge_win_update()
+                        return task.result()
+            # every attempt failed, report the last failure
+            return last.result()
+        finally:
+            for task in pending:
+                task.cancel()
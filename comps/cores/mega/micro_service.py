@@ -4,14 +4,27 @@
 import asyncio
 import multiprocessing
 import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
 from collections import defaultdict, deque
 from enum import Enum
-from typing import Any, List, Optional, Type
+from typing import Any, Dict, List, Optional, Type, Union
+
+from fastapi import HTTPException
+from prometheus_client import Gauge, Histogram
 
 from ..proto.docarray import TextDoc
+from .admission import AdmissionController
+from .base_statistics import dump_statistics, dump_statistics_periodically, set_statistics_dir
+from .cache import BaseCache
 from .constants import ServiceRoleType, ServiceType
 from .logger import CustomLogger
-from .utils import check_ports_availability
+from .serialization import fast_endpoint
+from .utils import check_ports_availability, get_numa_cpus
 
 opea_microservices = {}
 
@@ -19,6 +32,55 @@ logger = CustomLogger("micro_service")
 logflag = os.getenv("LOGFLAG", False)
 
 
+class BatchingMetrics:
+    # Metrics are class members for the same reasons as OrchestratorMetrics,
+    # microservices are told apart with the "service" label
+    batch_size = Histogram(
+        "microservice_batch_size",
+        "Requests per dynamic batch (histogram)",
+        ["service", "service_type"],
+        buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+    )
+    queue_latency = Histogram(
+        "microservice_batch_queue_latency",
+        "Time a request waited for its dynamic batch to be dispatched (histogram)",
+        ["service", "service_type"],
+        buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+    )
+    infer_latency = Histogram(
+        "microservice_batch_infer_latency",
+        "Inference time of a dynamic batch (histogram)",
+        ["service", "service_type"],
+    )
+    queue_size = Gauge("microservice_batch_queue_size", "Requests waiting to be batched (gauge)", ["service"])
+
+    def __init__(self, service_name: str) -> None:
+        self.service_name = service_name
+
+    def dispatch_update(self, service_type: Enum, batch: list[dict], dispatch_time: float) -> None:
+        labels = (self.service_name, str(service_type))
+        self.batch_size.labels(*labels).observe(len(batch))
+        queue_latency = self.queue_latency.labels(*labels)
+        for req in batch:
+            queue_latency.observe(dispatch_time - req["enqueue_time"])
+
+    def infer_update(self, service_type: Enum, infer_start: float) -> None:
+        self.infer_latency.labels(self.service_name, str(service_type)).observe(time.monotonic() - infer_start)
+
+
+class BatchQueue(deque):
+    """Requests of one service type waiting to be batched, appending wakes up the batch scheduler."""
+
+    def __init__(self, wakeup: asyncio.Event):
+        super().__init__()
+        self.wakeup = wakeup
+
+    def append(self, req: dict) -> None:
+        req.setdefault("enqueue_time", time.monotonic())
+        super().append(req)
+        self.wakeup.set()
+
+
 class MicroService:
     """MicroService class to create a microservice."""
 
@@ -40,10 +102,42 @@ class MicroService:
         use_remote_service: Optional[bool] = False,
         description: Optional[str] = None,
         dynamic_batching: bool = False,
-        dynamic_batching_timeout: int = 1,
+        dynamic_batching_timeout: float = 1,
         dynamic_batching_max_batch_size: int = 32,
+        dynamic_batching_max_inflight: int = 1,
+        dynamic_batching_max_queue_size: Optional[int] = None,
+        dynamic_batching_priorities: Optional[Dict[Enum, int]] = None,
+        cache: Optional[BaseCache] = None,
+        workers: int = 1,
+        cpu_affinity: Optional[Union[str, List[List[int]]]] = None,
+        graceful_timeout: float = 30,
+        admission_control: Optional[AdmissionController] = None,
+        fast_serialization: Optional[bool] = None,
     ):
-        """Init the microservice."""
+        """Init the microservice.
+
+        `workers` > 1 pre-forks worker processes which accept connections on the same listening socket.
+        `cpu_affinity` pins them: "core" gives each worker one of the allowed CPUs, "numa" the CPUs of one
+        NUMA node, or an explicit list of CPU lists used round robin. `restart()` (or SIGHUP to the
+        parent process) replaces the workers one at a time, each gets `graceful_timeout` seconds to
+        finish its requests.
+
+        With `dynamic_batching`, requests queued in `request_buffer` (see `dynamic_batching_submit`) are
+        batched per service type: a batch is dispatched once it holds `dynamic_batching_max_batch_size`
+        requests or its oldest request waited `dynamic_batching_timeout` seconds, at most
+        `dynamic_batching_max_inflight` batches run at once, and service types with a higher
+        `dynamic_batching_priorities` value are dispatched first.
+
+        `cache` opts the service in to result caching when it is added to a ServiceOrchestrator,
+        only set it for deterministic services.
+
+        `admission_control` bounds the concurrent requests to `endpoint` and sheds the excess load, see
+        AdmissionController and `add_admission_control()` for the other endpoints.
+
+        `fast_serialization` (default: the MICROSERVICE_FAST_SERIALIZATION env var) routes the handlers
+        through `serialization.fast_endpoint`: the body model is validated from the raw JSON by a
+        precompiled validator and model results are serialized without being re-validated.
+        """
         self.name = f"{name}/{self.__class__.__name__}" if name else self.__class__.__name__
         self.service_role = service_role
         self.service_type = service_type
@@ -58,6 +152,18 @@ class MicroService:
         self.dynamic_batching = dynamic_batching
         self.dynamic_batching_timeout = dynamic_batching_timeout
         self.dynamic_batching_max_batch_size = dynamic_batching_max_batch_size
+        self.dynamic_batching_max_inflight = dynamic_batching_max_inflight
+        self.dynamic_batching_max_queue_size = dynamic_batching_max_queue_size
+        self.dynamic_batching_priorities = dynamic_batching_priorities or {}
+        self.cache = cache
+        self.workers = workers
+        self.cpu_affinity = cpu_affinity
+        self.graceful_timeout = graceful_timeout
+        if fast_serialization is None:
+            fast_serialization = os.getenv("MICROSERVICE_FAST_SERIALIZATION", "false").lower() in ("true", "1")
+        self.fast_serialization = fast_serialization
+        self.processes = []
+        self.statistics_dir = None
         self.uvicorn_kwargs = {}
 
         if ssl_keyfile:
@@ -73,10 +179,15 @@ class MicroService:
 
             self.server = self._get_server()
             self.app = self.server.app
+            if admission_control is not None:
+                self.add_admission_control(endpoint, admission_control)
             # create a batch request processor loop if using dynamic batching
             if self.dynamic_batching:
                 self.buffer_lock = asyncio.Lock()
-                self.request_buffer = defaultdict(deque)
+                self._batch_wakeup = asyncio.Event()
+                self.request_buffer = defaultdict(lambda: BatchQueue(self._batch_wakeup))
+                self.batching_metrics = BatchingMetrics(self.name)
+                self.batching_metrics.queue_size.labels(self.name).set_function(self.dynamic_batching_queue_size)
 
                 @self.app.on_event("startup")
                 async def startup_event():
@@ -87,36 +198,117 @@ class MicroService:
             self.event_loop.run_until_complete(self._async_setup())
 
     async def _dynamic_batch_processor(self):
+        """Dispatch a batch as soon as it is full, or once its oldest request waited `dynamic_batching_timeout`.
+
+        Up to `dynamic_batching_max_inflight` batches run concurrently, when several service types are
+        ready they are dispatched in `dynamic_batching_priorities` order.
+        """
         if logflag:
             logger.info("dynamic batch processor looping...")
+        inflight = set()
         while True:
-            await asyncio.sleep(self.dynamic_batching_timeout)
-            runtime_batch: dict[Enum, list[dict]] = {}  # {ServiceType.Embedding: [{"request": xx, "response": yy}, {}]}
-
+            # cleared before scanning the buffer so that no append is missed, the lock is held by
+            # handlers which append to `request_buffer` directly
+            self._batch_wakeup.clear()
             async with self.buffer_lock:
-                # prepare the runtime batch, access to buffer is locked
-                if self.request_buffer:
-                    for service_type, request_lst in self.request_buffer.items():
+                now = time.monotonic()
+                deadline = None
+                for service_type in sorted(
+                    self.request_buffer, key=lambda t: -self.dynamic_batching_priorities.get(t, 0)
+                ):
+                    request_lst = self.request_buffer[service_type]
+                    self._drop_cancelled(request_lst)
+                    while request_lst and len(inflight) < self.dynamic_batching_max_inflight:
+                        if (
+                            len(request_lst) < self.dynamic_batching_max_batch_size
+                            and now - request_lst[0]["enqueue_time"] < self.dynamic_batching_timeout
+                        ):
+                            break
                         batch = []
-                        # grab min(MAX_BATCH_SIZE, REQUEST_SIZE) requests from buffer
-                        for _ in range(min(self.dynamic_batching_max_batch_size, len(request_lst))):
-                            batch.append(request_lst.popleft())
-
-                        runtime_batch[service_type] = batch
-
-            # Run batched inference on the batch and set results
-            for service_type, batch in runtime_batch.items():
-                if not batch:
-                    continue
-                results = await self.dynamic_batching_infer(service_type, batch)
+                        while request_lst and len(batch) < self.dynamic_batching_max_batch_size:
+                            req = request_lst.popleft()
+                            # the future is cancelled when the client went away
+                            if not req["response"].done():
+                                batch.append(req)
+                        if batch:
+                            inflight.add(asyncio.create_task(self._run_batch(service_type, batch)))
+                        self._drop_cancelled(request_lst)
+                    if request_lst:
+                        ready_at = request_lst[0]["enqueue_time"] + self.dynamic_batching_timeout
+                        deadline = ready_at if deadline is None else min(deadline, ready_at)
+
+            # wait for a new request, the next deadline or, when no batch can be dispatched, a free slot
+            wakeup = asyncio.create_task(self._batch_wakeup.wait())
+            timeout = None
+            if deadline is not None and len(inflight) < self.dynamic_batching_max_inflight:
+                timeout = max(deadline - time.monotonic(), 0)
+            await asyncio.wait({wakeup, *inflight}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            wakeup.cancel()
+            inflight = {task for task in inflight if not task.done()}
+
+    @staticmethod
+    def _drop_cancelled(request_lst: deque) -> None:
+        while request_lst and request_lst[0]["response"].done():
+            request_lst.popleft()
+
+    async def _run_batch(self, service_type: Enum, batch: list[dict]):
+        start = time.monotonic()
+        self.batching_metrics.dispatch_update(service_type, batch, start)
+        try:
+            results = await self.dynamic_batching_infer(service_type, batch)
+        except Exception as e:
+            logger.error(f"dynamic batching inference of {len(batch)} {service_type} requests failed: {e}")
+            for req in batch:
+                if not req["response"].done():
+                    req["response"].set_exception(e)
+            return
+        self.batching_metrics.infer_update(service_type, start)
+
+        results = list(results)
+        if len(results) != len(batch):
+            logger.error(f"dynamic batching inference returned {len(results)} results for {len(batch)} requests")
+        for i, req in enumerate(batch):
+            # the future is cancelled when the client went away
+            if req["response"].done():
+                continue
+            if i < len(results):
+                req["response"].set_result(results[i])
+            else:
+                req["response"].set_exception(RuntimeError("No result returned by dynamic batching inference"))
+
+    async def dynamic_batching_submit(self, service_type: Enum, request: Any) -> Any:
+        """Queue a request for batched inference and wait for its result.
+
+        Raises HTTP 503 when `dynamic_batching_max_queue_size` requests are already waiting.
+        """
+        if self.dynamic_batching_max_queue_size and self.dynamic_batching_queue_size() >= (
+            self.dynamic_batching_max_queue_size
+        ):
+            raise HTTPException(
+                status_code=503, detail="Too many requests waiting to be batched", headers={"Retry-After": "1"}
+            )
+        response_future = asyncio.get_running_loop().create_future()
+        self.request_buffer[service_type].append({"request": request, "response": response_future})
+        return await response_future
 
-                for req, result in zip(batch, results):
-                    req["response"].set_result(result)
+    def dynamic_batching_queue_size(self) -> int:
+        return sum(len(request_lst) for request_lst in self.request_buffer.values())
 
     async def dynamic_batching_infer(self, service_type: Enum, batch: list[dict]):
         """Need to implement."""
         raise NotImplementedError("Unimplemented dynamic batching inference!")
 
+    def add_route(self, endpoint: str, handler, methods: List[str] = ["POST"]):
+        self._validate_env()
+        if self.fast_serialization:
+            handler = fast_endpoint(handler)
+        self.app.router.add_api_route(endpoint, handler, methods=methods)
+
+    def add_admission_control(self, endpoint: str, controller: AdmissionController):
+        """Limit the concurrent requests to `endpoint`, one controller per endpoint."""
+        self._validate_env()
+        self.server.add_admission_control(endpoint, controller)
+
     def _validate_env(self):
         """Check whether to use the microservice locally."""
         if self.use_remote_service:
@@ -176,10 +368,83 @@ class MicroService:
         if in_single_process:
             # Resolve HPU segmentation fault and potential tokenizer issues by limiting to same process
             self.run()
+        elif self.workers > 1:
+            if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+                logger.warning(
+                    f"{self.name} runs {self.workers} workers without PROMETHEUS_MULTIPROC_DIR, "
+                    "/metrics only reports the worker serving the scrape"
+                )
+            self.statistics_dir = tempfile.mkdtemp(prefix="opea-statistics-")
+            self.processes = [self._start_worker(worker_id) for worker_id in range(self.workers)]
+            self.process = self.processes[0]
+            if threading.current_thread() is threading.main_thread():
+                signal.signal(signal.SIGHUP, lambda *_: self.restart())
         else:
             self.process = multiprocessing.Process(target=self.run, daemon=False, name=self.name)
             self.process.start()
 
+    def _start_worker(self, worker_id: int) -> multiprocessing.Process:
+        process = multiprocessing.Process(
+            target=self._run_worker, args=(worker_id,), daemon=False, name=f"{self.name}-{worker_id}"
+        )
+        process.start()
+        return process
+
+    def _worker_cpus(self, worker_id: int) -> Optional[List[int]]:
+        if self.cpu_affinity is None:
+            return None
+        if self.cpu_affinity == "core":
+            cpus = sorted(os.sched_getaffinity(0))
+            return [cpus[worker_id % len(cpus)]]
+        if self.cpu_affinity == "numa":
+            nodes = get_numa_cpus()
+            return nodes[worker_id % len(nodes)]
+        return self.cpu_affinity[worker_id % len(self.cpu_affinity)]
+
+    def _run_worker(self, worker_id: int):
+        """Serve on the listening socket inherited from the parent until SIGTERM, then shutdown gracefully."""
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        cpus = self._worker_cpus(worker_id)
+        if cpus:
+            os.sched_setaffinity(0, cpus)
+        if logflag:
+            logger.info(f"{self.name} worker {worker_id} (pid {os.getpid()}) pinned to {cpus}")
+
+        # The event loop forked from the parent shares its epoll instance and self-pipe with all the other
+        # workers, a closing worker would unregister the listening socket for everyone. Each worker serves
+        # the inherited socket from its own loop instead.
+        sockets = [socket.socket(fileno=os.dup(sock.fileno())) for sock in self.server.listening_sockets]
+        self.event_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.event_loop)
+        self.event_loop.run_until_complete(self.server.initialize_server(sockets=sockets))
+
+        set_statistics_dir(self.statistics_dir)
+        stats_task = self.event_loop.create_task(dump_statistics_periodically())
+        signal.signal(signal.SIGTERM, lambda *args: self.server.request_exit())
+        self.run()
+        # finishes the in-flight requests and runs the shutdown events
+        stats_task.cancel()
+        self.event_loop.run_until_complete(self._async_teardown())
+        dump_statistics()
+        if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+            from prometheus_client import multiprocess
+
+            multiprocess.mark_process_dead(os.getpid())
+
+    def restart(self):
+        """Rolling restart, replace the workers one at a time while the others keep serving."""
+        for worker_id, old_process in enumerate(self.processes):
+            self.processes[worker_id] = self._start_worker(worker_id)
+            self._stop_worker(old_process)
+        self.process = self.processes[0]
+
+    def _stop_worker(self, process: multiprocessing.Process):
+        process.terminate()
+        process.join(self.graceful_timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
     async def _async_teardown(self):
         """Shutdown the server."""
         self._validate_env()
@@ -191,7 +456,11 @@ class MicroService:
         self.event_loop.stop()
         self.event_loop.close()
         self.server.logger.close()
-        if self.process.is_alive():
+        if self.processes:
+            for process in self.processes:
+                self._stop_worker(process)
+            shutil.rmtree(self.statistics_dir, ignore_errors=True)
+        elif self.process.is_alive():
             self.process.terminate()
 
     @property
@@ -215,8 +484,17 @@ def register_microservice(
     provider_endpoint: Optional[str] = None,
     methods: List[str] = ["POST"],
     dynamic_batching: bool = False,
-    dynamic_batching_timeout: int = 1,
+    dynamic_batching_timeout: float = 1,
     dynamic_batching_max_batch_size: int = 32,
+    dynamic_batching_max_inflight: int = 1,
+    dynamic_batching_max_queue_size: Optional[int] = None,
+    dynamic_batching_priorities: Optional[Dict[Enum, int]] = None,
+    cache: Optional[BaseCache] = None,
+    workers: int = 1,
+    cpu_affinity: Optional[Union[str, List[List[int]]]] = None,
+    graceful_timeout: float = 30,
+    admission_control: Optional[AdmissionController] = None,
+    fast_serialization: Optional[bool] = None,
 ):
     def decorator(func):
         if name not in opea_microservices:
@@ -237,9 +515,20 @@ def register_microservice(
                 dynamic_batching=dynamic_batching,
                 dynamic_batching_timeout=dynamic_batching_timeout,
                 dynamic_batching_max_batch_size=dynamic_batching_max_batch_size,
+                dynamic_batching_max_inflight=dynamic_batching_max_inflight,
+                dynamic_batching_max_queue_size=dynamic_batching_max_queue_size,
+                dynamic_batching_priorities=dynamic_batching_priorities,
+                cache=cache,
+                workers=workers,
+                cpu_affinity=cpu_affinity,
+                graceful_timeout=graceful_timeout,
+                admission_control=admission_control,
+                fast_serialization=fast_serialization,
             )
             opea_microservices[name] = micro_service
-        opea_microservices[name].app.router.add_api_route(endpoint, func, methods=methods)
+        elif admission_control is not None:
+            opea_microservices[name].add_admission_control(endpoint, admission_control)
+        opea_microservices[name].add_route(endpoint, func, methods=methods)
 
         return func
 
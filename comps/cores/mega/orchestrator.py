@@ -1,24 +1,44 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import ast
 import asyncio
+import atexit
 import copy
+import hashlib
+import inspect
 import json
 import os
 import re
 import time
-from typing import Dict, List
+from collections import deque
+from typing import Dict, List, Optional
 
 import aiohttp
-import requests
+from docarray import BaseDoc
 from fastapi.responses import StreamingResponse
-from prometheus_client import Gauge, Histogram
+from opentelemetry import propagate, trace
+from prometheus_client import Counter, Gauge, Histogram
 from pydantic import BaseModel
 
 from ..proto.docarray import LLMParams
+from ..proto.embedding_encoding import accept_header
+from ..telemetry.opea_telemetry import request_span, start_request_span
+from .cache import BaseCache
 from .constants import ServiceType
-from .dag import DAG
+from .dag import DAG, RuntimeDAG
+from .load_balancer import ReplicaSet
 from .logger import CustomLogger
+from .serialization import json_dumps, json_loads
+from .streaming import (
+    DONE_EVENT,
+    SSE_COALESCE_MAX_BYTES,
+    SSE_COALESCE_WINDOW_MS,
+    SSEEncoder,
+    StreamingMetrics,
+    decode_json_event,
+    pack_tokens,
+)
 
 logger = CustomLogger("comps-core-orchestrator")
 LOGFLAG = os.getenv("LOGFLAG", False)
@@ -34,6 +54,19 @@ class OrchestratorMetrics:
     inter_token_latency = Histogram("megaservice_inter_token_latency", "Inter-token latency (histogram)")
     request_latency = Histogram("megaservice_request_latency", "Whole request/reply latency (histogram)")
     request_pending = Gauge("megaservice_request_pending", "Count of currently pending requests (gauge)")
+    connection_wait_latency = Histogram(
+        "megaservice_connection_wait_latency",
+        "Time waiting for a pooled connection to a microservice (histogram)",
+        ["service"],
+    )
+    connections_created = Counter(
+        "megaservice_connections_created", "Count of new connections to a microservice (counter)", ["service"]
+    )
+    connections_reused = Counter(
+        "megaservice_connections_reused",
+        "Count of requests served on a reused keep-alive connection to a microservice (counter)",
+        ["service"],
+    )
 
     def __init__(self) -> None:
         pass
@@ -55,19 +88,198 @@ class OrchestratorMetrics:
         else:
             self.request_pending.dec()
 
+    def connection_wait_update(self, service_name: str, wait_start: float) -> None:
+        self.connection_wait_latency.labels(service_name).observe(time.time() - wait_start)
+
+    def connection_update(self, service_name: str, reused: bool) -> None:
+        if reused:
+            self.connections_reused.labels(service_name).inc()
+        else:
+            self.connections_created.labels(service_name).inc()
+
+
+class ConnectionPool:
+    """Long-lived aiohttp sessions shared by all requests of an orchestrator, one session per microservice.
+
+    Keeping the sessions across requests preserves keep-alive connections, the DNS cache and TLS sessions.
+    Each microservice gets at most `limit_per_service` concurrent connections (0 for no limit), further
+    requests wait for a free connection. Streaming LLM/LVM nodes hold their connection for the whole
+    generation and are therefore left unlimited unless a limit is set for them.
+    """
+
+    _open_pools = set()  # pools with sessions left to close at exit
+
+    def __init__(
+        self,
+        metrics: OrchestratorMetrics,
+        limit_per_service: int = int(os.getenv("MEGASERVICE_CONNECTION_LIMIT", 100)),
+        keepalive_timeout: float = float(os.getenv("MEGASERVICE_KEEPALIVE_TIMEOUT", 60)),
+        dns_cache_ttl: int = int(os.getenv("MEGASERVICE_DNS_CACHE_TTL", 300)),
+        timeout: float = 1000,
+    ) -> None:
+        self.metrics = metrics
+        self.limit_per_service = limit_per_service
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        # bound the wait for each read rather than the whole request, streams may run for long
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+        self.service_limits = {}  # service name -> max connections
+        self._sessions = {}  # service name -> aiohttp.ClientSession
+        self._counts = {}  # service name -> {"created": n, "reused": n}
+        self._closing = set()  # tasks closing the sessions of a previous loop
+        self._loop = None
+
+    def set_limit(self, service_name: str, limit: int) -> None:
+        self.service_limits[service_name] = limit
+
+    async def open(self) -> None:
+        """Bind the pool to the running event loop, e.g. on gateway startup."""
+        if self._loop is not asyncio.get_running_loop():
+            self._detach()
+
+    async def close(self) -> None:
+        """Close all pooled connections, e.g. on gateway shutdown."""
+        sessions, self._sessions = self._sessions, {}
+        await self._close_sessions(sessions.values())
+        self._counts = {}
+        self._loop = None
+        ConnectionPool._open_pools.discard(self)
+
+    @staticmethod
+    async def _close_sessions(sessions) -> None:
+        for session in sessions:
+            await session.close()
+
+    def _detach(self) -> None:
+        # sessions are bound to the loop that created them and cannot be reused from another one
+        sessions, self._sessions = self._sessions, {}
+        old_loop, self._loop = self._loop, asyncio.get_running_loop()
+        self._counts = {}
+        if not sessions:
+            return
+        if old_loop is None or old_loop.is_closed():
+            # the connections went away with their loop, closing only releases the connectors
+            task = self._loop.create_task(self._close_sessions(sessions.values()))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+        else:
+            asyncio.run_coroutine_threadsafe(self._close_sessions(sessions.values()), old_loop)
+
+    @classmethod
+    def _close_at_exit(cls) -> None:
+        for pool in list(cls._open_pools):
+            loop = pool._loop
+            if not pool._sessions or loop is None or loop.is_running():
+                continue
+            if loop.is_closed():
+                asyncio.run(pool.close())
+            else:
+                loop.run_until_complete(pool.close())
+
+    def _trace_config(self, service_name: str) -> aiohttp.TraceConfig:
+        counts = self._counts.setdefault(service_name, {"created": 0, "reused": 0})
+
+        async def on_request_start(session, ctx, params):
+            ctx.wait_start = time.time()
+
+        def on_connection_acquired(reused: bool):
+            key = "reused" if reused else "created"
+
+            async def hook(session, ctx, params):
+                counts[key] += 1
+                self.metrics.connection_update(service_name, reused)
+                self.metrics.connection_wait_update(service_name, ctx.wait_start)
+
+            return hook
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_reuseconn.append(on_connection_acquired(reused=True))
+        trace_config.on_connection_create_end.append(on_connection_acquired(reused=False))
+        return trace_config
+
+    def session(self, service_name: str) -> aiohttp.ClientSession:
+        """Get the pooled session of a microservice, must be called from within the event loop."""
+        if self._loop is not asyncio.get_running_loop():
+            self._detach()
+        session = self._sessions.get(service_name)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.service_limits.get(service_name, self.limit_per_service),
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl,
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                trust_env=True,
+                json_serialize=json_dumps,
+                trace_configs=[self._trace_config(service_name)],
+            )
+            self._sessions[service_name] = session
+            ConnectionPool._open_pools.add(self)
+        return session
+
+    def stats(self) -> Dict:
+        """Created/reused connection count per microservice since the pool was bound to its loop."""
+        return {service_name: dict(self._counts[service_name]) for service_name in self._sessions}
+
+
+atexit.register(ConnectionPool._close_at_exit)
+
 
 class ServiceOrchestrator(DAG):
     """Manage 1 or N micro services in a DAG through Python API."""
 
-    def __init__(self) -> None:
+    def __init__(self, response_cache: Optional[BaseCache] = None) -> None:
         self.metrics = OrchestratorMetrics()
+        self.stream_metrics = StreamingMetrics("megaservice")
+        self.connection_pool = ConnectionPool(self.metrics)
+        self.response_cache = response_cache  # optional, final answers keyed by the request
         self.services = {}  # all services, id -> service
+        self.node_caches = {}  # opt-in per-node result caches, id -> cache
+        self.replica_sets = {}  # nodes served by several replicas, id -> ReplicaSet
+        # float32/float16: ask the embedding nodes for binary embeddings, forwarded as is to the next nodes
+        self.embedding_dtype = os.getenv("MEGASERVICE_BINARY_EMBEDDINGS")
         super().__init__()
 
-    def add(self, service):
+    def add(
+        self,
+        service,
+        connection_limit: Optional[int] = None,
+        cache: Optional[BaseCache] = None,
+        replicas: Optional[ReplicaSet] = None,
+    ):
+        """Add a service node.
+
+        :param connection_limit: max concurrent connections to the service, 0 for no limit. Defaults to
+            `MEGASERVICE_CONNECTION_LIMIT`, except for LLM/LVM services which are unlimited since each
+            streamed generation holds a connection.
+        :param cache: memoize the node outputs keyed by its aligned inputs, only for deterministic
+            services (e.g. embedding, retrieval, reranking). Defaults to the `cache` of the MicroService.
+            A cache left with the default name is renamed after the node.
+        :param replicas: endpoints of several replicas of the service to balance the requests over, used
+            instead of the `endpoint_path` of the service. The connection limit applies to all of them.
+        """
         if service.name not in self.services:
             self.services[service.name] = service
             self.add_node_if_not_exists(service.name)
+            if connection_limit is None and getattr(service, "service_type", None) in (
+                ServiceType.LLM,
+                ServiceType.LVM,
+            ):
+                connection_limit = 0
+            if connection_limit is not None:
+                self.connection_pool.set_limit(service.name, connection_limit)
+            cache = cache if cache is not None else getattr(service, "cache", None)
+            if cache is not None:
+                if cache.name == "response":
+                    # label an unnamed node cache after its node rather than as the response cache
+                    cache.rename(service.name)
+                self.node_caches[service.name] = cache
+            if replicas is not None:
+                replicas.bind(service.name)
+                self.replica_sets[service.name] = replicas
         else:
             raise Exception(f"Service {service.name} already exists!")
         return self
@@ -81,83 +293,235 @@ class ServiceOrchestrator(DAG):
             return False
 
     async def schedule(self, initial_inputs: Dict | BaseModel, llm_parameters: LLMParams = LLMParams(), **kwargs):
+        with request_span("schedule", {"opea.streaming": bool(llm_parameters.streaming)}):
+            return await self._schedule(initial_inputs, llm_parameters, **kwargs)
+
+    async def _schedule(self, initial_inputs: Dict | BaseModel, llm_parameters: LLMParams, **kwargs):
+        if self.response_cache is not None:
+            cache_key = self.response_cache_key(initial_inputs, llm_parameters, **kwargs)
+            cached = await self.response_cache.get(cache_key)
+            if cached is not None:
+                return self.replay_response(cached, llm_parameters)
+
         req_start = time.time()
         self.metrics.pending_update(True)
 
         result_dict = {}
-        runtime_graph = DAG()
-        runtime_graph.graph = copy.deepcopy(self.graph)
+        plan = self.compile()
+        runtime_graph = RuntimeDAG(plan)
+        in_degree = list(plan.in_degree)  # count of unfinished predecessors per node index
         if LOGFLAG:
             logger.info(initial_inputs)
 
-        timeout = aiohttp.ClientTimeout(total=1000)
-        async with aiohttp.ClientSession(trust_env=True, timeout=timeout) as session:
-            pending = {
-                asyncio.create_task(
-                    self.execute(session, req_start, node, initial_inputs, runtime_graph, llm_parameters, **kwargs)
+        pending = {
+            asyncio.create_task(
+                self.execute(
+                    self.connection_pool.session(node),
+                    req_start,
+                    node,
+                    initial_inputs,
+                    runtime_graph,
+                    llm_parameters,
+                    **kwargs,
                 )
-                for node in self.ind_nodes()
-            }
-            ind_nodes = self.ind_nodes()
-
-            while pending:
-                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
-                for done_task in done:
-                    response, node = await done_task
-                    result_dict[node] = response
-
-                    # traverse the current node's downstream nodes and execute if all one's predecessors are finished
-                    downstreams = runtime_graph.downstream(node)
-
-                    # remove all the black nodes that are skipped to be forwarded to
-                    if not isinstance(response, StreamingResponse) and "downstream_black_list" in response:
-                        for black_node in response["downstream_black_list"]:
-                            for downstream in reversed(downstreams):
-                                try:
-                                    if re.findall(black_node, downstream):
-                                        if LOGFLAG:
-                                            logger.info(f"skip forwardding to {downstream}...")
-                                        runtime_graph.delete_edge(node, downstream)
-                                        downstreams.remove(downstream)
-                                except re.error as e:
-                                    logger.error("Pattern invalid! Operation cancelled.")
-                            if len(downstreams) == 0 and llm_parameters.streaming:
-                                # turn the response to a StreamingResponse
-                                # to make the response uniform to UI
-                                def fake_stream(text):
-                                    yield "data: b'" + text + "'\n\n"
-                                    yield "data: [DONE]\n\n"
-
-                                result_dict[node] = StreamingResponse(
-                                    fake_stream(response["text"]), media_type="text/event-stream"
-                                )
+            )
+            for node in (plan.nodes[u] for u in plan.ind_nodes)
+        }
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for done_task in done:
+                response, node = await done_task
+                result_dict[node] = response
+
+                # traverse the current node's downstream nodes and execute if all one's predecessors are finished
+                downstreams = runtime_graph.downstream(node)
+                candidates = list(downstreams)
+                for d_node in candidates:
+                    in_degree[plan.index[d_node]] -= 1
+
+                # remove all the black nodes that are skipped to be forwarded to
+                if not isinstance(response, StreamingResponse) and "downstream_black_list" in response:
+                    for black_node in response["downstream_black_list"]:
+                        for downstream in reversed(downstreams):
+                            try:
+                                if re.findall(black_node, downstream):
+                                    if LOGFLAG:
+                                        logger.info(f"skip forwardding to {downstream}...")
+                                    runtime_graph.delete_edge(node, downstream)
+                                    downstreams.remove(downstream)
+                            except re.error as e:
+                                logger.error("Pattern invalid! Operation cancelled.")
+                        if len(downstreams) == 0 and llm_parameters.streaming:
+                            # turn the response to a StreamingResponse
+                            # to make the response uniform to UI
+                            def fake_stream(text):
+                                yield "data: b'" + text + "'\n\n"
+                                yield "data: [DONE]\n\n"
+
+                            result_dict[node] = StreamingResponse(
+                                fake_stream(response["text"]), media_type="text/event-stream"
+                            )
 
-                    for d_node in downstreams:
-                        if all(i in result_dict for i in runtime_graph.predecessors(d_node)):
-                            inputs = self.process_outputs(runtime_graph.predecessors(d_node), result_dict)
-                            pending.add(
-                                asyncio.create_task(
-                                    self.execute(
-                                        session, req_start, d_node, inputs, runtime_graph, llm_parameters, **kwargs
-                                    )
+                for d_node in candidates:
+                    if in_degree[plan.index[d_node]]:
+                        continue
+                    # predecessors whose edge was pruned do not feed the node
+                    predecessors = runtime_graph.predecessors(d_node)
+                    if predecessors:
+                        inputs = self.process_outputs(predecessors, result_dict)
+                        pending.add(
+                            asyncio.create_task(
+                                self.execute(
+                                    self.connection_pool.session(d_node),
+                                    req_start,
+                                    d_node,
+                                    inputs,
+                                    runtime_graph,
+                                    llm_parameters,
+                                    **kwargs,
                                 )
                             )
-        nodes_to_keep = []
-        for i in ind_nodes:
-            nodes_to_keep.append(i)
-            nodes_to_keep.extend(runtime_graph.all_downstreams(i))
-
-        all_nodes = list(runtime_graph.graph.keys())
-
-        for node in all_nodes:
-            if node not in nodes_to_keep:
-                runtime_graph.delete_node_if_exists(node)
+                        )
+        runtime_graph.prune_unreachable()
 
         if not llm_parameters.streaming:
             self.metrics.pending_update(False)
 
+        if self.response_cache is not None:
+            await self.cache_response(cache_key, result_dict, runtime_graph)
+
         return result_dict, runtime_graph
 
+    async def invalidate_cache(self, nodes: Optional[List[str]] = None, service_types: Optional[List] = None):
+        """Clear the node caches and the response cache, e.g. after new documents were ingested.
+
+        :param nodes: only clear the caches of these nodes.
+        :param service_types: only clear the caches of the nodes of these ServiceTypes.
+        With neither, every cache is cleared. The response cache is always cleared since
+        the final answers depend on all the nodes.
+        """
+        cleared = []
+        for node, cache in self.node_caches.items():
+            if nodes is not None and node not in nodes:
+                continue
+            if service_types is not None and self.services[node].service_type not in service_types:
+                continue
+            await cache.clear()
+            cleared.append(node)
+        if self.response_cache is not None:
+            await self.response_cache.clear()
+        if LOGFLAG:
+            logger.info(f"cleared the caches of {cleared}")
+        return cleared
+
+    def node_cache_key(self, input_data: Dict) -> str:
+        """Hash of the aligned inputs of a node, random document ids are left out."""
+
+        def strip_ids(value):
+            if isinstance(value, dict):
+                return {k: strip_ids(v) for k, v in value.items() if k != "id"}
+            if isinstance(value, (list, tuple)):
+                return [strip_ids(v) for v in value]
+            return value
+
+        data = json.dumps(strip_ids(input_data), sort_keys=True, default=str)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def response_cache_key(self, initial_inputs: Dict | BaseModel, llm_parameters: LLMParams, **kwargs) -> str:
+        """Hash of the whitespace-normalized inputs and of all the request parameters, except streaming."""
+
+        def normalize(value):
+            if isinstance(value, BaseDoc):
+                value = value.dict(exclude={"id"})
+            elif isinstance(value, BaseModel):
+                value = value.dict()
+            if isinstance(value, str):
+                return " ".join(value.split())
+            if isinstance(value, dict):
+                return {k: normalize(v) for k, v in value.items()}
+            if isinstance(value, (list, tuple)):
+                return [normalize(v) for v in value]
+            return value
+
+        parameters = normalize(llm_parameters)
+        parameters.pop("streaming", None)
+        key = {"inputs": normalize(initial_inputs), "llm_parameters": parameters}
+        key.update({k: normalize(v) for k, v in kwargs.items()})
+        return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    async def cache_response(self, key: str, result_dict: Dict, runtime_graph: DAG):
+        """Store the answer of a single-leaf flow, streams are stored once they were fully sent.
+
+        Nothing is stored unless every node of the request replied with a 2xx status.
+        """
+        leaves = runtime_graph.all_leaves()
+        if len(leaves) != 1 or leaves[0] not in result_dict:
+            return
+        if not all(200 <= status < 300 for status in runtime_graph.status.values()):
+            return
+        node = leaves[0]
+        response = result_dict[node]
+        if isinstance(response, StreamingResponse):
+
+            async def tee(body_iterator):
+                chunks = []
+                async for chunk in body_iterator:
+                    chunks.append(chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk)
+                    yield chunk
+                await self.response_cache.set(key, {"node": node, "chunks": chunks})
+
+            response.body_iterator = tee(response.body_iterator)
+        elif isinstance(response, dict):
+            await self.response_cache.set(key, {"node": node, "output": response})
+
+    def replay_response(self, cached: Dict, llm_parameters: LLMParams):
+        """Turn a cache entry into the (result_dict, runtime_graph) that schedule() would return."""
+        node = cached["node"]
+        runtime_graph = DAG()
+        runtime_graph.add_node(node)
+        chunks, output = cached.get("chunks"), cached.get("output")
+        if chunks is not None:
+            if llm_parameters.streaming:
+
+                async def replay():
+                    for chunk in chunks:
+                        yield chunk
+
+                response = StreamingResponse(replay(), media_type="text/event-stream")
+            else:
+                response = {"text": self.stream_text(chunks)}
+        elif (
+            llm_parameters.streaming
+            and "text" in output
+            and node in self.services
+            and self.services[node].service_type in (ServiceType.LLM, ServiceType.LVM)
+        ):
+            response = StreamingResponse(
+                self.token_generator(output["text"], time.time(), is_first=True, is_last=True),
+                media_type="text/event-stream",
+            )
+        else:
+            response = dict(output)
+        return {node: response}, runtime_graph
+
+    def stream_text(self, chunks: List[str]) -> str:
+        """Join the text of SSE chunks whose events carry the repr of the utf-8 encoded tokens, `data: b'...'`."""
+        text = b""
+        for chunk in chunks:
+            for event in chunk.split("\n\n"):
+                payload = event[len("data: ") :] if event.startswith("data: ") else event
+                if not payload or payload == "[DONE]":
+                    continue
+                if payload.startswith(("b'", 'b"')):
+                    try:
+                        text += ast.literal_eval(payload)
+                        continue
+                    except (SyntaxError, ValueError):
+                        pass
+                text += payload.encode("utf-8")
+        return text.decode("utf-8", errors="replace")
+
     def process_outputs(self, prev_nodes: List, result_dict: Dict) -> Dict:
         all_outputs = {}
 
@@ -175,6 +539,58 @@ class ServiceOrchestrator(DAG):
         runtime_graph: DAG,
         llm_parameters: LLMParams = LLMParams(),
         **kwargs,
+    ):
+        # the span of a streamed node is ended by its generator
+        span = start_request_span(f"execute {cur_node}", {"opea.node": cur_node})
+        with trace.use_span(span, end_on_exit=False):
+            try:
+                response, node = await self._execute(
+                    session, req_start, cur_node, inputs, runtime_graph, llm_parameters, **kwargs
+                )
+            except BaseException:
+                span.end()
+                raise
+        if not isinstance(response, StreamingResponse):
+            span.end()
+        return response, node
+
+    def _trace_headers(self) -> Dict:
+        """W3C trace context of the current span, sent to the microservices."""
+        headers = {}
+        propagate.inject(headers)
+        return headers
+
+    def _record_hop(self, response: aiohttp.ClientResponse, start: float) -> None:
+        """Split the time of a call into the time spent by the microservice, from its Server-Timing header,
+        and the network/queueing time."""
+        span = trace.get_current_span()
+        if not span.is_recording():
+            return
+        total = (time.perf_counter() - start) * 1000
+        span.set_attribute("opea.http.status_code", response.status)
+        span.set_attribute("opea.total_time_ms", total)
+        match = re.search(r"\bapp;dur=([0-9.]+)", response.headers.get("Server-Timing", ""))
+        if match:
+            server = float(match.group(1))
+            span.set_attribute("opea.server_time_ms", server)
+            span.set_attribute("opea.network_time_ms", max(total - server, 0.0))
+
+    async def _call(self, node: str, send):
+        """Run `send(url)` on the endpoint of the node, or on one of its replicas."""
+        replicas = self.replica_sets.get(node)
+        if replicas is None:
+            return await send(self.services[node].endpoint_path)
+        return await replicas.call(send)
+
+    async def _execute(
+        self,
+        session: aiohttp.client.ClientSession,
+        req_start: float,
+        cur_node: str,
+        inputs: Dict,
+        runtime_graph: DAG,
+        llm_parameters: LLMParams,
+        **kwargs,
     ):
         # send the cur_node request/reply
         endpoint = self.services[cur_node].endpoint_path
@@ -187,88 +603,160 @@ class ServiceOrchestrator(DAG):
                 if inputs.get(field) != value:
                     inputs[field] = value
         # pre-process
-        inputs = self.align_inputs(inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs)
+        with request_span("align_inputs"):
+            inputs = self.align_inputs(inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs)
 
         if is_llm_vlm and llm_parameters.streaming:
-            # Still leave to sync requests.post for StreamingResponse
             if LOGFLAG:
                 logger.info(inputs)
-            response = requests.post(
-                url=endpoint,
-                data=json.dumps(inputs),
-                headers={"Content-type": "application/json"},
-                proxies={"http": None},
-                stream=True,
-                timeout=1000,
-            )
+            span = trace.get_current_span()
+            # a generation is not hedged, its replica stays busy until the stream ends
+            replicas = self.replica_sets.get(cur_node)
+            replica = replicas.acquire() if replicas is not None else None
+            post_start = time.perf_counter()
+            try:
+                response = await session.post(
+                    replica.url if replica else endpoint, json=inputs, headers=self._trace_headers()
+                )
+            except BaseException:
+                if replica:
+                    replicas.release(replica, time.perf_counter() - post_start, ok=False)
+                raise
+            header_latency = time.perf_counter() - post_start
+            runtime_graph.status[cur_node] = response.status
+            self._record_hop(response, post_start)
             downstream = runtime_graph.downstream(cur_node)
             if downstream:
                 assert len(downstream) == 1, "Not supported multiple streaming downstreams yet!"
                 cur_node = downstream[0]
                 hitted_ends = [".", "?", "!", "。", "，", "！"]
-                downstream_endpoint = self.services[downstream[0]].endpoint_path
+                downstream_session = self.connection_pool.session(downstream[0])
+
+            async def post_sentence(sentence: str) -> str:
+                headers = {}
+                propagate.inject(headers, context=trace.set_span_in_context(span))
+
+                async def send(url):
+                    async with downstream_session.post(url, json={"text": sentence}, headers=headers) as res:
+                        return res.status, await res.json(loads=json_loads)
 
-            def generate():
+                _, res_json = await self._call(downstream[0], send)
+                if "text" in res_json:
+                    return res_json["text"]
+                raise Exception("Other response types not supported yet!")
+
+            async def generate():
                 token_start = req_start
-                if response:
-                    # response.elapsed = time until first headers received
+                encoder = SSEEncoder()
+                # downstream calls of finished sentences run concurrently, results are yielded in order
+                sentences = deque()
+                try:
                     buffered_chunk_str = ""
                     is_first = True
-                    for chunk in response.iter_content(chunk_size=None):
-                        if chunk:
-                            if downstream:
-                                chunk = chunk.decode("utf-8")
-                                buffered_chunk_str += self.extract_chunk_str(chunk)
-                                is_last = chunk.endswith("[DONE]\n\n")
-                                if (buffered_chunk_str and buffered_chunk_str[-1] in hitted_ends) or is_last:
-                                    res = requests.post(
-                                        url=downstream_endpoint,
-                                        data=json.dumps({"text": buffered_chunk_str}),
-                                        proxies={"http": None},
-                                    )
-                                    res_json = res.json()
-                                    if "text" in res_json:
-                                        res_txt = res_json["text"]
-                                    else:
-                                        raise Exception("Other response types not supported yet!")
-                                    buffered_chunk_str = ""  # clear
-                                    yield from self.token_generator(
-                                        res_txt, token_start, is_first=is_first, is_last=is_last
-                                    )
-                                    token_start = time.time()
-                            else:
-                                yield chunk
-                                token_start = self.metrics.token_update(token_start, is_first)
+                    # is_first stays set until the first sentence is back from downstream, TTFT is recorded once
+                    first_token_recorded = False
+                    async for chunk in self.iter_http_chunks(response):
+                        if not first_token_recorded:
+                            first_token_recorded = True
+                            if span.is_recording():
+                                ttft_ms = (time.perf_counter() - post_start) * 1000
+                                span.set_attribute("opea.time_to_first_token_ms", ttft_ms)
+                                span.add_event("first_token")
+                        if downstream:
+                            chunk = chunk.decode("utf-8")
+                            buffered_chunk_str += self.extract_chunk_str(chunk)
+                            is_last = chunk.endswith("[DONE]\n\n")
+                            if (buffered_chunk_str and buffered_chunk_str[-1] in hitted_ends) or is_last:
+                                sentences.append((asyncio.create_task(post_sentence(buffered_chunk_str)), is_last))
+                                buffered_chunk_str = ""  # clear
+                            while sentences and sentences[0][0].done():
+                                task, is_last = sentences.popleft()
+                                for token in self.token_generator(
+                                    await task, token_start, is_first=is_first, is_last=is_last, encoder=encoder
+                                ):
+                                    yield token
+                                token_start = time.time()
+                                is_first = False
+                        else:
+                            yield chunk
+                            self.stream_metrics.event_update(chunk)
+                            token_start = self.metrics.token_update(token_start, is_first)
                             is_first = False
+                    if buffered_chunk_str:
+                        sentences.append((asyncio.create_task(post_sentence(buffered_chunk_str)), False))
+                    while sentences:
+                        task, is_last = sentences.popleft()
+                        for token in self.token_generator(
+                            await task, token_start, is_first=is_first, is_last=is_last, encoder=encoder
+                        ):
+                            yield token
+                        token_start = time.time()
+                        is_first = False
                     self.metrics.request_update(req_start)
+                finally:
+                    for task, _ in sentences:
+                        task.cancel()
+                    response.release()
+                    if replica:
+                        replicas.release(replica, header_latency, ok=response.status < 500)
                     self.metrics.pending_update(False)
+                    span.end()
 
-            return (
-                StreamingResponse(self.align_generator(generate(), **kwargs), media_type="text/event-stream"),
-                cur_node,
-            )
+            with request_span("align_generator"):
+                generator = self.align_generator(self.wrap_generator(generate()), **kwargs)
+            return StreamingResponse(generator, media_type="text/event-stream"), cur_node
         else:
             if LOGFLAG:
                 logger.info(inputs)
-            if not isinstance(inputs, dict):
+            cache = self.node_caches.get(cur_node)
+            body = None
+            if isinstance(inputs, BaseModel) and cache is None:
+                # already validated, serialized as is rather than dumped to a dict and encoded again
+                body = inputs.model_dump_json(exclude={k for k, v in inputs if v is None})
+            elif not isinstance(inputs, dict):
                 input_data = inputs.dict()
                 # remove null
                 input_data = {k: v for k, v in input_data.items() if v is not None}
             else:
                 input_data = inputs
-            async with session.post(endpoint, json=input_data) as response:
-                if response.content_type == "audio/wav":
-                    audio_data = await response.read()
-                    data = self.align_outputs(
-                        audio_data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs
-                    )
-                else:
-                    # Parse as JSON
-                    data = await response.json()
-                    # post process
-                    data = self.align_outputs(data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
-
-                return data, cur_node
+            if cache is not None:
+                cache_key = self.node_cache_key(input_data)
+                cached = await cache.get(cache_key)
+                if cached is not None:
+                    runtime_graph.status[cur_node] = 200
+                    trace.get_current_span().set_attribute("opea.cache_hit", True)
+                    # align_outputs may modify the data in place
+                    with request_span("align_outputs"):
+                        data = self.align_outputs(
+                            copy.deepcopy(cached), cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs
+                        )
+                    return data, cur_node
+
+            headers = self._trace_headers()
+            if self.embedding_dtype and self.services[cur_node].service_type == ServiceType.EMBEDDING:
+                headers["Accept"] = accept_header(self.embedding_dtype)
+
+            if body is not None:
+                headers["Content-Type"] = "application/json"
+            payload = {"json": input_data} if body is None else {"data": body}
+
+            async def send(url):
+                post_start = time.perf_counter()
+                async with session.post(url, headers=headers, **payload) as response:
+                    is_audio = response.content_type == "audio/wav"
+                    # Parse as JSON unless audio
+                    data = await response.read() if is_audio else await response.json(loads=json_loads)
+                    self._record_hop(response, post_start)
+                    return response.status, data, is_audio
+
+            status, data, is_audio = await self._call(cur_node, send)
+            runtime_graph.status[cur_node] = status
+            if not is_audio and cache is not None and 200 <= status < 300:
+                await cache.set(cache_key, copy.deepcopy(data))
+            # post process
+            with request_span("align_outputs"):
+                data = self.align_outputs(data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
+            return data, cur_node
 
     def align_inputs(self, inputs, *args, **kwargs):
         """Override this method in megaservice definition."""
@@ -279,18 +767,63 @@ class ServiceOrchestrator(DAG):
         return data
 
     def align_generator(self, gen, *args, **kwargs):
-        """Override this method in megaservice definition."""
+        """Override this method in megaservice definition.
+
+        `gen` is an async generator when the override is an async generator function or a plain function,
+        and a sync generator when the override is a sync generator function (see wrap_generator).
+        """
         return gen
 
+    def wrap_generator(self, gen):
+        """Adapt the async stream to the kind of align_generator override.
+
+        Overrides written as sync generator functions iterate `gen` with a plain `for` loop, they get a sync
+        generator which pulls the items from the event loop. StreamingResponse iterates sync generators in
+        a threadpool, so blocking on the event loop there is fine.
+        """
+        if not inspect.isgeneratorfunction(self.align_generator):
+            return gen
+        loop = asyncio.get_running_loop()
+
+        def iterate():
+            try:
+                while True:
+                    try:
+                        yield asyncio.run_coroutine_threadsafe(gen.__anext__(), loop).result()
+                    except StopAsyncIteration:
+                        return
+            finally:
+                asyncio.run_coroutine_threadsafe(gen.aclose(), loop).result()
+
+        return iterate()
+
     def get_all_final_outputs(self, result_dict, runtime_graph):
         final_output_dict = {}
         for leaf in runtime_graph.all_leaves():
             final_output_dict[leaf] = result_dict[leaf]
         return final_output_dict
 
+    async def iter_http_chunks(self, response: aiohttp.ClientResponse):
+        """Yield the body of a streaming response one HTTP chunk (i.e. one SSE event) at a time."""
+        if response.headers.get("Transfer-Encoding", "").lower() != "chunked":
+            async for data in response.content.iter_any():
+                yield data
+            return
+        buffer = b""
+        async for data, end_of_http_chunk in response.content.iter_chunks():
+            buffer += data
+            if end_of_http_chunk and buffer:
+                yield buffer
+                buffer = b""
+        if buffer:
+            yield buffer
+
     def extract_chunk_str(self, chunk_str):
         if chunk_str == "data: [DONE]\n\n":
             return ""
+        text = decode_json_event(chunk_str)
+        if text is not None:
+            return text
         prefix = "data: b'"
         prefix_2 = 'data: b"'
         suffix = "'\n\n"
@@ -301,12 +834,20 @@ class ServiceOrchestrator(DAG):
             chunk_str = chunk_str[: -len(suffix)]
         return chunk_str
 
-    def token_generator(self, sentence: str, token_start: float, is_first: bool, is_last: bool) -> str:
-        prefix = "data: "
-        suffix = "\n\n"
-        tokens = re.findall(r"\s?\S+\s?", sentence, re.UNICODE)
+    def token_generator(
+        self, sentence: str, token_start: float, is_first: bool, is_last: bool, encoder: Optional[SSEEncoder] = None
+    ) -> str:
+        """Stream a sentence as SSE events, one per word or, when coalescing, frames of SSE_COALESCE_MAX_BYTES."""
+        encoder = encoder or SSEEncoder()
+        tokens = [token.replace("\\n", "\n") for token in re.findall(r"\s?\S+\s?", sentence, re.UNICODE)]
+        if SSE_COALESCE_WINDOW_MS > 0:
+            # the words of the sentence are all available, only the first one is sent alone
+            tokens = pack_tokens(tokens, SSE_COALESCE_MAX_BYTES, is_first)
         for token in tokens:
-            yield prefix + repr(token.replace("\\n", "\n").encode("utf-8")) + suffix
+            event = encoder.event(token)
+            self.stream_metrics.event_update(event)
+            yield event
             token_start = self.metrics.token_update(token_start, is_first)
         if is_last:
-            yield "data: [DONE]\n\n"
+            self.stream_metrics.event_update(DONE_EVENT)
+            yield DONE_EVENT
@@ -1,61 +1,104 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
-import json
+import asyncio
 import re
 from collections import OrderedDict
 from typing import Dict, List, Tuple
 
-import requests
+import aiohttp
 import yaml
+from fastapi.responses import StreamingResponse
 
-from .dag import DAG
+from ..proto.docarray import LLMParams
+from .constants import ServiceType
+from .load_balancer import ReplicaSet
+from .logger import CustomLogger
+from .orchestrator import ServiceOrchestrator
 
+logger = CustomLogger("comps-core-orchestrator-yaml")
 
-class ServiceOrchestratorWithYaml(DAG):
-    """Manage 1 or N micro services in a DAG defined by YAML."""
+
+class YamlService:
+    """Remote microservice declared in the `opea_micro_services` section of the YAML.
+
+    e.g.
+        llm:
+          endpoint: http://localhost:9000/v1/chat/completions
+          service_type: llm  # optional, LLM/LVM nodes are streamed
+          timeout: 30  # optional, seconds per attempt
+          retries: 2  # optional, new attempts after a connection error, a timeout or a 5xx reply
+
+    `endpoint` may also list the endpoints of several replicas, balanced by `load_balancing` (round_robin,
+    least_outstanding or latency_ewma), with `hedge: true` for idempotent services, see ReplicaSet.
+    """
+
+    def __init__(self, name: str, config: Dict):
+        self.name = name
+        endpoints = config["endpoint"] if isinstance(config["endpoint"], list) else [config["endpoint"]]
+        self.endpoint_path = endpoints[0]
+        self.replicas = None
+        if len(endpoints) > 1:
+            self.replicas = ReplicaSet(
+                endpoints, policy=config.get("load_balancing", "round_robin"), hedge=config.get("hedge", False)
+            )
+        self.service_type = ServiceType[config.get("service_type", "undefined").upper()]
+        self.timeout = config.get("timeout")
+        self.retries = config.get("retries", 0)
+
+
+class ServiceOrchestratorWithYaml(ServiceOrchestrator):
+    """Manage 1 or N micro services in a DAG defined by YAML.
+
+    The DAG runs on the ServiceOrchestrator engine: independent branches are executed concurrently and
+    every call of schedule() keeps its own results.
+    """
 
     def __init__(self, yaml_file_path: str):
         self.yaml_file_path = yaml_file_path
-        self.result_dict = {}  # {node: node's dict output}
         super().__init__()
         self.docs, is_valid = self._load_from_yaml()
         if not is_valid:
             raise Exception("Invalid mega graph!")
 
-    def execute(self, cur_node: str, inputs: Dict):
-        # send the cur_node request/reply
-        endpoint = self.docs["opea_micro_services"][cur_node]["endpoint"]
-        response = requests.post(url=endpoint, data=json.dumps(inputs), proxies={"http": None})
-        print(response)
-        return response.json()
-
-    def get_all_final_outputs(self):
-
-        for leaf in self.all_leaves():
-            print(self.result_dict[leaf])
-
-    def process_outputs(self, prev_nodes: List) -> Dict:
-        all_outputs = {}
-        # assume all prev_nodes outputs' keys are not duplicated
-        for prev_node in prev_nodes:
-            all_outputs.update(self.result_dict[prev_node])
-        return all_outputs
-
-    async def schedule(self, initial_inputs: Dict):
-        for node in self.topological_sort():
-            if node in self.ind_nodes():
-                inputs = initial_inputs
+    async def execute(
+        self,
+        session: aiohttp.client.ClientSession,
+        req_start: float,
+        cur_node: str,
+        inputs: Dict,
+        runtime_graph,
+        llm_parameters: LLMParams = LLMParams(),
+        **kwargs,
+    ):
+        service = self.services[cur_node]
+        for attempt in range(service.retries + 1):
+            last_attempt = attempt == service.retries
+            try:
+                response, node = await asyncio.wait_for(
+                    super().execute(session, req_start, cur_node, inputs, runtime_graph, llm_parameters, **kwargs),
+                    service.timeout,
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if last_attempt:
+                    raise
+                logger.warning(f"{cur_node} attempt {attempt + 1} failed: {e!r}, retrying")
             else:
-                inputs = self.process_outputs(self.predecessors(node))
-            response = self.execute(node, inputs)
-            self.result_dict[node] = response
+                # a stream is returned as is, its generator owns the connection
+                if last_attempt or isinstance(response, StreamingResponse) or runtime_graph.status[cur_node] < 500:
+                    return response, node
+                logger.warning(f"{cur_node} attempt {attempt + 1} replied {runtime_graph.status[cur_node]}, retrying")
+            await asyncio.sleep(0.1 * 2**attempt)
 
     def _load_from_yaml(self):
         """Parse the yaml and output docs, whether the mega graph is valid, the mega graph."""
         with open(self.yaml_file_path) as file:
             docs = yaml.safe_load(file)
 
+        for name, config in docs["opea_micro_services"].items():
+            service = YamlService(name, config)
+            self.add(service, replicas=service.replicas)
+
         if "mega_flow" in docs["opea_mega_service"]:
             mega_flow = docs["opea_mega_service"]["mega_flow"]
             return docs, self._construct_dag_from_rules(mega_flow)
@@ -80,11 +123,12 @@ class ServiceOrchestratorWithYaml(DAG):
 
                 if node_group_str.startswith("(") and node_group_str.endswith(")"):
                     cur_nodes = [i.strip() for i in re.findall(r"\((.*)\)", node_group_str)[0].split(",")]
-                    for cur_node in cur_nodes:
-                        self.add_node_if_not_exists(cur_node)
                 else:
                     cur_nodes = [node_group_str]
-                    self.add_node_if_not_exists(node_group_str)
+                unknown = [cur_node for cur_node in cur_nodes if cur_node not in self.services]
+                if unknown:
+                    logger.error(f"{unknown} of {rule} are not declared in opea_micro_services")
+                    return False
                 if prev_nodes:
                     try:
                         for prev_node in prev_nodes:
@@ -0,0 +1,93 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Fast JSON encoding/decoding of the protocol messages.
+
+`json_dumps`/`json_loads` use orjson when it is installed and fall back to the json module. With
+`fast_endpoint`, a route validates its body model straight from the JSON bytes with a TypeAdapter
+compiled once, and returns its model results serialized by pydantic-core, skipping the intermediate
+Python dicts and the re-validation of the result against the response model.
+"""
+
+import functools
+import inspect
+import json
+import typing
+from typing import Any, Callable, Union
+
+from fastapi import Request, Response
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+try:
+    import orjson
+except ImportError:  # optional, stdlib json otherwise
+    orjson = None
+
+
+def json_dumps(obj: Any) -> str:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            # e.g. integers over 64 bits, the json module handles them
+            pass
+    return json.dumps(obj)
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def model_response(result: BaseModel) -> Response:
+    return Response(content=result.model_dump_json(by_alias=True), media_type="application/json")
+
+
+def _is_model_annotation(annotation) -> bool:
+    """A pydantic model or a Union of pydantic models."""
+    if inspect.isclass(annotation):
+        return issubclass(annotation, BaseModel)
+    if typing.get_origin(annotation) is Union:
+        return all(_is_model_annotation(arg) for arg in typing.get_args(annotation))
+    return False
+
+
+def fast_endpoint(func: Callable) -> Callable:
+    """Wrap a route handler in the fast path.
+
+    A handler taking one model (or Union of models) argument gets it validated from the raw body by a
+    precompiled TypeAdapter, with the usual 422 on errors. Model results are serialized directly, other
+    results (dicts, Responses) are left to FastAPI. Sync handlers are left as they are.
+    """
+    if not inspect.iscoroutinefunction(func):
+        return func
+    signature = inspect.signature(func)
+    hints = typing.get_type_hints(func)
+    parameters = list(signature.parameters.values())
+
+    if len(parameters) == 1 and _is_model_annotation(hints.get(parameters[0].name)):
+        adapter = TypeAdapter(hints[parameters[0].name])
+
+        async def endpoint(request: Request):
+            body = await request.body()
+            try:
+                value = adapter.validate_json(body)
+            except ValidationError as e:
+                errors = [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
+                raise RequestValidationError(errors, body=body)
+            result = await func(value)
+            return model_response(result) if isinstance(result, BaseModel) else result
+
+        endpoint.__name__ = func.__name__
+        endpoint.__doc__ = func.__doc__
+        # documented with the response model of the handler
+        if "return" in hints:
+            endpoint.__annotations__["return"] = hints["return"]
+        return endpoint
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        result = await func(*args, **kwargs)
+        return model_response(result) if isinstance(result, BaseModel) else result
+
+    return wrapper
@@ -0,0 +1,187 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Server-sent events of the streamed generations.
+
+By default every token is one event carrying the repr of its UTF-8 bytes (`data: b'...'`), which the UIs and
+the megaservice parse. With SSE_COALESCE_WINDOW_MS set, the tokens generated within that window (or until
+SSE_COALESCE_MAX_BYTES) are sent as one event: fewer events to produce and parse and fewer small TCP writes
+at high token rates. The first token is always sent at once, the time to first token is unchanged.
+
+SSE_EVENT_FORMAT selects the payload of the events: "bytes" (default), "json" (`{"text": ...}`) or "openai"
+(`chat.completion.chunk` objects). All the streams end with `data: [DONE]`.
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import AsyncIterator, Iterable, List, Optional, Union
+
+from fastapi.responses import StreamingResponse
+from prometheus_client import Counter
+from starlette.concurrency import iterate_in_threadpool
+
+from .serialization import json_dumps
+
+SSE_EVENT_FORMATS = ("bytes", "json", "openai")
+DONE_EVENT = "data: [DONE]\n\n"
+
+SSE_EVENT_FORMAT = os.getenv("SSE_EVENT_FORMAT", "bytes")
+SSE_COALESCE_WINDOW_MS = float(os.getenv("SSE_COALESCE_WINDOW_MS", 0))
+SSE_COALESCE_MAX_BYTES = int(os.getenv("SSE_COALESCE_MAX_BYTES", 256))
+
+
+class StreamingMetrics:
+    # Metrics are class members for the same reasons as OrchestratorMetrics,
+    # streams are told apart with the "service" label, rate() gives the events and bytes per second
+    events = Counter("sse_events", "Server-sent events written (counter)", ["service"])
+    bytes = Counter("sse_bytes", "Bytes of server-sent events written (counter)", ["service"])
+
+    def __init__(self, service_name: str) -> None:
+        self.events_counter = self.events.labels(service_name)
+        self.bytes_counter = self.bytes.labels(service_name)
+
+    def event_update(self, event: str) -> None:
+        self.events_counter.inc()
+        self.bytes_counter.inc(len(event))
+
+
+class SSEEncoder:
+    """Frame text as the events of one stream."""
+
+    def __init__(self, event_format: Optional[str] = None, model: Optional[str] = None):
+        self.event_format = event_format or SSE_EVENT_FORMAT
+        if self.event_format not in SSE_EVENT_FORMATS:
+            raise ValueError(f"Unknown SSE event format {self.event_format}, expected one of {SSE_EVENT_FORMATS}")
+        self.model = model
+        self.id = f"chatcmpl-{uuid.uuid4().hex}"
+        self.created = int(time.time())
+
+    def event(self, text: str) -> str:
+        if self.event_format == "bytes":
+            return f"data: {text.encode('utf-8')!r}\n\n"
+        if self.event_format == "json":
+            return f"data: {json_dumps({'text': text})}\n\n"
+        chunk = {
+            "id": self.id,
+            "object": "chat.completion.chunk",
+            "created": self.created,
+            "model": self.model,
+            "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}],
+        }
+        return f"data: {json_dumps(chunk)}\n\n"
+
+
+def decode_json_event(event: str) -> Optional[str]:
+    """Text of a "json" or "openai" event, None for other events."""
+    if not event.startswith("data: {"):
+        return None
+    try:
+        data = json.loads(event[len("data: ") :])
+    except ValueError:
+        return None
+    if "choices" in data:
+        choices = data["choices"]
+        return "".join((choice.get("delta") or {}).get("content") or choice.get("text") or "" for choice in choices)
+    return data.get("text") if isinstance(data.get("text"), str) else None
+
+
+def pack_tokens(tokens: List[str], max_bytes: int, is_first: bool = False) -> List[str]:
+    """Join tokens which are all available into frames of about `max_bytes`, the first token alone if
+    `is_first` so that it is not held back."""
+    frames, frame, size = [], [], 0
+    if is_first and tokens:
+        frames.append(tokens[0])
+        tokens = tokens[1:]
+    for token in tokens:
+        frame.append(token)
+        size += len(token.encode("utf-8"))
+        if size >= max_bytes:
+            frames.append("".join(frame))
+            frame, size = [], 0
+    if frame:
+        frames.append("".join(frame))
+    return frames
+
+
+async def coalesce(tokens: AsyncIterator[str], window: float, max_bytes: int) -> AsyncIterator[str]:
+    """Join the tokens generated within `window` seconds of the first one of a frame, or until `max_bytes`.
+
+    The first token is yielded at once. A frame is flushed when its window is over even if the generation
+    stalls, the pending token is awaited in a task and never cancelled in between.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = tokens.__aiter__()
+    frame, size, deadline = [], 0, 0.0
+    pending = None
+    first = True
+    try:
+        while True:
+            if not frame and pending is None:
+                try:
+                    token = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+            else:
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                # no timeout once the frame was flushed and the token is still awaited
+                timeout = max(deadline - loop.time(), 0) if frame else None
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+                if not done:
+                    yield "".join(frame)
+                    frame, size = [], 0
+                    continue
+                task, pending = pending, None
+                try:
+                    token = task.result()
+                except StopAsyncIteration:
+                    break
+            if first:
+                first = False
+                yield token
+                continue
+            if not frame:
+                deadline = loop.time() + window
+            frame.append(token)
+            size += len(token.encode("utf-8"))
+            if size >= max_bytes:
+                yield "".join(frame)
+                frame, size = [], 0
+        if frame:
+            yield "".join(frame)
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+async def sse_events(
+    tokens: Union[AsyncIterator[str], Iterable[str]],
+    service_name: str,
+    event_format: Optional[str] = None,
+    model: Optional[str] = None,
+    coalesce_window_ms: Optional[float] = None,
+    coalesce_max_bytes: Optional[int] = None,
+) -> AsyncIterator[str]:
+    """Stream the generated tokens as server-sent events, coalesced if configured, ending with [DONE]."""
+    encoder = SSEEncoder(event_format, model)
+    metrics = StreamingMetrics(service_name)
+    window_ms = SSE_COALESCE_WINDOW_MS if coalesce_window_ms is None else coalesce_window_ms
+    max_bytes = SSE_COALESCE_MAX_BYTES if coalesce_max_bytes is None else coalesce_max_bytes
+    if not hasattr(tokens, "__aiter__"):
+        tokens = iterate_in_threadpool(iter(tokens))
+    if window_ms > 0:
+        tokens = coalesce(tokens, window_ms / 1000, max_bytes)
+    async for text in tokens:
+        event = encoder.event(text)
+        metrics.event_update(event)
+        yield event
+    metrics.event_update(DONE_EVENT)
+    yield DONE_EVENT
+
+
+def sse_response(tokens: Union[AsyncIterator[str], Iterable[str]], service_name: str, **kwargs) -> StreamingResponse:
+    """StreamingResponse of the generated tokens, see `sse_events` for the arguments."""
+    return StreamingResponse(sse_events(tokens, service_name, **kwargs), media_type="text/event-stream")
@@ -9,8 +9,6 @@ import random
 from socket import AF_INET, SOCK_STREAM, socket
 from typing import List, Optional, Union
 
-import requests
-
 from .logger import CustomLogger
 
 
@@ -111,6 +109,36 @@ def in_docker():
     return False
 
 
+def parse_cpu_list(cpu_list: str) -> List[int]:
+    """Parse a Linux cpulist string, e.g. "0-3,8-11"."""
+    cpus = []
+    for part in cpu_list.strip().split(","):
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        cpus.extend(range(int(start), int(end or start) + 1))
+    return cpus
+
+
+def get_numa_cpus() -> List[List[int]]:
+    """Return the CPUs this process may run on, grouped by NUMA node.
+
+    Falls back to a single group when the NUMA topology is not exposed in sysfs.
+    """
+    allowed = os.sched_getaffinity(0)
+    nodes = []
+    node_root = "/sys/devices/system/node"
+    if os.path.isdir(node_root):
+        for node in sorted(os.listdir(node_root)):
+            cpulist = os.path.join(node_root, node, "cpulist")
+            if node.startswith("node") and os.path.isfile(cpulist):
+                with open(cpulist, encoding="utf-8") as file:
+                    cpus = [cpu for cpu in parse_cpu_list(file.read()) if cpu in allowed]
+                if cpus:
+                    nodes.append(cpus)
+    return nodes or [sorted(allowed)]
+
+
 def host_is_local(hostname):
     """Check if hostname is point to localhost."""
     import socket
@@ -228,6 +256,8 @@ def load_model_configs(model_configs: str) -> dict:
 
 def get_access_token(token_url: str, client_id: str, client_secret: str) -> str:
     """Get access token using OAuth client credentials flow."""
+    import requests
+
     logger = CustomLogger("tgi_or_tei_service_auth")
     data = {
         "client_id": client_id,
@@ -8,7 +8,9 @@ from typing import Any, Dict, List, Literal, Optional, Union
 import shortuuid
 from fastapi import File, UploadFile
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, conint, field_validator, model_validator
+
+from .embedding_encoding import decode_embedding, is_encoded
 
 
 class ServiceCard(BaseModel):
@@ -119,6 +121,11 @@ class RetrievalRequest(BaseModel):
     # define
     request_type: Literal["retrieval"] = "retrieval"
 
+    @field_validator("embedding", mode="before")
+    @classmethod
+    def decode_binary_embedding(cls, v):
+        return decode_embedding(v) if is_encoded(v) else v
+
 
 class RetrievalResponseData(BaseModel):
     text: str
@@ -268,6 +275,11 @@ class ChatCompletionRequest(BaseModel):
     # define
     request_type: Literal["chat"] = "chat"
 
+    @field_validator("embedding", mode="before")
+    @classmethod
+    def decode_binary_embedding(cls, v):
+        return decode_embedding(v) if is_encoded(v) else v
+
 
 class DocSumChatCompletionRequest(BaseModel):
     llm_params: Optional[ChatCompletionRequest] = None
@@ -275,6 +287,16 @@ class DocSumChatCompletionRequest(BaseModel):
     audio: Optional[str] = None
     video: Optional[str] = None
     type: Optional[str] = None
+    summary_type: Literal["stuff", "map_reduce"] = "stuff"
+    chunk_size: conint(gt=0) = 4000  # characters per chunk of map_reduce
+    chunk_overlap: conint(ge=0) = 0
+
+    @model_validator(mode="after")
+    def check_chunk_overlap(self):
+        # an overlap of a chunk or more would move one character per chunk, i.e. one LLM call per character
+        if self.chunk_overlap >= self.chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        return self
 
 
 class AudioChatCompletionRequest(BaseModel):
@@ -7,7 +7,9 @@ import numpy as np
 from docarray import BaseDoc, DocList
 from docarray.documents import AudioDoc
 from docarray.typing import AudioUrl, ImageUrl
-from pydantic import Field, conint, conlist, field_validator
+from pydantic import Field, conint, conlist, field_serializer, field_validator
+
+from .embedding_encoding import decode_embedding, is_encoded, serialize_embedding
 
 
 class TopologyInfo:
@@ -103,6 +105,16 @@ class EmbedDoc(BaseDoc):
     score_threshold: float = 0.2
     constraints: Optional[Union[Dict[str, Any], List[Dict[str, Any]], None]] = None
 
+    @field_validator("embedding", mode="before")
+    @classmethod
+    def decode_binary_embedding(cls, v):
+        # binary embeddings, see embedding_encoding
+        return decode_embedding(v) if is_encoded(v) else v
+
+    @field_serializer("embedding", when_used="json")
+    def encode_binary_embedding(self, v):
+        return serialize_embedding(v)
+
 
 class EmbedMultimodalDoc(EmbedDoc):
     # extend EmbedDoc with these attributes
@@ -0,0 +1,80 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Binary transport of embedding vectors inside the JSON messages of the microservices.
+
+A vector travels as its little-endian float32 or float16 bytes in base64 rather than as a list of decimal
+floats, e.g. {"dtype": "float16", "shape": [1024], "data": "<base64>"}: a 1024-dim float32 vector takes
+~5.5 KB instead of ~20 KB of JSON and is decoded by numpy without parsing each float.
+
+The encoding is negotiated per request: a client accepting `application/vnd.opea.embedding+json` (with an
+optional `dtype=float16` parameter) gets the embeddings of the EmbedDoc replies encoded, the reply then
+has that content type. The EmbedDoc inputs accept both forms, so a retriever decodes the vectors a binary
+embedding service produced without the megaservice ever converting them.
+"""
+
+import base64
+import re
+from contextvars import ContextVar
+from typing import Any, List, Optional, Union
+
+import numpy as np
+
+EMBEDDING_MEDIA_TYPE = "application/vnd.opea.embedding+json"
+DTYPES = ("float32", "float16")
+
+# {"dtype": <negotiated dtype>, "used": <whether a vector was encoded>} while serving a request which
+# accepts binary embeddings, set by the EmbeddingEncodingMiddleware of the microservices
+embedding_encoding: ContextVar[Optional[dict]] = ContextVar("embedding_encoding", default=None)
+
+
+def accepted_dtype(accept: str) -> Optional[str]:
+    """dtype requested by an Accept header, None when binary embeddings are not accepted."""
+    if EMBEDDING_MEDIA_TYPE not in accept:
+        return None
+    for media_range in accept.split(","):
+        if media_range.strip().startswith(EMBEDDING_MEDIA_TYPE):
+            match = re.search(r";\s*dtype=(\w+)", media_range)
+            dtype = match.group(1) if match else "float32"
+            return dtype if dtype in DTYPES else "float32"
+    return None
+
+
+def accept_header(dtype: str = "float32") -> str:
+    """Accept header of a client which takes binary embeddings, JSON replies of other types included."""
+    return f"{EMBEDDING_MEDIA_TYPE}; dtype={dtype}, application/json;q=0.9"
+
+
+def encode_embedding(embedding: Union[List[float], List[List[float]]], dtype: str = "float32") -> dict:
+    """One vector or a batch of vectors to {"dtype", "shape", "data"}."""
+    array = np.asarray(embedding, dtype=np.dtype(dtype).newbyteorder("<"))
+    return {"dtype": dtype, "shape": list(array.shape), "data": base64.b64encode(array.tobytes()).decode("ascii")}
+
+
+def encode_base64(embedding: List[float]) -> str:
+    """OpenAI `encoding_format="base64"`: the little-endian float32 bytes of one vector."""
+    return base64.b64encode(np.asarray(embedding, dtype="<f4").tobytes()).decode("ascii")
+
+
+def is_encoded(value: Any) -> bool:
+    return isinstance(value, dict) and "data" in value and value.get("dtype") in DTYPES
+
+
+def decode_embedding(value: Any) -> Any:
+    """Vector(s) as lists of floats from the binary forms, an OpenAI base64 string is float32. Other values
+    are returned as is."""
+    if is_encoded(value):
+        array = np.frombuffer(base64.b64decode(value["data"]), dtype=np.dtype(value["dtype"]).newbyteorder("<"))
+        return array.reshape(value.get("shape") or array.shape).astype(np.float64).tolist()
+    if isinstance(value, str):
+        return np.frombuffer(base64.b64decode(value), dtype="<f4").astype(np.float64).tolist()
+    return value
+
+
+def serialize_embedding(embedding: Any) -> Any:
+    """JSON form of an embedding field: encoded when the current request negotiated binary embeddings."""
+    encoding = embedding_encoding.get()
+    if encoding is None or not embedding:
+        return embedding
+    encoding["used"] = True
+    return encode_embedding(embedding, encoding["dtype"])
@@ -1,37 +1,264 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import contextlib
 import inspect
+import json
 import os
+import threading
+from collections import OrderedDict, deque
 from functools import wraps
+from typing import List, Optional
 
 from opentelemetry import trace
-from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter as HTTPSpanExporter
 from opentelemetry.sdk.resources import SERVICE_NAME, Resource
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.sampling import ALWAYS_ON, ParentBased, TraceIdRatioBased
+from opentelemetry.trace import StatusCode
 
+# TELEMETRY_ENABLED=false leaves the functions decorated with @opea_telemetry untouched and traces nothing
+telemetry_enabled = os.environ.get("TELEMETRY_ENABLED", "true").lower() in ("true", "1")
+# comma separated exporters of the spans, see SPAN_EXPORTERS
+telemetry_exporters = [e.strip() for e in os.environ.get("TELEMETRY_EXPORTERS", "otlp,memory").split(",") if e.strip()]
 telemetry_endpoint = os.environ.get("TELEMETRY_ENDPOINT", "http://localhost:4318/v1/traces")
+# JSON lines file the spans are also written to, for offline analysis without a collector
+telemetry_trace_file = os.environ.get("TELEMETRY_TRACE_FILE")
+# finished spans kept by the in-memory exporter, served on /v1/debug/traces
+telemetry_memory_spans = int(os.environ.get("TELEMETRY_MEMORY_SPANS", "10000"))
+# fraction of the traces sampled
+telemetry_sample_rate = float(os.environ.get("TELEMETRY_SAMPLE_RATE", "1.0"))
+# with tail sampling, traces slower than this are kept whatever the sample rate
+telemetry_keep_slow_ms = (
+    float(os.environ["TELEMETRY_KEEP_SLOW_MS"]) if os.environ.get("TELEMETRY_KEEP_SLOW_MS") else None
+)
+# trace every megaservice and microservice request, not only the functions decorated with @opea_telemetry
+request_tracing = telemetry_enabled and os.environ.get("TELEMETRY_REQUEST_TRACING", "false").lower() in ("true", "1")
 
-resource = Resource.create({SERVICE_NAME: "opea"})
-traceProvider = TracerProvider(resource=resource)
 
-traceProvider.add_span_processor(BatchSpanProcessor(HTTPSpanExporter(endpoint=telemetry_endpoint)))
-in_memory_exporter = InMemorySpanExporter()
-traceProvider.add_span_processor(BatchSpanProcessor(in_memory_exporter))
-trace.set_tracer_provider(traceProvider)
+class FileSpanExporter(SpanExporter):
+    """Append the finished spans to a file, one JSON object per line.
 
-tracer = trace.get_tracer(__name__)
+    Processes may share the file: every span is written with a single append.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans) -> SpanExportResult:
+        data = "".join(span.to_json(indent=None) + "\n" for span in spans)
+        try:
+            with self._lock, open(self.path, "a") as f:
+                f.write(data)
+        except OSError:
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        pass
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
+
+
+class RingBufferSpanExporter(SpanExporter):
+    """Keep the last `max_spans` finished spans in memory."""
+
+    def __init__(self, max_spans: int = 10000):
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def export(self, spans) -> SpanExportResult:
+        with self._lock:
+            self._spans.extend(spans)
+        return SpanExportResult.SUCCESS
+
+    def get_finished_spans(self) -> tuple:
+        with self._lock:
+            return tuple(self._spans)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._spans.clear()
+
+    def shutdown(self) -> None:
+        self.clear()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
+
+
+class TailSamplingSpanProcessor(SpanProcessor):
+    """Decide whether to keep a trace once its local root span ended.
+
+    The spans of a trace are held until the root span of this process ends (the megaservice request or
+    the request served by a microservice), then passed on to the processors if the request failed, took
+    at least `keep_slow_ms` or is sampled by `sample_rate`. The rate applies to the trace id like the
+    head sampler, so that the processes of a trace keep the same sampled requests. Spans ending after
+    their root follow the decision taken for the trace.
+    """
+
+    def __init__(self, sample_rate: float = 1.0, keep_slow_ms: Optional[float] = None, max_traces: int = 10000):
+        self.bound = TraceIdRatioBased.get_bound_for_rate(sample_rate)
+        self.keep_slow_ns = keep_slow_ms * 1e6 if keep_slow_ms is not None else None
+        self.max_traces = max_traces
+        self.processors: List[SpanProcessor] = []
+        self._pending = OrderedDict()  # trace id -> spans waiting for the root span
+        self._decisions = OrderedDict()  # trace id -> kept
+        self._lock = threading.Lock()
+
+    def add_span_processor(self, processor: SpanProcessor) -> None:
+        self.processors.append(processor)
+
+    def keep(self, root: ReadableSpan) -> bool:
+        if root.status.status_code == StatusCode.ERROR:
+            return True
+        if self.keep_slow_ns is not None and root.end_time - root.start_time >= self.keep_slow_ns:
+            return True
+        return root.context.trace_id & TraceIdRatioBased.TRACE_ID_LIMIT < self.bound
+
+    def on_start(self, span, parent_context=None) -> None:
+        for processor in self.processors:
+            processor.on_start(span, parent_context=parent_context)
+
+    def on_end(self, span: ReadableSpan) -> None:
+        trace_id = span.context.trace_id
+        with self._lock:
+            if trace_id in self._decisions:
+                spans = [span] if self._decisions[trace_id] else []
+            elif span.parent is not None and not span.parent.is_remote:
+                self._pending.setdefault(trace_id, []).append(span)
+                if len(self._pending) > self.max_traces:
+                    self._pending.popitem(last=False)
+                return
+            else:
+                pending = self._pending.pop(trace_id, [])
+                kept = self.keep(span)
+                spans = pending + [span] if kept else []
+                self._decisions[trace_id] = kept
+                if len(self._decisions) > self.max_traces:
+                    self._decisions.popitem(last=False)
+        for sampled in spans:
+            for processor in self.processors:
+                processor.on_end(sampled)
+
+    def shutdown(self) -> None:
+        for processor in self.processors:
+            processor.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return all(processor.force_flush(timeout_millis) for processor in self.processors)
+
+
+def _otlp_exporter() -> SpanExporter:
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+    return OTLPSpanExporter(endpoint=telemetry_endpoint)
+
+
+# exporters selected by name in TELEMETRY_EXPORTERS
+SPAN_EXPORTERS = {
+    "otlp": _otlp_exporter,
+    "memory": lambda: RingBufferSpanExporter(telemetry_memory_spans),
+    "file": lambda: FileSpanExporter(telemetry_trace_file or "opea_traces.jsonl"),
+}
+
+
+def _span_processor(exporter: SpanExporter, batch: bool) -> SpanProcessor:
+    return BatchSpanProcessor(exporter) if batch else SimpleSpanProcessor(exporter)
+
+
+_setup_lock = threading.Lock()
+_tracer = None
+
+
+def setup_tracing() -> trace.Tracer:
+    """Create the tracer provider and the exporters on the first use of the tracing, return the tracer.
+
+    `traceProvider`, `tail_sampler` and `in_memory_exporter` are set up when first accessed too.
+    """
+    global _tracer, traceProvider, tail_sampler, in_memory_exporter
+    if _tracer is not None:
+        return _tracer
+    with _setup_lock:
+        if _tracer is not None:
+            return _tracer
+        resource = Resource.create({SERVICE_NAME: "opea"})
+        if telemetry_keep_slow_ms is None:
+            # head sampling, the requests left out are not even recorded
+            sampler = ParentBased(TraceIdRatioBased(telemetry_sample_rate))
+            traceProvider = TracerProvider(resource=resource, sampler=sampler)
+            tail_sampler = None
+        else:
+            traceProvider = TracerProvider(resource=resource, sampler=ParentBased(ALWAYS_ON))
+            tail_sampler = TailSamplingSpanProcessor(telemetry_sample_rate, telemetry_keep_slow_ms)
+            traceProvider.add_span_processor(tail_sampler)
+
+        in_memory_exporter = None
+        if telemetry_enabled:
+            if telemetry_trace_file and "file" not in telemetry_exporters:
+                telemetry_exporters.append("file")
+            for name in telemetry_exporters:
+                exporter = SPAN_EXPORTERS[name]()
+                if name == "memory":
+                    in_memory_exporter = exporter
+                # appending to the ring buffer is cheaper than batching
+                (tail_sampler or traceProvider).add_span_processor(_span_processor(exporter, batch=name != "memory"))
+            trace.set_tracer_provider(traceProvider)
+        _tracer = trace.get_tracer(__name__)
+    return _tracer
+
+
+def __getattr__(name):
+    if name == "tracer":
+        return setup_tracing()
+    if name in ("traceProvider", "tail_sampler", "in_memory_exporter"):
+        setup_tracing()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def add_span_exporter(exporter: SpanExporter, batch: bool = True) -> None:
+    """Export the sampled spans, from a background thread unless `batch` is False."""
+    setup_tracing()
+    (tail_sampler or traceProvider).add_span_processor(_span_processor(exporter, batch))
+
+
+def recent_spans(limit: int = 100, trace_id: Optional[str] = None) -> Optional[List[dict]]:
+    """Last finished spans of the in-memory exporter, of one trace (hex id) if given. None without it."""
+    setup_tracing()
+    if in_memory_exporter is None:
+        return None
+    spans = in_memory_exporter.get_finished_spans()
+    if trace_id is not None:
+        spans = [span for span in spans if format(span.context.trace_id, "032x") == trace_id]
+    return [json.loads(span.to_json(indent=None)) for span in spans[-limit:]] if limit > 0 else []
+
+
+def request_span(name: str, attributes: dict = None, context=None, kind=trace.SpanKind.INTERNAL):
+    """Context manager of a span of the request tracing, a no-op span when request tracing is disabled."""
+    if not request_tracing:
+        return contextlib.nullcontext(trace.INVALID_SPAN)
+    return setup_tracing().start_as_current_span(name, context=context, kind=kind, attributes=attributes)
+
+
+def start_request_span(name: str, attributes: dict = None, kind=trace.SpanKind.INTERNAL):
+    """Start a span of the request tracing that is ended explicitly, e.g. when a stream is over."""
+    if not request_tracing:
+        return trace.INVALID_SPAN
+    return setup_tracing().start_span(name, kind=kind, attributes=attributes)
 
 
 def opea_telemetry(func):
+    if not telemetry_enabled:
+        return func
     print(f"[*** telemetry ***] {func.__name__} under telemetry.")
     if inspect.iscoroutinefunction(func):
 
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            with tracer.start_as_current_span(func.__name__):
+            with setup_tracing().start_as_current_span(func.__name__):
                 res = await func(*args, **kwargs)
             return res
 
@@ -39,7 +266,7 @@ def opea_telemetry(func):
 
         @wraps(func)
         def wrapper(*args, **kwargs):
-            with tracer.start_as_current_span(func.__name__):
+            with setup_tracing().start_as_current_span(func.__name__):
                 res = func(*args, **kwargs)
             return res
 
@@ -0,0 +1,95 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Content hashes of the ingested files and chunks, for incremental re-ingestion.
+
+The record of an ingested file keeps the hash of the file and the hash of each of its chunks next to the key
+of the chunk. A file uploaded again is skipped when its hash did not change. Otherwise its new chunks are
+matched with the old ones by hash: only the new or changed chunks are embedded and written, the keys of the
+unchanged chunks are kept and the vanished chunks are deleted.
+"""
+
+import hashlib
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_hash(chunk: Any) -> str:
+    """Hash of the text of a chunk, a string or a langchain Document (HTML chunks)."""
+    text = getattr(chunk, "page_content", chunk)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ChunkDiff:
+    """Chunks of a file matched with the chunks of its previous ingestion.
+
+    `added` are the (position, chunk) to embed and write, `kept` maps the position of an unchanged chunk to
+    its key and `removed` are the keys of the vanished chunks.
+    """
+
+    def __init__(self, hashes: List[str]):
+        self.hashes = hashes
+        self.added: List[Tuple[int, Any]] = []
+        self.kept: Dict[int, str] = {}
+        self.removed: List[str] = []
+
+    def track(self, chunks: Iterable[Any]) -> Iterator[Any]:
+        """Yield the chunks of a new file, recorded as added as they are consumed (a streamed file)."""
+        for chunk in chunks:
+            self.added.append((len(self.hashes), chunk))
+            self.hashes.append(chunk_hash(chunk))
+            yield chunk
+
+    def keys(self, added_keys: Sequence[str]) -> List[str]:
+        """Keys of all the chunks in order, given the keys of the added chunks."""
+        keys = [None] * len(self.hashes)
+        for position, key in self.kept.items():
+            keys[position] = key
+        for (position, _), key in zip(self.added, added_keys):
+            keys[position] = key
+        return keys
+
+    def report(self, file_name: str, is_new: bool) -> Dict[str, Any]:
+        if is_new:
+            status = "new"
+        elif self.added or self.removed:
+            status = "changed"
+        else:
+            status = "unchanged"
+        return {
+            "file": file_name,
+            "status": status,
+            "added": len(self.added),
+            "kept": len(self.kept),
+            "removed": len(self.removed),
+        }
+
+
+def diff_chunks(chunks: Sequence[Any], old_keys: Sequence[str], old_hashes: Optional[Sequence[str]]) -> ChunkDiff:
+    """Match `chunks` with the chunks of the previous ingestion, by hash and in order for repeated chunks.
+
+    Without `old_hashes` (a file ingested before the hashes were recorded) all the old chunks are removed.
+    """
+    diff = ChunkDiff([chunk_hash(chunk) for chunk in chunks])
+    old = defaultdict(list)
+    if old_hashes and len(old_hashes) == len(old_keys):
+        for key, digest in zip(reversed(old_keys), reversed(old_hashes)):
+            old[digest].append(key)
+    else:
+        diff.removed.extend(old_keys)
+    for position, (chunk, digest) in enumerate(zip(chunks, diff.hashes)):
+        if old[digest]:
+            diff.kept[position] = old[digest].pop()
+        else:
+            diff.added.append((position, chunk))
+    for keys in old.values():
+        diff.removed.extend(keys)
+    return diff
@@ -0,0 +1,315 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Ingestion jobs of the dataprep microservices.
+
+An upload is saved to disk and turned into a job, the files of the job are parsed, chunked, embedded and
+written by a bounded pool of worker threads instead of inside the HTTP handler. Each job reports its progress
+(files parsed, chunks embedded, vectors written) and can be cancelled, cancellation takes effect at the next
+progress update of the running file.
+
+Every state change is appended to a JSON lines job log, the last record of a job wins. On startup the
+unfinished jobs of the log are queued again and skip the files they had already ingested.
+"""
+
+import asyncio
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from comps import CustomLogger
+
+logger = CustomLogger("dataprep_jobs")
+logflag = os.getenv("LOGFLAG", False)
+
+DATAPREP_JOB_WORKERS = int(os.getenv("DATAPREP_JOB_WORKERS", 2))
+DATAPREP_JOB_QUEUE_SIZE = int(os.getenv("DATAPREP_JOB_QUEUE_SIZE", 100))
+DATAPREP_JOB_LOG = os.getenv("DATAPREP_JOB_LOG", "./dataprep_jobs.jsonl")
+DATAPREP_JOB_HISTORY = int(os.getenv("DATAPREP_JOB_HISTORY", 1000))
+DATAPREP_ASYNC_INGEST = os.getenv("DATAPREP_ASYNC_INGEST", "false").lower() in ("true", "1", "yes")
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobProgress:
+    """Progress counters of a job, updated by the ingestion functions.
+
+    Every update is a cancellation point: it raises JobCancelled once the job was cancelled. A standalone
+    JobProgress() only counts, the ingestion functions take one when they are not run by a job.
+    """
+
+    def __init__(self, counters: Optional[Dict[str, int]] = None):
+        self.counters = {
+            "files_parsed": 0,
+            "chunks_embedded": 0,
+            "vectors_written": 0,
+            "chunks_unchanged": 0,
+            "vectors_deleted": 0,
+            **(counters or {}),
+        }
+        self.cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def _add(self, name: str, n: int):
+        self.check_cancelled()
+        with self._lock:
+            self.counters[name] += n
+
+    def parsed(self, n: int = 1):
+        self._add("files_parsed", n)
+
+    def embedded(self, n: int):
+        self._add("chunks_embedded", n)
+
+    def written(self, n: int):
+        self._add("vectors_written", n)
+
+    def unchanged(self, n: int):
+        self._add("chunks_unchanged", n)
+
+    def deleted(self, n: int):
+        self._add("vectors_deleted", n)
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+
+class IngestionJob:
+    """The items (one dict per file or link) to ingest and the state of their ingestion."""
+
+    def __init__(self, items: List[Dict[str, Any]], job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.items = items
+        self.status = QUEUED
+        self.done = 0  # items ingested, in order
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.progress = JobProgress()
+        self.future: Optional[Future] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "files": [item["name"] for item in self.items],
+            "progress": {"files_total": len(self.items), "files_done": self.done, **self.progress.counters},
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+    def to_record(self) -> Dict[str, Any]:
+        return {**self.to_dict(), "items": self.items, "done": self.done}
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "IngestionJob":
+        job = cls(record["items"], record["id"])
+        job.status, job.done, job.error = record["status"], record["done"], record["error"]
+        job.created, job.started, job.finished = record["created"], record["started"], record["finished"]
+        counters = {k: v for k, v in record["progress"].items() if k not in ("files_total", "files_done")}
+        job.progress = JobProgress(counters)
+        return job
+
+
+class JobManager:
+    """Run ingestion jobs on a bounded pool of worker threads, log them to `log_path` and resume them.
+
+    `ingest_fn(item, progress)` ingests one item of a job. `on_complete(job)`, a function or a coroutine
+    function, is called in the worker thread after a job succeeded, e.g. to invalidate the megaservice cache.
+    """
+
+    def __init__(
+        self,
+        ingest_fn: Callable[[Dict[str, Any], JobProgress], Any],
+        on_complete: Optional[Callable[[IngestionJob], Any]] = None,
+        log_path: Optional[str] = DATAPREP_JOB_LOG,
+        max_workers: int = DATAPREP_JOB_WORKERS,
+        max_queued: int = DATAPREP_JOB_QUEUE_SIZE,
+        history: int = DATAPREP_JOB_HISTORY,
+    ):
+        self.ingest_fn = ingest_fn
+        self.on_complete = on_complete
+        self.log_path = log_path
+        self.max_queued = max_queued
+        self.history = history
+        self.jobs: Dict[str, IngestionJob] = {}
+        self._log_lines = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dataprep-job")
+        self._lock = threading.Lock()
+
+    def submit(self, items: List[Dict[str, Any]]) -> IngestionJob:
+        """Queue a job, JobQueueFull when `max_queued` jobs are already queued or running."""
+        job = IngestionJob(items)
+        with self._lock:
+            if sum(j.status in (QUEUED, RUNNING) for j in self.jobs.values()) >= self.max_queued:
+                raise JobQueueFull(f"{self.max_queued} ingestion jobs are already queued")
+            self.jobs[job.id] = job
+            self._trim()
+        self._log(job)
+        job.future = self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[IngestionJob]:
+        """Cancel a queued or running job, a finished job is left as is."""
+        job = self.jobs.get(job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        job.progress.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            # still queued, the worker will never see it
+            self._finish(job, CANCELLED)
+        return job
+
+    def resume(self) -> List[IngestionJob]:
+        """Load the job log, queue again the unfinished jobs and compact the log."""
+        if not self.log_path or not os.path.exists(self.log_path):
+            return []
+        records = {}
+        with open(self.log_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line may be cut by a crash
+                    continue
+                records[record["id"]] = record
+        resumed = []
+        with self._lock:
+            for record in records.values():
+                job = IngestionJob.from_record(record)
+                if job.status not in FINISHED:
+                    job.status = QUEUED
+                    resumed.append(job)
+                self.jobs[job.id] = job
+            self._trim()
+            self._compact()
+        for job in resumed:
+            if logflag:
+                logger.info(f"[ jobs ] resuming job {job.id} at item {job.done}/{len(job.items)}")
+            job.future = self._executor.submit(self._run, job)
+        return resumed
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _run(self, job: IngestionJob):
+        job.status, job.started = RUNNING, job.started or time.time()
+        self._log(job)
+        try:
+            for item in job.items[job.done :]:
+                job.progress.check_cancelled()
+                self.ingest_fn(item, job.progress)
+                job.done += 1
+                self._log(job)
+            if self.on_complete is not None:
+                result = self.on_complete(job)
+                if inspect.iscoroutine(result):
+                    asyncio.run(result)
+        except JobCancelled:
+            self._finish(job, CANCELLED)
+            raise
+        except Exception as e:
+            job.error = getattr(e, "detail", None) or str(e) or type(e).__name__
+            logger.error(f"[ jobs ] job {job.id} failed on item {job.done}: {job.error}")
+            self._finish(job, FAILED)
+            raise
+        self._finish(job, SUCCEEDED)
+
+    def _finish(self, job: IngestionJob, status: str):
+        job.status, job.finished = status, time.time()
+        self._log(job)
+        if logflag:
+            logger.info(f"[ jobs ] job {job.id} {status}: {job.to_dict()['progress']}")
+
+    def _log(self, job: IngestionJob):
+        if not self.log_path:
+            return
+        line = json.dumps(job.to_record()) + "\n"
+        with self._lock:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self._log_lines += 1
+            # a job logs a record per item, keep the log about the size of the jobs kept
+            if self._log_lines > 4 * (len(self.jobs) + self.history):
+                self._compact()
+
+    def _compact(self):
+        """Rewrite the log with the last record of the jobs kept, called with the lock held."""
+        if not self.log_path:
+            return
+        tmp_path = self.log_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for job in self.jobs.values():
+                f.write(json.dumps(job.to_record()) + "\n")
+        os.replace(tmp_path, self.log_path)
+        self._log_lines = len(self.jobs)
+
+    def _trim(self):
+        """Forget the oldest finished jobs beyond `history`, called with the lock held."""
+        finished = [job for job in self.jobs.values() if job.status in FINISHED]
+        for job in finished[: max(len(finished) - self.history, 0)]:
+            del self.jobs[job.id]
+
+
+async def run_ingestion(manager: JobManager, items: List[Dict[str, Any]], asynchronous: bool) -> Dict[str, Any]:
+    """Submit the items as a job. Return the job at once if `asynchronous`, else once the job succeeded.
+
+    The exception of a failed job is raised again, so the synchronous API answers as before.
+    """
+    try:
+        job = manager.submit(items)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    if asynchronous:
+        return {"status": 202, "message": "Data preparation job queued", "job_id": job.id}
+    try:
+        await asyncio.wrap_future(job.future)
+    except JobCancelled:
+        raise HTTPException(status_code=409, detail=f"Data preparation job {job.id} was cancelled")
+    return {"status": 200, "message": "Data preparation succeeded", "job_id": job.id}
+
+
+def register_job_routes(manager: JobManager, name: str, host: str = "0.0.0.0", port: int = 6007):
+    """Add the job status, list and cancellation endpoints to the dataprep microservice `name`."""
+    from comps import register_microservice
+
+    @register_microservice(name=name, endpoint="/v1/dataprep/jobs", host=host, port=port, methods=["GET"])
+    async def list_jobs():
+        return [job.to_dict() for job in manager.jobs.values()]
+
+    @register_microservice(name=name, endpoint="/v1/dataprep/jobs/{job_id}", host=host, port=port, methods=["GET"])
+    async def get_job(job_id: str):
+        job = manager.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+        return job.to_dict()
+
+    @register_microservice(name=name, endpoint="/v1/dataprep/jobs/{job_id}/cancel", host=host, port=port)
+    async def cancel_job(job_id: str):
+        job = manager.cancel(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+        return job.to_dict()
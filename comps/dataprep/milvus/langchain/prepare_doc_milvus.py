@@ -23,6 +23,14 @@ from langchain_milvus.vectorstores import Milvus
 from langchain_text_splitters import HTMLHeaderTextSplitter
 
 from comps import CustomLogger, DocPath, opea_microservices, register_microservice
+from comps.dataprep.jobs import (
+    DATAPREP_ASYNC_INGEST,
+    JobCancelled,
+    JobManager,
+    JobProgress,
+    register_job_routes,
+    run_ingestion,
+)
 from comps.dataprep.utils import (
     create_upload_folder,
     decode_filename,
@@ -69,7 +77,7 @@ class MosecEmbeddings(OpenAIEmbeddings):
         return [e if e is not None else empty_embedding() for e in batched_embeddings]
 
 
-def ingest_chunks_to_milvus(file_name: str, chunks: List):
+def ingest_chunks_to_milvus(file_name: str, chunks: List, progress: Optional[JobProgress] = None):
     if logflag:
         logger.info(f"[ ingest chunks ] file name: {file_name}")
 
@@ -81,6 +89,7 @@ def ingest_chunks_to_milvus(file_name: str, chunks: List):
     # Batch size
     batch_size = 32
     num_chunks = len(chunks)
+    progress = progress or JobProgress()
 
     for i in range(0, num_chunks, batch_size):
         if logflag:
@@ -99,6 +108,20 @@ def ingest_chunks_to_milvus(file_name: str, chunks: List):
             if logflag:
                 logger.info(f"[ ingest chunks ] fail to ingest chunks into Milvus. error: {e}")
             raise HTTPException(status_code=500, detail=f"Fail to store chunks of file {file_name}.")
+        try:
+            progress.embedded(len(batch_docs))
+            progress.written(len(batch_docs))
+        except JobCancelled:
+            # drop the chunks of the cancelled file, so that it can be uploaded again
+            my_milvus = Milvus(
+                embedding_function=embeddings,
+                collection_name=COLLECTION_NAME,
+                connection_args={"uri": milvus_uri},
+                index_params=index_params,
+                auto_id=True,
+            )
+            delete_by_partition_field(my_milvus, file_name)
+            raise
 
     if logflag:
         logger.info(f"[ ingest chunks ] Docs ingested file {file_name} to Milvus collection {COLLECTION_NAME}.")
@@ -106,7 +129,7 @@ def ingest_chunks_to_milvus(file_name: str, chunks: List):
     return True
 
 
-def ingest_data_to_milvus(doc_path: DocPath):
+def ingest_data_to_milvus(doc_path: DocPath, progress: Optional[JobProgress] = None):
     """Ingest document to Milvus."""
     path = doc_path.path
     file_name = path.split("/")[-1]
@@ -146,8 +169,31 @@ def ingest_data_to_milvus(doc_path: DocPath):
         chunks = chunks + table_chunks
     if logflag:
         logger.info(f"[ ingest data ] Done preprocessing. Created {len(chunks)} chunks of the original file.")
+    if progress is not None:
+        progress.parsed()
+
+    return ingest_chunks_to_milvus(file_name, chunks, progress)
+
+
+def ingest_job_item(item: dict, progress: JobProgress):
+    """Ingest one file or link of an ingestion job, run by a worker thread of `dataprep_jobs`."""
+    if item.get("link"):
+        content = parse_html_new([item["link"]], chunk_size=item["chunk_size"], chunk_overlap=item["chunk_overlap"])
+        with open(item["path"], "w", encoding="utf-8") as f:
+            f.write(content)
+    ingest_data_to_milvus(
+        DocPath(
+            path=item["path"],
+            chunk_size=item["chunk_size"],
+            chunk_overlap=item["chunk_overlap"],
+            process_table=item["process_table"],
+            table_strategy=item["table_strategy"],
+        ),
+        progress,
+    )
+
 
-    return ingest_chunks_to_milvus(file_name, chunks)
+dataprep_jobs = JobManager(ingest_job_item)
 
 
 def search_by_file(collection, file_name):
@@ -198,6 +244,7 @@ async def ingest_documents(
     chunk_overlap: int = Form(100),
     process_table: bool = Form(False),
     table_strategy: str = Form("fast"),
+    asynchronous: bool = Form(DATAPREP_ASYNC_INGEST),
 ):
     if logflag:
         logger.info(f"[ upload ] files:{files}")
@@ -215,10 +262,17 @@ async def ingest_documents(
         auto_id=True,
     )
 
+    params = {
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "process_table": process_table,
+        "table_strategy": table_strategy,
+    }
+
     if files:
         if not isinstance(files, list):
             files = [files]
-        uploaded_files = []
+        items = []
 
         for file in files:
             encode_file = encode_filename(file.filename)
@@ -243,52 +297,11 @@ async def ingest_documents(
                     )
 
             await save_content_to_local_disk(save_path, file)
-            ingest_data_to_milvus(
-                DocPath(
-                    path=save_path,
-                    chunk_size=chunk_size,
-                    chunk_overlap=chunk_overlap,
-                    process_table=process_table,
-                    table_strategy=table_strategy,
-                ),
-            )
-            uploaded_files.append(save_path)
+            items.append({"name": file.filename, "path": save_path, **params})
             if logflag:
                 logger.info(f"Saved file {save_path} into local disk.")
 
-        # def process_files_wrapper(files):
-        #     if not isinstance(files, list):
-        #         files = [files]
-        #     for file in files:
-        #         encode_file = encode_filename(file.filename)
-        #         save_path = upload_folder + encode_file
-        #         ingest_data_to_milvus(
-        #             DocPath(
-        #                 path=save_path,
-        #                 chunk_size=chunk_size,
-        #                 chunk_overlap=chunk_overlap,
-        #                 process_table=process_table,
-        #                 table_strategy=table_strategy,
-        #             ),
-        #         )
-
-        # try:
-        #     # Create a SparkContext
-        #     conf = SparkConf().setAppName("Parallel-dataprep").setMaster("local[*]")
-        #     sc = SparkContext(conf=conf)
-        #     # Create an RDD with parallel processing
-        #     parallel_num = min(len(uploaded_files), os.cpu_count())
-        #     rdd = sc.parallelize(uploaded_files, parallel_num)
-        #     print(uploaded_files)
-        #     # Perform a parallel operation
-        #     rdd_trans = rdd.map(process_files_wrapper)
-        #     rdd_trans.collect()
-        #     # Stop the SparkContext
-        #     sc.stop()
-        # except:
-        #     # Stop the SparkContext
-        #     sc.stop()
-        results = {"status": 200, "message": "Data preparation succeeded"}
+        results = await run_ingestion(dataprep_jobs, items, asynchronous)
         if logflag:
             logger.info(results)
         return results
@@ -298,6 +311,7 @@ async def ingest_documents(
         if not isinstance(link_list, list):
             raise HTTPException(status_code=400, detail="link_list should be a list.")
 
+        items = []
         for link in link_list:
             encoded_link = encode_filename(link)
             if logflag:
@@ -316,25 +330,21 @@ async def ingest_documents(
                         status_code=400, detail=f"Uploaded link {link} already exists. Please change link."
                     )
 
+            # the link is fetched and saved by the job
             save_path = upload_folder + encoded_link + ".txt"
-            content = parse_html_new([link], chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-            await save_content_to_local_disk(save_path, content)
-            ingest_data_to_milvus(
-                DocPath(
-                    path=save_path,
-                    chunk_size=chunk_size,
-                    chunk_overlap=chunk_overlap,
-                    process_table=process_table,
-                    table_strategy=table_strategy,
-                ),
-            )
+            items.append({"name": link, "path": save_path, "link": link, **params})
+
+        results = await run_ingestion(dataprep_jobs, items, asynchronous)
         if logflag:
-            logger.info(f"[ upload ] Successfully saved link list {link_list}")
-        return {"status": 200, "message": "Data preparation succeeded"}
+            logger.info(f"[ upload ] {results} for link list {link_list}")
+        return results
 
     raise HTTPException(status_code=400, detail="Must provide either a file or a string list.")
 
 
+register_job_routes(dataprep_jobs, name="opea_service@prepare_doc_milvus", host="0.0.0.0", port=6010)
+
+
 @register_microservice(
     name="opea_service@prepare_doc_milvus", endpoint="/v1/dataprep/get_file", host="0.0.0.0", port=6010
 )
@@ -488,4 +498,5 @@ if __name__ == "__main__":
             logger.info(f"[ prepare_doc_milvus ] LOCAL_EMBEDDING_MODEL:{LOCAL_EMBEDDING_MODEL}")
         embeddings = HuggingFaceBgeEmbeddings(model_name=LOCAL_EMBEDDING_MODEL)
 
+    dataprep_jobs.resume()
     opea_microservices["opea_service@prepare_doc_milvus"].start()
@@ -15,6 +15,14 @@ from langchain_community.embeddings import HuggingFaceBgeEmbeddings, HuggingFace
 from langchain_community.vectorstores import PGVector
 
 from comps import CustomLogger, DocPath, opea_microservices, register_microservice
+from comps.dataprep.jobs import (
+    DATAPREP_ASYNC_INGEST,
+    JobCancelled,
+    JobManager,
+    JobProgress,
+    register_job_routes,
+    run_ingestion,
+)
 from comps.dataprep.utils import (
     create_upload_folder,
     document_loader,
@@ -23,7 +31,6 @@ from comps.dataprep.utils import (
     get_separators,
     parse_html_new,
     remove_folder_with_ignore,
-    save_content_to_local_disk,
 )
 
 logger = CustomLogger("prepare_doc_pgvector")
@@ -91,7 +98,7 @@ def delete_embeddings(doc_name):
         return False
 
 
-def ingest_doc_to_pgvector(doc_path: DocPath):
+def ingest_doc_to_pgvector(doc_path: DocPath, progress: Optional[JobProgress] = None):
     """Ingest document to PGVector."""
     doc_path = doc_path.path
     if logflag:
@@ -115,6 +122,8 @@ def ingest_doc_to_pgvector(doc_path: DocPath):
         logger.info("Done preprocessing. Created ", len(chunks), " chunks of the original file.")
         logger.info("PG Connection", PG_CONNECTION_STRING)
     metadata = [dict({"doc_name": str(doc_path)})]
+    progress = progress or JobProgress()
+    progress.parsed()
 
     # Create vectorstore
     if tei_embedding_endpoint:
@@ -127,23 +136,30 @@ def ingest_doc_to_pgvector(doc_path: DocPath):
     # Batch size
     batch_size = 32
     num_chunks = len(chunks)
-    for i in range(0, num_chunks, batch_size):
-        batch_chunks = chunks[i : i + batch_size]
-        batch_texts = batch_chunks
-
-        _ = PGVector.from_texts(
-            texts=batch_texts,
-            embedding=embedder,
-            metadatas=metadata,
-            collection_name=INDEX_NAME,
-            connection_string=PG_CONNECTION_STRING,
-        )
-        if logflag:
-            logger.info(f"Processed batch {i//batch_size + 1}/{(num_chunks-1)//batch_size + 1}")
+    try:
+        for i in range(0, num_chunks, batch_size):
+            batch_chunks = chunks[i : i + batch_size]
+            batch_texts = batch_chunks
+
+            _ = PGVector.from_texts(
+                texts=batch_texts,
+                embedding=embedder,
+                metadatas=metadata,
+                collection_name=INDEX_NAME,
+                connection_string=PG_CONNECTION_STRING,
+            )
+            progress.embedded(len(batch_texts))
+            progress.written(len(batch_texts))
+            if logflag:
+                logger.info(f"Processed batch {i//batch_size + 1}/{(num_chunks-1)//batch_size + 1}")
+    except JobCancelled:
+        # drop the chunks of the cancelled file
+        delete_embeddings(str(doc_path))
+        raise
     return True
 
 
-async def ingest_link_to_pgvector(link_list: List[str]):
+def ingest_link_to_pgvector(link_list: List[str], progress: Optional[JobProgress] = None):
     # Create vectorstore
     if tei_embedding_endpoint:
         # create embeddings using TEI endpoint service
@@ -155,6 +171,7 @@ async def ingest_link_to_pgvector(link_list: List[str]):
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True, separators=get_separators()
     )
+    progress = progress or JobProgress()
 
     for link in link_list:
         texts = []
@@ -166,30 +183,49 @@ async def ingest_link_to_pgvector(link_list: List[str]):
         doc_path = upload_folder + link + ".txt"
         if logflag:
             logger.info(f"[ ingest link ] save_path: {save_path}")
-        await save_content_to_local_disk(save_path, content)
+        with open(save_path, "w", encoding="utf-8") as f:
+            f.write(content)
         metadata = [dict({"doc_name": str(doc_path)})]
 
         chunks = text_splitter.split_text(content)
+        progress.parsed()
 
         batch_size = 32
         num_chunks = len(chunks)
-        for i in range(0, num_chunks, batch_size):
-            batch_chunks = chunks[i : i + batch_size]
-            batch_texts = batch_chunks
-
-            _ = PGVector.from_texts(
-                texts=batch_texts,
-                embedding=embedder,
-                metadatas=metadata,
-                collection_name=INDEX_NAME,
-                connection_string=PG_CONNECTION_STRING,
-            )
-            if logflag:
-                logger.info(f"Processed batch {i//batch_size + 1}/{(num_chunks-1)//batch_size + 1}")
+        try:
+            for i in range(0, num_chunks, batch_size):
+                batch_chunks = chunks[i : i + batch_size]
+                batch_texts = batch_chunks
+
+                _ = PGVector.from_texts(
+                    texts=batch_texts,
+                    embedding=embedder,
+                    metadatas=metadata,
+                    collection_name=INDEX_NAME,
+                    connection_string=PG_CONNECTION_STRING,
+                )
+                progress.embedded(len(batch_texts))
+                progress.written(len(batch_texts))
+                if logflag:
+                    logger.info(f"Processed batch {i//batch_size + 1}/{(num_chunks-1)//batch_size + 1}")
+        except JobCancelled:
+            delete_embeddings(str(doc_path))
+            raise
 
     return True
 
 
+def ingest_job_item(item: dict, progress: JobProgress):
+    """Ingest one file or link of an ingestion job, run by a worker thread of `dataprep_jobs`."""
+    if item.get("link"):
+        ingest_link_to_pgvector([item["link"]], progress)
+    else:
+        ingest_doc_to_pgvector(DocPath(path=item["path"]), progress)
+
+
+dataprep_jobs = JobManager(ingest_job_item)
+
+
 @register_microservice(
     name="opea_service@prepare_doc_pgvector",
     endpoint="/v1/dataprep",
@@ -197,7 +233,9 @@ async def ingest_link_to_pgvector(link_list: List[str]):
     port=6007,
 )
 async def ingest_documents(
-    files: Optional[Union[UploadFile, List[UploadFile]]] = File(None), link_list: Optional[str] = Form(None)
+    files: Optional[Union[UploadFile, List[UploadFile]]] = File(None),
+    link_list: Optional[str] = Form(None),
+    asynchronous: bool = Form(DATAPREP_ASYNC_INGEST),
 ):
     if logflag:
         logger.info(f"files:{files}")
@@ -211,14 +249,14 @@ async def ingest_documents(
 
         if not os.path.exists(upload_folder):
             Path(upload_folder).mkdir(parents=True, exist_ok=True)
+        items = []
         for file in files:
             save_path = upload_folder + file.filename
             await save_file_to_local_disk(save_path, file)
-
-            ingest_doc_to_pgvector(DocPath(path=save_path))
+            items.append({"name": file.filename, "path": save_path})
             if logflag:
                 logger.info(f"Successfully saved file {save_path}")
-        result = {"status": 200, "message": "Data preparation succeeded"}
+        result = await run_ingestion(dataprep_jobs, items, asynchronous)
         if logflag:
             logger.info(result)
         return result
@@ -228,10 +266,9 @@ async def ingest_documents(
             link_list = json.loads(link_list)  # Parse JSON string to list
             if not isinstance(link_list, list):
                 raise HTTPException(status_code=400, detail="link_list should be a list.")
-            await ingest_link_to_pgvector(link_list)
-            if logflag:
-                logger.info(f"Successfully saved link list {link_list}")
-            result = {"status": 200, "message": "Data preparation succeeded"}
+            # the links are fetched and saved by the job
+            items = [{"name": link, "link": link} for link in link_list]
+            result = await run_ingestion(dataprep_jobs, items, asynchronous)
             if logflag:
                 logger.info(result)
             return result
@@ -241,6 +278,9 @@ async def ingest_documents(
     raise HTTPException(status_code=400, detail="Must provide either a file or a string list.")
 
 
+register_job_routes(dataprep_jobs, name="opea_service@prepare_doc_pgvector", host="0.0.0.0", port=6007)
+
+
 @register_microservice(
     name="opea_service@prepare_doc_pgvector", endpoint="/v1/dataprep/get_file", host="0.0.0.0", port=6007
 )
@@ -314,4 +354,5 @@ async def delete_single_file(file_path: str = Body(..., embed=True)):
 
 if __name__ == "__main__":
     create_upload_folder(upload_folder)
+    dataprep_jobs.resume()
     opea_microservices["opea_service@prepare_doc_pgvector"].start()
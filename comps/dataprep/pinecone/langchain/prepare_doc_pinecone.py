@@ -17,6 +17,7 @@ from langchain_text_splitters import HTMLHeaderTextSplitter
 from pinecone import Pinecone, ServerlessSpec
 
 from comps import CustomLogger, DocPath, opea_microservices, opea_telemetry, register_microservice
+from comps.dataprep.jobs import DATAPREP_ASYNC_INGEST, JobManager, JobProgress, register_job_routes, run_ingestion
 from comps.dataprep.utils import (
     create_upload_folder,
     document_loader,
@@ -83,7 +84,7 @@ def drop_index(index_name):
     return True
 
 
-def ingest_data_to_pinecone(doc_path: DocPath):
+def ingest_data_to_pinecone(doc_path: DocPath, progress: Optional[JobProgress] = None):
     """Ingest document to Pinecone."""
     path = doc_path.path
     if logflag:
@@ -119,6 +120,8 @@ def ingest_data_to_pinecone(doc_path: DocPath):
         chunks = chunks + table_chunks
     if logflag:
         logger.info("Done preprocessing. Created ", len(chunks), " chunks of the original file.")
+    progress = progress or JobProgress()
+    progress.parsed()
 
     # Create vectorstore
     if tei_embedding_endpoint:
@@ -151,6 +154,8 @@ def ingest_data_to_pinecone(doc_path: DocPath):
             embedding=embedder,
             index_name=PINECONE_INDEX_NAME,
         )
+        progress.embedded(len(batch_texts))
+        progress.written(len(batch_texts))
         if logflag:
             logger.info(f"Processed batch {i//batch_size + 1}/{(num_chunks-1)//batch_size + 1}")
 
@@ -158,7 +163,7 @@ def ingest_data_to_pinecone(doc_path: DocPath):
     pc = Pinecone(api_key=PINECONE_API_KEY)
 
 
-async def ingest_link_to_pinecone(link_list: List[str], chunk_size, chunk_overlap):
+def ingest_link_to_pinecone(link_list: List[str], chunk_size, chunk_overlap, progress: Optional[JobProgress] = None):
     # Create embedding obj
     if tei_embedding_endpoint:
         # create embeddings using TEI endpoint service
@@ -176,6 +181,8 @@ async def ingest_link_to_pinecone(link_list: List[str], chunk_size, chunk_overla
         if logflag:
             logger.info("Successfully created the index", PINECONE_INDEX_NAME)
 
+    progress = progress or JobProgress()
+
     # save link contents and doc_ids one by one
     for link in link_list:
         content = parse_html_new([link], chunk_size=chunk_size, chunk_overlap=chunk_overlap)
@@ -185,17 +192,41 @@ async def ingest_link_to_pinecone(link_list: List[str], chunk_size, chunk_overla
         save_path = upload_folder + encoded_link + ".txt"
         if logflag:
             logger.info(f"[ ingest link ] save_path: {save_path}")
-        await save_content_to_local_disk(save_path, content)
+        with open(save_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        progress.parsed()
 
         vectorstore = PineconeVectorStore.from_texts(
             texts=content,
             embedding=embedder,
             index_name=PINECONE_INDEX_NAME,
         )
+        progress.embedded(len(content))
+        progress.written(len(content))
 
     return True
 
 
+def ingest_job_item(item: dict, progress: JobProgress):
+    """Ingest one file or link of an ingestion job, run by a worker thread of `dataprep_jobs`."""
+    if item.get("link"):
+        ingest_link_to_pinecone([item["link"]], item["chunk_size"], item["chunk_overlap"], progress)
+        return
+    ingest_data_to_pinecone(
+        DocPath(
+            path=item["path"],
+            chunk_size=item["chunk_size"],
+            chunk_overlap=item["chunk_overlap"],
+            process_table=item["process_table"],
+            table_strategy=item["table_strategy"],
+        ),
+        progress,
+    )
+
+
+dataprep_jobs = JobManager(ingest_job_item)
+
+
 @register_microservice(name="opea_service@prepare_doc_pinecone", endpoint="/v1/dataprep", host="0.0.0.0", port=6007)
 async def ingest_documents(
     files: Optional[Union[UploadFile, List[UploadFile]]] = File(None),
@@ -204,32 +235,30 @@ async def ingest_documents(
     chunk_overlap: int = Form(100),
     process_table: bool = Form(False),
     table_strategy: str = Form("fast"),
+    asynchronous: bool = Form(DATAPREP_ASYNC_INGEST),
 ):
     if logflag:
         logger.info(f"files:{files}")
         logger.info(f"link_list:{link_list}")
+    params = {
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "process_table": process_table,
+        "table_strategy": table_strategy,
+    }
 
     if files:
         if not isinstance(files, list):
             files = [files]
-        uploaded_files = []
+        items = []
         for file in files:
             encode_file = encode_filename(file.filename)
             save_path = upload_folder + encode_file
             await save_content_to_local_disk(save_path, file)
-            ingest_data_to_pinecone(
-                DocPath(
-                    path=save_path,
-                    chunk_size=chunk_size,
-                    chunk_overlap=chunk_overlap,
-                    process_table=process_table,
-                    table_strategy=table_strategy,
-                )
-            )
-            uploaded_files.append(save_path)
+            items.append({"name": file.filename, "path": save_path, **params})
             if logflag:
                 logger.info(f"Successfully saved file {save_path}")
-        result = {"status": 200, "message": "Data preparation succeeded"}
+        result = await run_ingestion(dataprep_jobs, items, asynchronous)
         if logflag:
             logger.info(result)
         return result
@@ -239,8 +268,9 @@ async def ingest_documents(
             link_list = json.loads(link_list)  # Parse JSON string to list
             if not isinstance(link_list, list):
                 raise HTTPException(status_code=400, detail="link_list should be a list.")
-            await ingest_link_to_pinecone(link_list, chunk_size, chunk_overlap)
-            result = {"status": 200, "message": "Data preparation succeeded"}
+            # the links are fetched and saved by the job
+            items = [{"name": link, "link": link, **params} for link in link_list]
+            result = await run_ingestion(dataprep_jobs, items, asynchronous)
             if logflag:
                 logger.info(f"Successfully saved link list {link_list}")
                 logger.info(result)
@@ -251,6 +281,9 @@ async def ingest_documents(
     raise HTTPException(status_code=400, detail="Must provide either a file or a string list.")
 
 
+register_job_routes(dataprep_jobs, name="opea_service@prepare_doc_pinecone", host="0.0.0.0", port=6007)
+
+
 @register_microservice(
     name="opea_service@prepare_doc_pinecone_file", endpoint="/v1/dataprep/get_file", host="0.0.0.0", port=6008
 )
@@ -296,6 +329,7 @@ async def delete_all(file_path: str = Body(..., embed=True)):
 
 if __name__ == "__main__":
     create_upload_folder(upload_folder)
+    dataprep_jobs.resume()
     opea_microservices["opea_service@prepare_doc_pinecone"].start()
     opea_microservices["opea_service@prepare_doc_pinecone_file"].start()
     opea_microservices["opea_service@prepare_doc_pinecone_del"].start()
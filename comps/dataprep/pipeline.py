@@ -0,0 +1,245 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+"""Pipelined ingestion: parse -> split -> embed -> write.
+
+Documents are parsed and split in a process pool (`DATAPREP_PARSE_WORKERS`), so that PDF parsing and OCR do
+not hold the GIL of the service. The chunks are embedded in batches of `DATAPREP_EMBED_BATCH_SIZE` with up to
+`DATAPREP_EMBED_INFLIGHT` embedding requests in flight, and the embedded batches are written by a writer
+thread in order. At most `DATAPREP_PIPELINE_QUEUE_SIZE` embedded batches wait for the writer, a slow vector
+store holds back the embedding instead of piling the vectors up in memory.
+
+A long document can be streamed instead: its parts (e.g. the pages of a PDF) are parsed in the parse pool with
+`ordered_map` and split with `split_stream` as they come, so that its first chunks are embedded while the rest
+of it is still parsed.
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+DATAPREP_PARSE_WORKERS = int(os.getenv("DATAPREP_PARSE_WORKERS", 2))
+DATAPREP_EMBED_BATCH_SIZE = int(os.getenv("DATAPREP_EMBED_BATCH_SIZE", 32))
+DATAPREP_EMBED_INFLIGHT = int(os.getenv("DATAPREP_EMBED_INFLIGHT", 4))
+DATAPREP_PIPELINE_QUEUE_SIZE = int(os.getenv("DATAPREP_PIPELINE_QUEUE_SIZE", 8))
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+_in_parse_worker = False
+
+
+def _init_parse_worker(parent_pid: int):
+    """Initializer of the parse pool workers: flag the worker and exit once the service process is gone."""
+    global _in_parse_worker
+    _in_parse_worker = True
+
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def parse_pool() -> ProcessPoolExecutor:
+    """The process pool of the document parsing, created on the first use."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=DATAPREP_PARSE_WORKERS, initializer=_init_parse_worker, initargs=(os.getpid(),)
+            )
+        return _parse_pool
+
+
+def in_parse_worker() -> bool:
+    """Whether the caller runs in a worker of the parse pool, which must not fan work out to the pool."""
+    return _in_parse_worker
+
+
+class StageStats:
+    """Items processed by a stage and the time spent in it, summed over its concurrent calls.
+
+    `items_per_sec` is per second spent in the stage, i.e. the throughput of one worker of the stage.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items: int, seconds: float):
+        with self._lock:
+            self.items += items
+            self.busy += seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        rate = self.items / self.busy if self.busy else None
+        return {"items": self.items, "seconds": round(self.busy, 4), "items_per_sec": rate and round(rate, 1)}
+
+
+class PipelineStats:
+    def __init__(self):
+        self.stages = {name: StageStats(name) for name in ("parse", "split", "embed", "write")}
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+
+    def __getitem__(self, name: str) -> StageStats:
+        return self.stages[name]
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = (self.end or time.perf_counter()) - self.start
+        chunks = self.stages["write"].items
+        return {
+            "elapsed": round(elapsed, 4),
+            "chunks_per_sec": round(chunks / elapsed, 1) if elapsed else None,
+            "stages": {name: stage.to_dict() for name, stage in self.stages.items()},
+        }
+
+
+def parse_document(parse_fn: Callable[..., List[str]], *args, stats: Optional[PipelineStats] = None) -> List[str]:
+    """Chunks of a document, `parse_fn(*args)` run in the parse pool."""
+    start = time.perf_counter()
+    chunks = parse_pool().submit(parse_fn, *args).result()
+    if stats is not None:
+        stats["parse"].add(len(chunks), time.perf_counter() - start)
+    return chunks
+
+
+def ordered_map(
+    executor: Executor, fn: Callable, tasks: Iterable[tuple], max_inflight: int = 2 * DATAPREP_PARSE_WORKERS
+) -> Iterator[Any]:
+    """Results of `fn(*task)` run in `executor`, in the order of the tasks.
+
+    At most `max_inflight` tasks are submitted ahead of the consumer, so that a long document does not hold up
+    the other files sharing the pool. The pending tasks are cancelled when the generator is closed.
+    """
+    pending = deque()
+    try:
+        for task in tasks:
+            pending.append(executor.submit(fn, *task))
+            if len(pending) >= max_inflight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def split_stream(texts: Iterable[str], split_fn: Callable[[str], List[str]]) -> Iterator[str]:
+    """Chunks of the concatenated `texts`, split with `split_fn` as the texts come.
+
+    The last chunk of a text is split again with the next text, so that the chunks run across the boundaries
+    of the texts as for the whole document.
+    """
+    carry = ""
+    for text in texts:
+        chunks = split_fn(carry + text)
+        if not chunks:
+            continue
+        carry = chunks.pop()
+        yield from chunks
+    if carry:
+        yield carry
+
+
+def _batches(chunks: Iterable[str], batch_size: int, stats: PipelineStats) -> Iterator[List[str]]:
+    """Batches of the chunks, the time waiting for the chunks (e.g. the splitting of a stream) is "split"."""
+    iterator = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        batch = []
+        for chunk in iterator:
+            batch.append(chunk)
+            if len(batch) == batch_size:
+                break
+        stats["split"].add(len(batch), time.perf_counter() - start)
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+
+
+def embed_and_write(
+    chunks: Iterable[str],
+    embed_fn: Callable[[List[str]], List[List[float]]],
+    write_fn: Callable[[List[str], List[List[float]]], Any],
+    batch_size: int = DATAPREP_EMBED_BATCH_SIZE,
+    max_inflight: int = DATAPREP_EMBED_INFLIGHT,
+    queue_size: int = DATAPREP_PIPELINE_QUEUE_SIZE,
+    progress=None,
+    stats: Optional[PipelineStats] = None,
+) -> PipelineStats:
+    """Embed the chunks with `embed_fn(texts)` and write them with `write_fn(texts, vectors)`.
+
+    `embed_fn` is called from up to `max_inflight` threads at once, `write_fn` from one writer thread in the
+    order of the chunks. `progress` (a JobProgress) counts the chunks embedded and written, an exception of a
+    stage, JobCancelled included, stops the pipeline and is raised once the pending batches are dropped.
+    """
+    stats = stats or PipelineStats()
+    written: queue.Queue = queue.Queue(maxsize=queue_size)
+    errors: List[BaseException] = []
+
+    def embed(texts):
+        start = time.perf_counter()
+        vectors = embed_fn(texts)
+        stats["embed"].add(len(texts), time.perf_counter() - start)
+        return vectors
+
+    def writer():
+        while True:
+            batch = written.get()
+            if batch is None:
+                return
+            if errors:
+                # drain the queue so that the producer is not blocked
+                continue
+            texts, vectors = batch
+            try:
+                start = time.perf_counter()
+                write_fn(texts, vectors)
+                stats["write"].add(len(texts), time.perf_counter() - start)
+                if progress is not None:
+                    progress.written(len(texts))
+            except BaseException as e:
+                errors.append(e)
+
+    writer_thread = threading.Thread(target=writer, name="dataprep-writer", daemon=True)
+    writer_thread.start()
+    pending = deque()
+
+    def hand_over():
+        texts, future = pending.popleft()
+        vectors = future.result()
+        if progress is not None:
+            progress.embedded(len(texts))
+        written.put((texts, vectors))
+
+    with ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="dataprep-embed") as embed_pool:
+        try:
+            for texts in _batches(chunks, batch_size, stats):
+                if errors:
+                    break
+                pending.append((texts, embed_pool.submit(embed, texts)))
+                if len(pending) >= max_inflight:
+                    hand_over()
+            while pending and not errors:
+                hand_over()
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            for _, future in pending:
+                future.cancel()
+            written.put(None)
+            writer_thread.join()
+    stats.end = time.perf_counter()
+    if errors:
+        raise errors[0]
+    return stats
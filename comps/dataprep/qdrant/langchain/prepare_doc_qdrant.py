@@ -14,6 +14,7 @@ from langchain_huggingface import HuggingFaceEndpointEmbeddings
 from langchain_text_splitters import HTMLHeaderTextSplitter
 
 from comps import CustomLogger, DocPath, opea_microservices, register_microservice
+from comps.dataprep.jobs import DATAPREP_ASYNC_INGEST, JobManager, JobProgress, register_job_routes, run_ingestion
 from comps.dataprep.utils import (
     document_loader,
     encode_filename,
@@ -29,7 +30,7 @@ logflag = os.getenv("LOGFLAG", False)
 upload_folder = "./uploaded_files/"
 
 
-def ingest_data_to_qdrant(doc_path: DocPath):
+def ingest_data_to_qdrant(doc_path: DocPath, progress: Optional[JobProgress] = None):
     """Ingest document to Qdrant."""
     path = doc_path.path
     if logflag:
@@ -65,6 +66,8 @@ def ingest_data_to_qdrant(doc_path: DocPath):
         chunks = chunks + table_chunks
     if logflag:
         logger.info("Done preprocessing. Created ", len(chunks), " chunks of the original file.")
+    progress = progress or JobProgress()
+    progress.parsed()
 
     # Create vectorstore
     if TEI_EMBEDDING_ENDPOINT:
@@ -91,12 +94,38 @@ def ingest_data_to_qdrant(doc_path: DocPath):
             host=QDRANT_HOST,
             port=QDRANT_PORT,
         )
+        progress.embedded(len(batch_texts))
+        progress.written(len(batch_texts))
         if logflag:
             logger.info(f"Processed batch {i//batch_size + 1}/{(num_chunks-1)//batch_size + 1}")
 
     return True
 
 
+def ingest_job_item(item: dict, progress: JobProgress):
+    """Ingest one file or link of an ingestion job, run by a worker thread of `dataprep_jobs`."""
+    if item.get("link"):
+        content = parse_html_new([item["link"]], chunk_size=item["chunk_size"], chunk_overlap=item["chunk_overlap"])
+        with open(item["path"], "w", encoding="utf-8") as f:
+            f.write(content)
+    try:
+        ingest_data_to_qdrant(
+            DocPath(
+                path=item["path"],
+                chunk_size=item["chunk_size"],
+                chunk_overlap=item["chunk_overlap"],
+                process_table=item["process_table"],
+                table_strategy=item["table_strategy"],
+            ),
+            progress,
+        )
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=500, detail="Fail to ingest data into qdrant.")
+
+
+dataprep_jobs = JobManager(ingest_job_item)
+
+
 @register_microservice(
     name="opea_service@prepare_doc_qdrant",
     endpoint="/v1/dataprep",
@@ -112,32 +141,31 @@ async def ingest_documents(
     chunk_overlap: int = Form(100),
     process_table: bool = Form(False),
     table_strategy: str = Form("fast"),
+    asynchronous: bool = Form(DATAPREP_ASYNC_INGEST),
 ):
     if logflag:
         logger.info(f"files:{files}")
         logger.info(f"link_list:{link_list}")
 
+    params = {
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "process_table": process_table,
+        "table_strategy": table_strategy,
+    }
+
     if files:
         if not isinstance(files, list):
             files = [files]
-        uploaded_files = []
+        items = []
         for file in files:
             encode_file = encode_filename(file.filename)
             save_path = upload_folder + encode_file
             await save_content_to_local_disk(save_path, file)
-            ingest_data_to_qdrant(
-                DocPath(
-                    path=save_path,
-                    chunk_size=chunk_size,
-                    chunk_overlap=chunk_overlap,
-                    process_table=process_table,
-                    table_strategy=table_strategy,
-                )
-            )
-            uploaded_files.append(save_path)
+            items.append({"name": file.filename, "path": save_path, **params})
             if logflag:
                 logger.info(f"Successfully saved file {save_path}")
-        result = {"status": 200, "message": "Data preparation succeeded"}
+        result = await run_ingestion(dataprep_jobs, items, asynchronous)
         if logflag:
             logger.info(result)
         return result
@@ -146,28 +174,13 @@ async def ingest_documents(
         link_list = json.loads(link_list)  # Parse JSON string to list
         if not isinstance(link_list, list):
             raise HTTPException(status_code=400, detail="link_list should be a list.")
+        items = []
         for link in link_list:
-            encoded_link = encode_filename(link)
-            save_path = upload_folder + encoded_link + ".txt"
-            content = parse_html_new([link], chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-            try:
-                await save_content_to_local_disk(save_path, content)
-                ingest_data_to_qdrant(
-                    DocPath(
-                        path=save_path,
-                        chunk_size=chunk_size,
-                        chunk_overlap=chunk_overlap,
-                        process_table=process_table,
-                        table_strategy=table_strategy,
-                    )
-                )
-            except json.JSONDecodeError:
-                raise HTTPException(status_code=500, detail="Fail to ingest data into qdrant.")
-
-            if logflag:
-                logger.info(f"Successfully saved link {link}")
+            # the link is fetched and saved by the job
+            save_path = upload_folder + encode_filename(link) + ".txt"
+            items.append({"name": link, "path": save_path, "link": link, **params})
 
-        result = {"status": 200, "message": "Data preparation succeeded"}
+        result = await run_ingestion(dataprep_jobs, items, asynchronous)
         if logflag:
             logger.info(result)
         return result
@@ -175,5 +188,9 @@ async def ingest_documents(
     raise HTTPException(status_code=400, detail="Must provide either a file or a string list.")
 
 
+register_job_routes(dataprep_jobs, name="opea_service@prepare_doc_qdrant", host="0.0.0.0", port=6007)
+
+
 if __name__ == "__main__":
+    dataprep_jobs.resume()
     opea_microservices["opea_service@prepare_doc_qdrant"].start()
@@ -1,34 +1,45 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
 import json
 import os
+import tempfile
+import threading
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Iterable, List, Optional, Union
 
 # from pyspark import SparkConf, SparkContext
 import redis
 from config import EMBED_MODEL, INDEX_NAME, KEY_INDEX_NAME, REDIS_URL, SEARCH_BATCH_SIZE
 from fastapi import Body, File, Form, HTTPException, UploadFile
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceBgeEmbeddings
 from langchain_community.vectorstores import Redis
 from langchain_huggingface import HuggingFaceEndpointEmbeddings
-from langchain_text_splitters import HTMLHeaderTextSplitter
 from redis.commands.search.field import TextField
 from redis.commands.search.indexDefinition import IndexDefinition, IndexType
 
-from comps import CustomLogger, DocPath, opea_microservices, register_microservice
+from comps import CustomLogger, DocPath, cached_embeddings, opea_microservices, register_microservice
+from comps.dataprep.dedup import ChunkDiff, diff_chunks, file_hash
+from comps.dataprep.jobs import (
+    DATAPREP_ASYNC_INGEST,
+    JobCancelled,
+    JobManager,
+    JobProgress,
+    register_job_routes,
+    run_ingestion,
+)
+from comps.dataprep.pipeline import PipelineStats, embed_and_write, parse_document
 from comps.dataprep.utils import (
     create_upload_folder,
-    document_loader,
     encode_filename,
     format_search_results,
-    get_separators,
-    get_tables_result,
+    invalidate_megaservice_cache,
+    parse_and_split,
     parse_html_new,
     remove_folder_with_ignore,
     save_content_to_local_disk,
+    split_pdf,
 )
 
 logger = CustomLogger("prepare_doc_redis")
@@ -68,11 +79,12 @@ def create_index(client, index_name: str = KEY_INDEX_NAME):
     return True
 
 
-def store_by_id(client, key, value):
+def store_by_id(client, key, value, **fields):
+    """Store the keys of the chunks of file `key`, `fields` are e.g. the content hashes of the file."""
     if logflag:
         logger.info(f"[ store by id ] storing ids of {key}")
     try:
-        client.add_document(doc_id="file:" + key, file_name=key, key_ids=value)
+        client.add_document(doc_id="file:" + key, replace=True, file_name=key, key_ids=value, **fields)
         if logflag:
             logger.info(f"[ store by id ] store document success. id: file:{key}")
     except Exception as e:
@@ -122,39 +134,83 @@ def delete_by_id(client, id):
     return True
 
 
-def ingest_chunks_to_redis(file_name: str, chunks: List):
+_embedder = None
+_vectorstore = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder():
+    """The embedder of the process, the TEI client or the local model is created once.
+
+    With `EMBEDDING_CACHE`, the chunks already embedded, by this or another service, are not embedded again.
+    """
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            if tei_embedding_endpoint:
+                # create embeddings using TEI endpoint service
+                _embedder = cached_embeddings(
+                    HuggingFaceEndpointEmbeddings(model=tei_embedding_endpoint), tei_embedding_endpoint
+                )
+            else:
+                # create embeddings using local embedding model
+                _embedder = cached_embeddings(
+                    HuggingFaceBgeEmbeddings(model_name=EMBED_MODEL), EMBED_MODEL, separate_queries=True
+                )
+        return _embedder
+
+
+def get_vectorstore():
+    """The Redis vector store of INDEX_NAME, created once per process with its connection pool."""
+    global _vectorstore
+    embedder = get_embedder()
+    with _embedder_lock:
+        if _vectorstore is None:
+            _vectorstore = Redis(redis_url=REDIS_URL, index_name=INDEX_NAME, embedding=embedder)
+        return _vectorstore
+
+
+def ingest_chunks_to_redis(
+    file_name: str,
+    chunks: Iterable,
+    progress: Optional[JobProgress] = None,
+    stats: Optional[PipelineStats] = None,
+    diff: Optional[ChunkDiff] = None,
+    content_hash: str = "",
+):
+    """Embed and write the chunks of a file with the dataprep pipeline, then store their keys in KEY_INDEX_NAME.
+
+    With the `diff` of a file ingested before, only its added chunks are embedded and written, and the keys of
+    its removed chunks are deleted once the new keys are stored. Without, the chunks of the new file may be
+    streamed. Returns the diff.
+    """
     if logflag:
         logger.info(f"[ ingest chunks ] file name: {file_name}")
-    # Create vectorstore
-    if tei_embedding_endpoint:
-        # create embeddings using TEI endpoint service
-        embedder = HuggingFaceEndpointEmbeddings(model=tei_embedding_endpoint)
+    if diff is None:
+        diff = ChunkDiff([])
+        added = diff.track(chunks)
     else:
-        # create embeddings using local embedding model
-        embedder = HuggingFaceBgeEmbeddings(model_name=EMBED_MODEL)
-
-    # Batch size
-    batch_size = 32
-    num_chunks = len(chunks)
-
+        added = [chunk for _, chunk in diff.added]
+    embedder = get_embedder()
+    vectorstore = get_vectorstore()
     file_ids = []
-    for i in range(0, num_chunks, batch_size):
-        if logflag:
-            logger.info(f"[ ingest chunks ] Current batch: {i}")
-        batch_chunks = chunks[i : i + batch_size]
-        batch_texts = batch_chunks
-
-        _, keys = Redis.from_texts_return_keys(
-            texts=batch_texts,
-            embedding=embedder,
-            index_name=INDEX_NAME,
-            redis_url=REDIS_URL,
-        )
+
+    def write(texts, vectors):
+        # one pipelined round trip per batch, add_texts creates the index if delete_file dropped it
+        keys = vectorstore.add_texts(texts, embeddings=vectors, batch_size=len(texts))
         if logflag:
             logger.info(f"[ ingest chunks ] keys: {keys}")
         file_ids.extend(keys)
-        if logflag:
-            logger.info(f"[ ingest chunks ] Processed batch {i//batch_size + 1}/{(num_chunks-1)//batch_size + 1}")
+
+    try:
+        stats = embed_and_write(added, embedder.embed_documents, write, progress=progress, stats=stats)
+    except JobCancelled:
+        # the file key is not stored yet, drop the vectors of the cancelled file
+        if file_ids:
+            Redis.delete(ids=file_ids, redis_url=REDIS_URL)
+        raise
+    if logflag:
+        logger.info(f"[ ingest chunks ] {len(diff.added)} chunks of {file_name} ingested: {stats.to_dict()}")
 
     # store file_ids into index file-keys
     r = redis.Redis(connection_pool=redis_pool)
@@ -163,56 +219,112 @@ def ingest_chunks_to_redis(file_name: str, chunks: List):
         assert create_index(client)
 
     try:
-        assert store_by_id(client, key=file_name, value="#".join(file_ids))
+        assert store_by_id(
+            client,
+            key=file_name,
+            value="#".join(diff.keys(file_ids)),
+            file_hash=content_hash,
+            chunk_hashes="#".join(diff.hashes),
+        )
     except Exception as e:
         if logflag:
             logger.info(f"[ ingest chunks ] {e}. Fail to store chunks of file {file_name}.")
         raise HTTPException(status_code=500, detail=f"Fail to store chunks of file {file_name}.")
-    return True
 
+    if diff.removed:
+        Redis.delete(ids=diff.removed, redis_url=REDIS_URL)
+        if progress is not None:
+            progress.deleted(len(diff.removed))
+    return diff
+
+
+def ingest_data_to_redis(
+    doc_path: DocPath, progress: Optional[JobProgress] = None, file_name: Optional[str] = None, dry_run: bool = False
+):
+    """Ingest document to Redis.
 
-def ingest_data_to_redis(doc_path: DocPath):
-    """Ingest document to Redis."""
+    A file ingested before is re-ingested incrementally, see comps/dataprep/dedup.py. Returns the diff report
+    of the file, with `dry_run` nothing is written.
+    """
     path = doc_path.path
+    file_name = file_name or path.split("/")[-1]
+    progress = progress or JobProgress()
+    record = search_by_id(redis.Redis(connection_pool=redis_pool).ft(KEY_INDEX_NAME), "file:" + file_name)
+    old_keys = record.key_ids.split("#") if record is not None and record.key_ids else []
+    content_hash = file_hash(path)
+
+    if record is not None and getattr(record, "file_hash", None) == content_hash:
+        if logflag:
+            logger.info(f"[ ingest data ] {file_name} is unchanged, skipped.")
+        progress.parsed()
+        progress.unchanged(len(old_keys))
+        return {"file": file_name, "status": "unchanged", "added": 0, "kept": len(old_keys), "removed": 0}
+
     if logflag:
         logger.info(f"[ ingest data ] Parsing document {path}.")
-
-    if path.endswith(".html"):
-        headers_to_split_on = [
-            ("h1", "Header 1"),
-            ("h2", "Header 2"),
-            ("h3", "Header 3"),
-        ]
-        text_splitter = HTMLHeaderTextSplitter(headers_to_split_on=headers_to_split_on)
+    stats = PipelineStats()
+    params = (doc_path.chunk_size, doc_path.chunk_overlap, doc_path.process_table, doc_path.table_strategy)
+    if path.endswith(".pdf"):
+        # the pages are parsed in the parse pool and split as they come
+        chunks = split_pdf(path, *params)
     else:
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=doc_path.chunk_size,
-            chunk_overlap=doc_path.chunk_overlap,
-            add_start_index=True,
-            separators=get_separators(),
-        )
+        chunks = parse_document(parse_and_split, path, *params, stats=stats)
 
-    content = document_loader(path)
+    if record is None and not dry_run:
+        # a new file is streamed, its first chunks are embedded while the rest is parsed
+        diff = ingest_chunks_to_redis(file_name, chunks, progress, stats, content_hash=content_hash)
+        progress.parsed()
+        report = diff.report(file_name, is_new=True)
+        if logflag:
+            logger.info(f"[ ingest data ] {report}")
+        return report
+
+    chunks = list(chunks)
     if logflag:
-        logger.info("[ ingest data ] file content loaded")
+        logger.info(f"[ ingest data ] Done preprocessing. Created {len(chunks)} chunks of the given file.")
+    progress.parsed()
 
-    structured_types = [".xlsx", ".csv", ".json", "jsonl"]
-    _, ext = os.path.splitext(path)
+    old_hashes = getattr(record, "chunk_hashes", "").split("#") if record is not None else []
+    diff = diff_chunks(chunks, old_keys, old_hashes)
+    report = diff.report(file_name, is_new=record is None)
+    if logflag:
+        logger.info(f"[ ingest data ] {report}")
+    if dry_run:
+        return report
+    progress.unchanged(len(diff.kept))
+    ingest_chunks_to_redis(file_name, chunks, progress, stats, diff=diff, content_hash=content_hash)
+    return report
+
+
+def ingest_job_item(item: dict, progress: JobProgress):
+    """Ingest one file or link of an ingestion job, run by a worker thread of `dataprep_jobs`."""
+    if item.get("link"):
+        content = parse_html_new([item["link"]], chunk_size=item["chunk_size"], chunk_overlap=item["chunk_overlap"])
+        with open(item["path"], "w", encoding="utf-8") as f:
+            f.write(content)
+    ingest_data_to_redis(
+        DocPath(
+            path=item["path"],
+            chunk_size=item["chunk_size"],
+            chunk_overlap=item["chunk_overlap"],
+            process_table=item["process_table"],
+            table_strategy=item["table_strategy"],
+        ),
+        progress,
+    )
+    if logflag:
+        logger.info(f"[ ingest job ] Successfully ingested {item['name']}")
 
-    if ext in structured_types:
-        chunks = content
-    else:
-        chunks = text_splitter.split_text(content)
 
-    ### Specially processing for the table content in PDFs
-    if doc_path.process_table and path.endswith(".pdf"):
-        table_chunks = get_tables_result(path, doc_path.table_strategy)
-        chunks = chunks + table_chunks
-    if logflag:
-        logger.info(f"[ ingest data ] Done preprocessing. Created {len(chunks)} chunks of the given file.")
+dataprep_jobs = JobManager(ingest_job_item, on_complete=lambda job: invalidate_megaservice_cache())
+
 
-    file_name = doc_path.path.split("/")[-1]
-    return ingest_chunks_to_redis(file_name, chunks)
+async def dry_run_diff(tmp_path: str, file_name: str, params: dict) -> dict:
+    """Diff of the file saved at `tmp_path` with the stored file `file_name`, the temporary file is removed."""
+    try:
+        return await asyncio.to_thread(ingest_data_to_redis, DocPath(path=tmp_path, **params), None, file_name, True)
+    finally:
+        os.remove(tmp_path)
 
 
 @register_microservice(name="opea_service@prepare_doc_redis", endpoint="/v1/dataprep", host="0.0.0.0", port=6007)
@@ -223,18 +335,37 @@ async def ingest_documents(
     chunk_overlap: int = Form(100),
     process_table: bool = Form(False),
     table_strategy: str = Form("fast"),
+    asynchronous: bool = Form(DATAPREP_ASYNC_INGEST),
+    update: bool = Form(False),
+    dry_run: bool = Form(False),
 ):
+    """Save the files (or the links to fetch) and ingest them as a job of `dataprep_jobs`.
+
+    With `asynchronous` the job id is returned at once, the job is followed with GET /v1/dataprep/jobs/{job_id}.
+    Otherwise the response is sent when the job is done, the event loop serves the other clients meanwhile.
+
+    A file (or link) uploaded before is rejected, unless `update` is set: then only its new or changed chunks
+    are ingested and its vanished chunks deleted, it is skipped when it did not change. `dry_run` returns the
+    diff of each file with what is stored, without ingesting anything.
+    """
     if logflag:
         logger.info(f"[ upload ] files:{files}")
         logger.info(f"[ upload ] link_list:{link_list}")
 
     r = redis.Redis(connection_pool=redis_pool)
     client = r.ft(KEY_INDEX_NAME)
+    params = {
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "process_table": process_table,
+        "table_strategy": table_strategy,
+    }
 
     if files:
         if not isinstance(files, list):
             files = [files]
-        uploaded_files = []
+        items = []
+        diffs = []
 
         for file in files:
             encode_file = encode_filename(file.filename)
@@ -250,48 +381,28 @@ async def ingest_documents(
                     logger.info(f"[ upload ] File {file.filename} already exists.")
             except Exception as e:
                 logger.info(f"[ upload ] File {file.filename} does not exist.")
-            if key_ids:
+            if key_ids and not (update or dry_run):
                 raise HTTPException(
                     status_code=400, detail=f"Uploaded file {file.filename} already exists. Please change file name."
                 )
 
+            if dry_run:
+                # the stored file is left as is
+                fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(encode_file)[1])
+                os.close(fd)
+                await save_content_to_local_disk(tmp_path, file)
+                diffs.append(await dry_run_diff(tmp_path, encode_file, params))
+                continue
+
             save_path = upload_folder + encode_file
             await save_content_to_local_disk(save_path, file)
-            ingest_data_to_redis(
-                DocPath(
-                    path=save_path,
-                    chunk_size=chunk_size,
-                    chunk_overlap=chunk_overlap,
-                    process_table=process_table,
-                    table_strategy=table_strategy,
-                )
-            )
-            uploaded_files.append(save_path)
+            items.append({"name": file.filename, "path": save_path, **params})
             if logflag:
                 logger.info(f"[ upload ] Successfully saved file {save_path}")
 
-        # def process_files_wrapper(files):
-        #     if not isinstance(files, list):
-        #         files = [files]
-        #     for file in files:
-        #         ingest_data_to_redis(DocPath(path=file, chunk_size=chunk_size, chunk_overlap=chunk_overlap))
-
-        # try:
-        #     # Create a SparkContext
-        #     conf = SparkConf().setAppName("Parallel-dataprep").setMaster("local[*]")
-        #     sc = SparkContext(conf=conf)
-        #     # Create an RDD with parallel processing
-        #     parallel_num = min(len(uploaded_files), os.cpu_count())
-        #     rdd = sc.parallelize(uploaded_files, parallel_num)
-        #     # Perform a parallel operation
-        #     rdd_trans = rdd.map(process_files_wrapper)
-        #     rdd_trans.collect()
-        #     # Stop the SparkContext
-        #     sc.stop()
-        # except:
-        #     # Stop the SparkContext
-        #     sc.stop()
-        result = {"status": 200, "message": "Data preparation succeeded"}
+        if dry_run:
+            return {"status": 200, "message": "Dry run, nothing was ingested", "diff": diffs}
+        result = await run_ingestion(dataprep_jobs, items, asynchronous)
         if logflag:
             logger.info(result)
         return result
@@ -300,6 +411,8 @@ async def ingest_documents(
         link_list = json.loads(link_list)  # Parse JSON string to list
         if not isinstance(link_list, list):
             raise HTTPException(status_code=400, detail=f"Link_list {link_list} should be a list.")
+        items = []
+        diffs = []
         for link in link_list:
             encoded_link = encode_filename(link)
             doc_id = "file:" + encoded_link + ".txt"
@@ -314,30 +427,38 @@ async def ingest_documents(
                     logger.info(f"[ upload ] Link {link} already exists.")
             except Exception as e:
                 logger.info(f"[ upload ] Link {link} does not exist. Keep storing.")
-            if key_ids:
+            if key_ids and not (update or dry_run):
                 raise HTTPException(
                     status_code=400, detail=f"Uploaded link {link} already exists. Please change another link."
                 )
 
-            save_path = upload_folder + encoded_link + ".txt"
-            content = parse_html_new([link], chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-            await save_content_to_local_disk(save_path, content)
-            ingest_data_to_redis(
-                DocPath(
-                    path=save_path,
-                    chunk_size=chunk_size,
-                    chunk_overlap=chunk_overlap,
-                    process_table=process_table,
-                    table_strategy=table_strategy,
+            if dry_run:
+                content = await asyncio.to_thread(
+                    parse_html_new, [link], chunk_size=chunk_size, chunk_overlap=chunk_overlap
                 )
-            )
+                fd, tmp_path = tempfile.mkstemp(suffix=".txt")
+                os.close(fd)
+                await save_content_to_local_disk(tmp_path, content)
+                diffs.append(await dry_run_diff(tmp_path, encoded_link + ".txt", params))
+                continue
+
+            # the link is fetched and saved by the job
+            save_path = upload_folder + encoded_link + ".txt"
+            items.append({"name": link, "path": save_path, "link": link, **params})
+
+        if dry_run:
+            return {"status": 200, "message": "Dry run, nothing was ingested", "diff": diffs}
+        result = await run_ingestion(dataprep_jobs, items, asynchronous)
         if logflag:
-            logger.info(f"[ upload ] Successfully saved link list {link_list}")
-        return {"status": 200, "message": "Data preparation succeeded"}
+            logger.info(f"[ upload ] {result} for link list {link_list}")
+        return result
 
     raise HTTPException(status_code=400, detail="Must provide either a file or a string list.")
 
 
+register_job_routes(dataprep_jobs, name="opea_service@prepare_doc_redis", host="0.0.0.0", port=6007)
+
+
 @register_microservice(
     name="opea_service@prepare_doc_redis", endpoint="/v1/dataprep/get_file", host="0.0.0.0", port=6007
 )
@@ -427,6 +548,7 @@ async def delete_single_file(file_path: str = Body(..., embed=True)):
         if logflag:
             logger.info("[ delete ] successfully delete all files.")
         create_upload_folder(upload_folder)
+        await invalidate_megaservice_cache()
         if logflag:
             logger.info({"status": True})
         return {"status": True}
@@ -473,6 +595,7 @@ async def delete_single_file(file_path: str = Body(..., embed=True)):
             if logflag:
                 logger.info(f"[ delete ] {e}. File {file_path} delete failed for db {INDEX_NAME}")
             raise HTTPException(status_code=500, detail=f"File {file_path} delete failed for index.")
+    await invalidate_megaservice_cache()
 
     # local file does not exist (restarted docker container)
     if not delete_path.exists():
@@ -497,4 +620,5 @@ async def delete_single_file(file_path: str = Body(..., embed=True)):
 
 if __name__ == "__main__":
     create_upload_folder(upload_folder)
+    dataprep_jobs.resume()
     opea_microservices["opea_service@prepare_doc_redis"].start()
@@ -1,9 +1,11 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
 import base64
 import errno
 import functools
+import hashlib
 import json
 import multiprocessing
 import os
@@ -15,11 +17,12 @@ import tempfile
 import timeit
 import unicodedata
 import urllib.parse
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Union
 from urllib.parse import urlparse, urlunparse
 
+import aiohttp
 import cairosvg
 import cv2
 import docx
@@ -42,10 +45,20 @@ from langchain_community.document_loaders import (
 from langchain_community.llms import HuggingFaceEndpoint
 
 from comps import CustomLogger
+from comps.dataprep.pipeline import in_parse_worker, ordered_map, parse_pool, split_stream
 
 logger = CustomLogger("prepare_doc_util")
 logflag = os.getenv("LOGFLAG", False)
 
+DATAPREP_PDF_PAGES_PER_TASK = int(os.getenv("DATAPREP_PDF_PAGES_PER_TASK", 4))
+DATAPREP_OCR_THREADS = int(os.getenv("DATAPREP_OCR_THREADS", 2))
+# images smaller than this many pixels in width or height are not OCRed
+DATAPREP_OCR_MIN_SIZE = int(os.getenv("DATAPREP_OCR_MIN_SIZE", 32))
+# directory of the OCR results cached by image hash, unset by default as nothing bounds its size
+DATAPREP_OCR_CACHE = os.getenv("DATAPREP_OCR_CACHE", "")
+OCR_LANG = "eng"
+OCR_CONFIG = "--psm 6"
+
 
 class TimeoutError(Exception):
     pass
@@ -111,40 +124,98 @@ def get_separators():
     return separators
 
 
-def process_page(doc, idx):
-    page = doc.load_page(idx)
-    pagetext = page.get_text().strip()
-    result = pagetext if pagetext.endswith(("!", "?", ".")) else pagetext + "."
+def plan_pdf_pages(doc):
+    """The pages of the PDF with the xrefs of their images to OCR, as (page number, xrefs).
 
-    page_images = doc.get_page_images(idx)
-    if page_images:
-        for img_index, img in enumerate(page_images):
-            xref = img[0]
-            img_data = doc.extract_image(xref)
-            img_bytes = img_data["image"]
+    Tiny images (icons, bullets, rules) are skipped, and an image drawn on several pages (logos, backgrounds) is
+    only OCRed on its first page.
+    """
+    seen = set()
+    pages = []
+    for idx in range(doc.page_count):
+        xrefs = []
+        for img in doc.get_page_images(idx):
+            xref, width, height = img[0], img[2], img[3]
+            if xref in seen or min(width, height) < DATAPREP_OCR_MIN_SIZE:
+                continue
+            seen.add(xref)
+            xrefs.append(xref)
+        pages.append((idx, xrefs))
+    return pages
+
+
+def _ocr_cache_path(img_bytes):
+    digest = hashlib.sha256(f"{OCR_LANG} {OCR_CONFIG}\0".encode() + img_bytes).hexdigest()
+    return os.path.join(DATAPREP_OCR_CACHE, digest[:2], digest + ".txt")
+
+
+def ocr_image(img_bytes):
+    """Text of an image with Tesseract, cached on disk by the hash of the image with `DATAPREP_OCR_CACHE`."""
+    cache_path = _ocr_cache_path(img_bytes) if DATAPREP_OCR_CACHE else None
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as f:
+            return f.read()
+    img_array = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if img_array is None:
+        if logflag:
+            logger.info("[ ocr image ] image format not supported by OpenCV, skipped.")
+        return ""
+    text = pytesseract.image_to_string(img_array, lang=OCR_LANG, config=OCR_CONFIG)
+    if cache_path:
+        # written aside then renamed, the workers of the parse pool share the cache
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, cache_path)
+    return text
 
-            # process images
-            img_array = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
-            img_result = pytesseract.image_to_string(img_array, lang="eng", config="--psm 6")
 
-            # add results
-            pageimg = img_result.strip()
-            pageimg += "" if pageimg.endswith(("!", "?", ".")) else "."
-            result += pageimg
-    return result
+def process_pages(pdf_path, pages):
+    """Text of the `pages` of the PDF, from `plan_pdf_pages`, their images OCRed concurrently.
 
+    A top-level function, so that `iter_pdf_pages` runs it in the parse pool.
+    """
+    with fitz.open(pdf_path) as doc:
+        texts = [doc.load_page(idx).get_text().strip() for idx, _ in pages]
+        images = [[doc.extract_image(xref)["image"] for xref in xrefs] for _, xrefs in pages]
+
+    # tesseract runs in a subprocess, the threads OCR the images in parallel
+    with ThreadPoolExecutor(max_workers=DATAPREP_OCR_THREADS) as executor:
+        futures = [[executor.submit(ocr_image, img_bytes) for img_bytes in page_images] for page_images in images]
+        results = []
+        for pagetext, page_futures in zip(texts, futures):
+            result = pagetext if pagetext.endswith(("!", "?", ".")) else pagetext + "."
+            for future in page_futures:
+                pageimg = future.result().strip()
+                pageimg += "" if pageimg.endswith(("!", "?", ".")) else "."
+                result += pageimg
+            results.append(result)
+    return results
+
+
+def iter_pdf_pages(pdf_path):
+    """Text of the pages of the PDF in order, as they are parsed.
+
+    Runs of `DATAPREP_PDF_PAGES_PER_TASK` pages are parsed in the parse pool of the dataprep pipeline. In a
+    worker of that pool (e.g. `parse_and_split`), the pages are parsed in the worker itself.
+    """
+    with fitz.open(pdf_path) as doc:
+        pages = plan_pdf_pages(doc)
+    tasks = [
+        (pdf_path, pages[i : i + DATAPREP_PDF_PAGES_PER_TASK])
+        for i in range(0, len(pages), DATAPREP_PDF_PAGES_PER_TASK)
+    ]
+    if in_parse_worker():
+        for task in tasks:
+            yield from process_pages(*task)
+        return
+    for results in ordered_map(parse_pool(), process_pages, tasks):
+        yield from results
 
-def load_pdf(pdf_path):
-    doc = fitz.open(pdf_path)
-    results = []
-
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = [executor.submit(process_page, doc, i) for i in range(doc.page_count)]
-        for future in as_completed(futures):
-            results.append(future.result())
 
-    combined_result = "".join(results)
-    return combined_result
+def load_pdf(pdf_path):
+    return "".join(iter_pdf_pages(pdf_path))
 
 
 def load_html(html_path):
@@ -693,6 +764,65 @@ def get_tables_result(pdf_path, table_strategy):
     return tables_result
 
 
+def get_text_splitter(path: str, chunk_size: int, chunk_overlap: int):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain_text_splitters import HTMLHeaderTextSplitter
+
+    if path.endswith(".html"):
+        headers_to_split_on = [
+            ("h1", "Header 1"),
+            ("h2", "Header 2"),
+            ("h3", "Header 3"),
+        ]
+        return HTMLHeaderTextSplitter(headers_to_split_on=headers_to_split_on)
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        add_start_index=True,
+        separators=get_separators(),
+    )
+
+
+def parse_and_split(path: str, chunk_size: int, chunk_overlap: int, process_table: bool, table_strategy: str):
+    """Load the document at `path` and split it in chunks, the tables of a PDF included if `process_table`.
+
+    A top-level function, so that the dataprep pipeline runs it in its parse pool.
+    """
+    text_splitter = get_text_splitter(path, chunk_size, chunk_overlap)
+
+    content = document_loader(path)
+
+    structured_types = [".xlsx", ".csv", ".json", "jsonl"]
+    _, ext = os.path.splitext(path)
+
+    if ext in structured_types:
+        chunks = content
+    else:
+        chunks = text_splitter.split_text(content)
+
+    ### Specially processing for the table content in PDFs
+    if process_table and path.endswith(".pdf"):
+        chunks = chunks + (get_tables_result(path, table_strategy) or [])
+    return chunks
+
+
+def split_pdf(path: str, chunk_size: int, chunk_overlap: int, process_table: bool, table_strategy: str):
+    """Chunks of the PDF at `path` as its pages are parsed, then its tables if `process_table`.
+
+    Run in the service process: the pages are parsed in the parse pool and the tables meanwhile, the chunks
+    come before the whole document is parsed.
+    """
+    text_splitter = get_text_splitter(path, chunk_size, chunk_overlap)
+    tables = parse_pool().submit(get_tables_result, path, table_strategy) if process_table else None
+    try:
+        yield from split_stream(iter_pdf_pages(path), text_splitter.split_text)
+        if tables is not None:
+            yield from tables.result() or []
+    finally:
+        if tables is not None:
+            tables.cancel()
+
+
 def llm_generate(content):
     llm_endpoint = os.getenv("TGI_LLM_ENDPOINT", "http://localhost:8080")
     llm = HuggingFaceEndpoint(
@@ -836,3 +966,26 @@ def remove_folder_with_ignore(folder_path: str, except_patterns: List = []):
                 continue
             if not os.listdir(dir_path):
                 os.rmdir(dir_path)
+
+
+async def invalidate_megaservice_cache(service_types: List[str] = ["RETRIEVER", "RERANK"]):
+    """Tell the megaservice gateway that the knowledge base changed, so cached results are dropped.
+
+    The gateway endpoint (e.g. http://chatqna-backend:8888/v1/invalidate_cache) is read from
+    `MEGASERVICE_CACHE_INVALIDATE_ENDPOINT` and its token from `MEGASERVICE_CACHE_INVALIDATE_TOKEN`,
+    nothing is done when the endpoint is not set.
+    """
+    endpoint = os.getenv("MEGASERVICE_CACHE_INVALIDATE_ENDPOINT")
+    if not endpoint:
+        return
+    headers = {"Authorization": f"Bearer {os.getenv('MEGASERVICE_CACHE_INVALIDATE_TOKEN', '')}"}
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+            async with session.post(endpoint, json={"service_types": service_types}, headers=headers) as response:
+                response.raise_for_status()
+                result = await response.json()
+        if logflag:
+            logger.info(f"[ invalidate cache ] {result}")
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # a stale cache must not fail the ingestion
+        logger.warning(f"[ invalidate cache ] failed to invalidate the megaservice cache: {e}")
@@ -24,6 +24,7 @@ from comps.cores.proto.api_protocol import (
     EmbeddingResponse,
     EmbeddingResponseData,
 )
+from comps.cores.proto.embedding_encoding import encode_base64
 
 logger = CustomLogger("embedding_mosec")
 logflag = os.getenv("LOGFLAG", False)
@@ -69,7 +70,7 @@ class MosecEmbeddings(OpenAIEmbeddings):
 )
 @register_statistics(names=["opea_service@embedding_mosec"])
 async def embedding(
-    input: Union[TextDoc, EmbeddingRequest, ChatCompletionRequest]
+    input: Union[TextDoc, EmbeddingRequest, ChatCompletionRequest],
 ) -> Union[EmbedDoc, EmbeddingResponse, ChatCompletionRequest]:
     if logflag:
         logger.info(input)
@@ -82,6 +83,8 @@ async def embedding(
         embed_vector = await get_embeddings(input.input)
         if input.dimensions is not None:
             embed_vector = [embed_vector[i][: input.dimensions] for i in range(len(embed_vector))]
+        if input.encoding_format == "base64":
+            embed_vector = [encode_base64(vector) for vector in embed_vector]
 
         # for standard openai embedding format
         res = EmbeddingResponse(
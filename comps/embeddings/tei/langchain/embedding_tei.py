@@ -13,11 +13,13 @@ from comps import (
     EmbedDoc,
     ServiceType,
     TextDoc,
+    get_embedding_cache,
     opea_microservices,
     register_microservice,
     register_statistics,
     statistics_dict,
 )
+from comps.cores.mega.embedding_cache import aembed_cached
 from comps.cores.mega.utils import get_access_token
 from comps.cores.proto.api_protocol import (
     ChatCompletionRequest,
@@ -25,6 +27,7 @@ from comps.cores.proto.api_protocol import (
     EmbeddingResponse,
     EmbeddingResponseData,
 )
+from comps.cores.proto.embedding_encoding import encode_base64
 
 logger = CustomLogger("embedding_tei_langchain")
 logflag = os.getenv("LOGFLAG", False)
@@ -35,6 +38,9 @@ TOKEN_URL = os.getenv("TOKEN_URL")
 CLIENTID = os.getenv("CLIENTID")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 TEI_EMBEDDING_ENDPOINT = os.getenv("TEI_EMBEDDING_ENDPOINT", "http://localhost:8080")
+EMBEDDING_CACHE_MODEL_ID = os.getenv("EMBEDDING_CACHE_MODEL_ID", TEI_EMBEDDING_ENDPOINT)
+
+embedding_cache = get_embedding_cache()
 
 
 @register_microservice(
@@ -46,7 +52,7 @@ TEI_EMBEDDING_ENDPOINT = os.getenv("TEI_EMBEDDING_ENDPOINT", "http://localhost:8
 )
 @register_statistics(names=["opea_service@embedding_tei_langchain"])
 async def embedding(
-    input: Union[TextDoc, EmbeddingRequest, ChatCompletionRequest]
+    input: Union[TextDoc, EmbeddingRequest, ChatCompletionRequest],
 ) -> Union[EmbedDoc, EmbeddingResponse, ChatCompletionRequest]:
     start = time.time()
     access_token = (
@@ -63,6 +69,8 @@ async def embedding(
         embed_vector = await aembed_query(input.input, async_client)
         if input.dimensions is not None:
             embed_vector = [embed_vector[i][: input.dimensions] for i in range(len(embed_vector))]
+        if input.encoding_format == "base64":
+            embed_vector = [encode_base64(vector) for vector in embed_vector]
 
         # for standard openai embedding format
         res = EmbeddingResponse(
@@ -84,8 +92,13 @@ async def aembed_query(
     text: Union[str, List[str]], async_client: AsyncInferenceClient, model_kwargs=None, task=None
 ) -> List[List[float]]:
     texts = [text] if isinstance(text, str) else text
-    response = await aembed_documents(texts, async_client, model_kwargs=model_kwargs, task=task)
-    return response
+    if embedding_cache is None or model_kwargs:
+        return await aembed_documents(texts, async_client, model_kwargs=model_kwargs, task=task)
+
+    async def embed(missing):
+        return await aembed_documents(missing, async_client, task=task)
+
+    return await aembed_cached(embedding_cache, EMBEDDING_CACHE_MODEL_ID, texts, embed)
 
 
 async def aembed_documents(
@@ -1,7 +1,6 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
-import asyncio
 import math
 import os
 from enum import Enum
@@ -179,23 +178,16 @@ async def dynamic_batching_infer(service_type: Enum, batch: list[dict]):
     dynamic_batching_max_batch_size=DYNAMIC_BATCHING_MAX_BATCH_SIZE,
 )
 async def embedding(
-    input: Union[TextDoc, EmbeddingRequest, ChatCompletionRequest]
+    input: Union[TextDoc, EmbeddingRequest, ChatCompletionRequest],
 ) -> Union[EmbedDoc, EmbeddingResponse, ChatCompletionRequest]:
 
     # if logflag:
     #     logger.info(input)
-    # Create a future for this specific request
-    response_future = asyncio.get_event_loop().create_future()
-
     cur_microservice = opea_microservices["opea_service@local_embedding_reranking"]
     cur_microservice.dynamic_batching_infer = dynamic_batching_infer
-    async with cur_microservice.buffer_lock:
-        cur_microservice.request_buffer[ServiceType.EMBEDDING].append({"request": input, "response": response_future})
 
     # Wait for batch inference to complete and return results
-    result = await response_future
-
-    return result
+    return await cur_microservice.dynamic_batching_submit(ServiceType.EMBEDDING, input)
 
 
 @register_microservice(
@@ -218,18 +210,11 @@ async def reranking(input: SearchedDoc) -> LLMParamsDoc:
     if len(input.retrieved_docs) == 0:
         return LLMParamsDoc(query=input.initial_query)
 
-    # Create a future for this specific request
-    response_future = asyncio.get_event_loop().create_future()
-
     cur_microservice = opea_microservices["opea_service@local_embedding_reranking"]
     cur_microservice.dynamic_batching_infer = dynamic_batching_infer
-    async with cur_microservice.buffer_lock:
-        cur_microservice.request_buffer[ServiceType.RERANK].append({"request": input, "response": response_future})
 
     # Wait for batch inference to complete and return results
-    result = await response_future
-
-    return result
+    return await cur_microservice.dynamic_batching_submit(ServiceType.RERANK, input)
 
 
 if __name__ == "__main__":
@@ -20,6 +20,7 @@ from comps import (
     opea_microservices,
     register_microservice,
     register_statistics,
+    sse_response,
     statistics_dict,
 )
 from comps.cores.mega.utils import ConfigError, get_access_token, load_model_configs
@@ -114,16 +115,18 @@ async def llm_generate(input: Union[LLMParamsDoc, ChatCompletionRequest, Searche
                     stream_gen_time.append(time.time() - start)
                     if text not in ["<|im_end|>", "<|endoftext|>"]:
                         chat_response += text
-                        chunk_repr = repr(text.encode("utf-8"))
                         if logflag:
-                            logger.info(f"[ SearchedDoc ] chunk:{chunk_repr}")
-                        yield f"data: {chunk_repr}\n\n"
+                            logger.info(f"[ SearchedDoc ] chunk: {text!r}")
+                        yield text
                 if logflag:
                     logger.info(f"[ SearchedDoc ] stream response: {chat_response}")
-                statistics_dict["opea_service@llm_tgi"].append_latency(stream_gen_time[-1], stream_gen_time[0])
-                yield "data: [DONE]\n\n"
+                statistics_dict["opea_service@llm_tgi"].append_latency(
+                    stream_gen_time[-1],
+                    stream_gen_time[0],
+                    [b - a for a, b in zip(stream_gen_time, stream_gen_time[1:])],
+                )
 
-            return StreamingResponse(stream_generator(), media_type="text/event-stream")
+            return sse_response(stream_generator(), "opea_service@llm_tgi", model=input.model)
         else:
             statistics_dict["opea_service@llm_tgi"].append_latency(time.time() - start, None)
             if logflag:
@@ -165,16 +168,18 @@ async def llm_generate(input: Union[LLMParamsDoc, ChatCompletionRequest, Searche
                     stream_gen_time.append(time.time() - start)
                     if text not in ["<|im_end|>", "<|endoftext|>"]:
                         chat_response += text
-                        chunk_repr = repr(text.encode("utf-8"))
                         if logflag:
-                            logger.info(f"[ LLMParamsDoc ] chunk:{chunk_repr}")
-                        yield f"data: {chunk_repr}\n\n"
+                            logger.info(f"[ LLMParamsDoc ] chunk: {text!r}")
+                        yield text
                 if logflag:
                     logger.info(f"[ LLMParamsDoc ] stream response: {chat_response}")
-                statistics_dict["opea_service@llm_tgi"].append_latency(stream_gen_time[-1], stream_gen_time[0])
-                yield "data: [DONE]\n\n"
+                statistics_dict["opea_service@llm_tgi"].append_latency(
+                    stream_gen_time[-1],
+                    stream_gen_time[0],
+                    [b - a for a, b in zip(stream_gen_time, stream_gen_time[1:])],
+                )
 
-            return StreamingResponse(stream_generator(), media_type="text/event-stream")
+            return sse_response(stream_generator(), "opea_service@llm_tgi", model=input.model)
         else:
             statistics_dict["opea_service@llm_tgi"].append_latency(time.time() - start, None)
             if logflag:
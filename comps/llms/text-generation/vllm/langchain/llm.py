@@ -4,7 +4,6 @@
 import os
 from typing import Union
 
-from fastapi.responses import StreamingResponse
 from langchain_community.llms import VLLMOpenAI
 from langchain_core.prompts import PromptTemplate
 from template import ChatTemplate
@@ -18,6 +17,7 @@ from comps import (
     opea_microservices,
     opea_telemetry,
     register_microservice,
+    sse_response,
 )
 from comps.cores.mega.utils import ConfigError, get_access_token, load_model_configs
 from comps.cores.proto.api_protocol import ChatCompletionRequest
@@ -126,15 +126,13 @@ async def llm_generate(input: Union[LLMParamsDoc, ChatCompletionRequest, Searche
                 async for text in llm.astream(new_input.query, **parameters):
                     if text not in ["<|im_end|>", "<|endoftext|>"]:
                         chat_response += text
-                        chunk_repr = repr(text.encode("utf-8"))
                         if logflag:
-                            logger.info(f"[ SearchedDoc ] chunk: {chunk_repr}")
-                        yield f"data: {chunk_repr}\n\n"
+                            logger.info(f"[ SearchedDoc ] chunk: {text!r}")
+                        yield text
                 if logflag:
                     logger.info(f"[ SearchedDoc ] stream response: {chat_response}")
-                yield "data: [DONE]\n\n"
 
-            return StreamingResponse(stream_generator(), media_type="text/event-stream")
+            return sse_response(stream_generator(), "opea_service@llm_vllm", model=model_name)
 
         else:
             response = await llm.ainvoke(new_input.query, **parameters)
@@ -178,15 +176,13 @@ async def llm_generate(input: Union[LLMParamsDoc, ChatCompletionRequest, Searche
                 async for text in llm.astream(prompt, **parameters):
                     if text not in ["<|im_end|>", "<|endoftext|>"]:
                         chat_response += text
-                        chunk_repr = repr(text.encode("utf-8"))
                         if logflag:
-                            logger.info(f"[ LLMParamsDoc ] chunk: {chunk_repr}")
-                        yield f"data: {chunk_repr}\n\n"
+                            logger.info(f"[ LLMParamsDoc ] chunk: {text!r}")
+                        yield text
                 if logflag:
                     logger.info(f"[ LLMParamsDoc ] stream response: {chat_response}")
-                yield "data: [DONE]\n\n"
 
-            return StreamingResponse(stream_generator(), media_type="text/event-stream")
+            return sse_response(stream_generator(), "opea_service@llm_vllm", model=model_name)
 
         else:
             response = await llm.ainvoke(prompt, **parameters)
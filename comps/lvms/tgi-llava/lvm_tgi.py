@@ -120,7 +120,11 @@ async def lvm(request: Union[LVMDoc, LVMSearchedMultimodalDoc]) -> Union[TextDoc
                 yield f"data: {chunk_repr}\n\n"
             if logflag:
                 logger.info(f"[llm - chat_stream] stream response: {chat_response}")
-            statistics_dict["opea_service@lvm_tgi"].append_latency(stream_gen_time[-1], stream_gen_time[0])
+            statistics_dict["opea_service@lvm_tgi"].append_latency(
+                stream_gen_time[-1],
+                stream_gen_time[0],
+                [b - a for a, b in zip(stream_gen_time, stream_gen_time[1:])],
+            )
             yield "data: [DONE]\n\n"
 
         return StreamingResponse(stream_generator(), media_type="text/event-stream")
@@ -16,6 +16,7 @@ from comps import (
     SearchedDoc,
     ServiceType,
     TextDoc,
+    cached_embeddings,
     opea_microservices,
     register_microservice,
     register_statistics,
@@ -28,6 +29,7 @@ from comps.cores.proto.api_protocol import (
     RetrievalResponse,
     RetrievalResponseData,
 )
+from comps.cores.proto.embedding_encoding import decode_embedding
 
 logger = CustomLogger("retriever_redis")
 logflag = os.getenv("LOGFLAG", False)
@@ -44,7 +46,7 @@ tei_embedding_endpoint = os.getenv("TEI_EMBEDDING_ENDPOINT")
 )
 @register_statistics(names=["opea_service@retriever_redis"])
 async def retrieve(
-    input: Union[EmbedDoc, RetrievalRequest, ChatCompletionRequest]
+    input: Union[EmbedDoc, RetrievalRequest, ChatCompletionRequest],
 ) -> Union[SearchedDoc, RetrievalResponse, ChatCompletionRequest]:
     if logflag:
         logger.info(input)
@@ -66,7 +68,7 @@ async def retrieve(
                     # each emb is EmbeddingResponseData
                     # print("Embedding data: ", emb.embedding)
                     # print("Embedding data length: ",len(emb.embedding))
-                    embedding_data_input.append(emb.embedding)
+                    embedding_data_input.append(decode_embedding(emb.embedding))
                 # print("All Embedding data length: ",len(embedding_data_input))
             else:
                 embedding_data_input = input.embedding
@@ -119,9 +121,14 @@ if __name__ == "__main__":
     if tei_embedding_endpoint:
         # create embeddings using TEI endpoint service
         embeddings = HuggingFaceEndpointEmbeddings(model=tei_embedding_endpoint)
+        # the queries of the score threshold and mmr searches are embedded by the vector store, with the cache
+        # enabled they are served from the embeddings of the embedding microservice
+        embeddings = cached_embeddings(embeddings, tei_embedding_endpoint)
     else:
         # create embeddings using local embedding model
-        embeddings = HuggingFaceBgeEmbeddings(model_name=EMBED_MODEL)
+        embeddings = cached_embeddings(
+            HuggingFaceBgeEmbeddings(model_name=EMBED_MODEL), EMBED_MODEL, separate_queries=True
+        )
 
     vector_db = Redis(embedding=embeddings, index_name=INDEX_NAME, redis_url=REDIS_URL)
     opea_microservices["opea_service@retriever_redis"].start()
@@ -0,0 +1,66 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import tempfile
+import unittest
+
+from comps.dataprep.dedup import chunk_hash, diff_chunks, file_hash
+
+
+class Document:
+    def __init__(self, page_content):
+        self.page_content = page_content
+
+
+class TestDedup(unittest.TestCase):
+    def test_hashes(self):
+        self.assertEqual(chunk_hash("a chunk"), chunk_hash(Document("a chunk")))
+        self.assertNotEqual(chunk_hash("a chunk"), chunk_hash("a chunk."))
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "doc.txt")
+            with open(path, "w") as f:
+                f.write("some text")
+            digest = file_hash(path, block_size=4)
+            with open(path, "a") as f:
+                f.write("!")
+            self.assertNotEqual(file_hash(path), digest)
+
+    def test_new_file(self):
+        diff = diff_chunks(["a", "b"], [], [])
+        self.assertEqual(diff.added, [(0, "a"), (1, "b")])
+        self.assertEqual(diff.keys(["k1", "k2"]), ["k1", "k2"])
+        self.assertEqual(diff.report("doc.txt", is_new=True)["status"], "new")
+
+    def test_changed_file(self):
+        old = diff_chunks(["a", "b", "c", "b"], [], [])
+        old_keys = ["ka", "kb1", "kc", "kb2"]
+        # "c" vanished, "d" is new and "a" moved, the repeated "b" keep their keys in order
+        diff = diff_chunks(["b", "a", "b", "d"], old_keys, old.hashes)
+        self.assertEqual(diff.added, [(3, "d")])
+        self.assertEqual(diff.kept, {0: "kb1", 1: "ka", 2: "kb2"})
+        self.assertEqual(diff.removed, ["kc"])
+        self.assertEqual(diff.keys(["kd"]), ["kb1", "ka", "kb2", "kd"])
+        self.assertEqual(
+            diff.report("doc.txt", is_new=False),
+            {"file": "doc.txt", "status": "changed", "added": 1, "kept": 3, "removed": 1},
+        )
+        unchanged = diff_chunks(["a", "b", "c", "b"], old_keys, old.hashes)
+        self.assertEqual(unchanged.report("doc.txt", is_new=False)["status"], "unchanged")
+
+    def test_streamed_file(self):
+        diff = diff_chunks([], [], [])
+        self.assertEqual(list(diff.track(iter(["a", "b"]))), ["a", "b"])
+        self.assertEqual(diff.added, [(0, "a"), (1, "b")])
+        self.assertEqual(diff.hashes, diff_chunks(["a", "b"], [], []).hashes)
+        self.assertEqual(diff.keys(["k1", "k2"]), ["k1", "k2"])
+
+    def test_file_without_hashes(self):
+        # ingested before the chunk hashes were recorded: fully re-ingested
+        diff = diff_chunks(["a", "b"], ["k1", "k2", "k3"], [""])
+        self.assertEqual(len(diff.added), 2)
+        self.assertEqual(diff.removed, ["k1", "k2", "k3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
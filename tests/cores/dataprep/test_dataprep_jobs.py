@@ -0,0 +1,157 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from comps import opea_microservices
+from comps.dataprep.jobs import (
+    CANCELLED,
+    FAILED,
+    SUCCEEDED,
+    JobCancelled,
+    JobManager,
+    JobQueueFull,
+    register_job_routes,
+    run_ingestion,
+)
+
+
+def fake_ingest(item, progress):
+    """Parse, embed and write `item["chunks"]` chunks."""
+    if item.get("fail"):
+        raise ValueError(f"cannot parse {item['name']}")
+    progress.parsed()
+    progress.embedded(item["chunks"])
+    progress.written(item["chunks"])
+
+
+class TestJobManager(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.tmpdir.name, "jobs.jsonl")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_progress_and_completion(self):
+        completed = []
+
+        async def on_complete(job):
+            completed.append(job.id)
+
+        manager = JobManager(fake_ingest, on_complete=on_complete, log_path=self.log_path)
+        job = manager.submit([{"name": "a.txt", "chunks": 3}, {"name": "b.txt", "chunks": 2}])
+        job.future.result(timeout=5)
+        status = manager.get(job.id).to_dict()
+        self.assertEqual(status["status"], SUCCEEDED)
+        self.assertEqual(status["files"], ["a.txt", "b.txt"])
+        self.assertEqual(
+            status["progress"],
+            {
+                "files_total": 2,
+                "files_done": 2,
+                "files_parsed": 2,
+                "chunks_embedded": 5,
+                "vectors_written": 5,
+                "chunks_unchanged": 0,
+                "vectors_deleted": 0,
+            },
+        )
+        self.assertEqual(completed, [job.id])
+        manager.shutdown()
+
+    def test_failure(self):
+        manager = JobManager(fake_ingest, log_path=self.log_path)
+        job = manager.submit([{"name": "a.txt", "chunks": 1}, {"name": "b.pdf", "fail": True}])
+        with self.assertRaises(ValueError):
+            job.future.result(timeout=5)
+        self.assertEqual((job.status, job.done, job.error), (FAILED, 1, "cannot parse b.pdf"))
+        manager.shutdown()
+
+    def test_cancel(self):
+        started, release = threading.Event(), threading.Event()
+
+        def blocking_ingest(item, progress):
+            started.set()
+            release.wait(5)
+            progress.embedded(1)
+
+        manager = JobManager(blocking_ingest, log_path=self.log_path, max_workers=1)
+        running = manager.submit([{"name": "a.txt"}, {"name": "b.txt"}])
+        queued = manager.submit([{"name": "c.txt"}])
+        self.assertTrue(started.wait(5))
+        # a queued job is cancelled at once, a running job at its next progress update
+        self.assertEqual(manager.cancel(queued.id).status, CANCELLED)
+        manager.cancel(running.id)
+        release.set()
+        with self.assertRaises(JobCancelled):
+            running.future.result(timeout=5)
+        self.assertEqual((running.status, running.done), (CANCELLED, 0))
+        manager.shutdown()
+
+    def test_resume(self):
+        manager = JobManager(fake_ingest, log_path=self.log_path)
+        job = manager.submit([{"name": "a.txt", "chunks": 1}])
+        job.future.result(timeout=5)
+        manager.shutdown()
+        # a job interrupted by a restart after its first file
+        record = dict(job.to_record(), id="interrupted", status="running", finished=None)
+        record["items"] = [{"name": f"{name}.txt", "chunks": 1} for name in "xyz"]
+        with open(self.log_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.write('{"id": "cut by the crash"')
+
+        ingested = []
+        manager = JobManager(lambda item, progress: ingested.append(item["name"]), log_path=self.log_path)
+        resumed = manager.resume()
+        self.assertEqual([job.id for job in resumed], ["interrupted"])
+        resumed[0].future.result(timeout=5)
+        self.assertEqual(ingested, ["y.txt", "z.txt"])
+        self.assertEqual(manager.get(job.id).status, SUCCEEDED)
+        manager.shutdown()
+        with open(self.log_path) as f:
+            records = [json.loads(line) for line in f]
+        # compacted on resume, then the resumed job logged its items
+        self.assertEqual(len({record["id"] for record in records}), 2)
+        self.assertEqual(records[-1]["status"], SUCCEEDED)
+
+    def test_queue_full(self):
+        release = threading.Event()
+        manager = JobManager(lambda item, progress: release.wait(5), log_path=None, max_workers=1, max_queued=1)
+        manager.submit([{"name": "a.txt"}])
+        with self.assertRaises(JobQueueFull):
+            manager.submit([{"name": "b.txt"}])
+        with self.assertRaises(HTTPException) as cm:
+            asyncio.run(run_ingestion(manager, [{"name": "b.txt"}], asynchronous=True))
+        self.assertEqual(cm.exception.status_code, 429)
+        release.set()
+        manager.shutdown()
+
+
+class TestJobRoutes(unittest.TestCase):
+    def test_routes(self):
+        manager = JobManager(fake_ingest, log_path=None)
+        register_job_routes(manager, name="dataprep_jobs_test", port=8094)
+        client = TestClient(opea_microservices["dataprep_jobs_test"].app)
+
+        result = asyncio.run(run_ingestion(manager, [{"name": "a.txt", "chunks": 2}], asynchronous=False))
+        self.assertEqual(result["message"], "Data preparation succeeded")
+        response = client.get(f"/v1/dataprep/jobs/{result['job_id']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["progress"]["vectors_written"], 2)
+        self.assertEqual(len(client.get("/v1/dataprep/jobs").json()), 1)
+        self.assertEqual(client.post(f"/v1/dataprep/jobs/{result['job_id']}/cancel").json()["status"], SUCCEEDED)
+        self.assertEqual(client.get("/v1/dataprep/jobs/unknown").status_code, 404)
+        manager.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import threading
+import time
+import unittest
+
+from comps.dataprep.jobs import JobCancelled, JobProgress
+from comps.dataprep.pipeline import (
+    PipelineStats,
+    embed_and_write,
+    in_parse_worker,
+    ordered_map,
+    parse_document,
+    parse_pool,
+    split_stream,
+)
+
+
+def split_words(text, size):
+    """Parse function of the parse pool, run in a child process."""
+    words = text.split()
+    return [" ".join(words[i : i + size]) + f" ({os.getpid()})" for i in range(0, len(words), size)]
+
+
+def parse_part(index, delay):
+    """A part of a document parsed in the parse pool, the first parts are the slowest."""
+    time.sleep(delay)
+    return index, in_parse_worker()
+
+
+class TestPipeline(unittest.TestCase):
+    def test_order_and_progress(self):
+        lock = threading.Lock()
+        inflight, max_inflight = 0, 0
+
+        def embed(texts):
+            nonlocal inflight, max_inflight
+            with lock:
+                inflight += 1
+                max_inflight = max(max_inflight, inflight)
+            # later batches are faster, the writes must still be in order
+            time.sleep(0.02 if texts[0] == "c0" else 0.005)
+            with lock:
+                inflight -= 1
+            return [[float(len(text))] for text in texts]
+
+        written = []
+        progress = JobProgress()
+        chunks = (f"c{i}" for i in range(50))
+        stats = embed_and_write(
+            chunks,
+            embed,
+            lambda texts, vectors: written.extend(zip(texts, vectors)),
+            batch_size=4,
+            max_inflight=3,
+            progress=progress,
+        )
+        self.assertEqual([text for text, _ in written], [f"c{i}" for i in range(50)])
+        self.assertEqual(written[10], ("c10", [3.0]))
+        self.assertLessEqual(max_inflight, 3)
+        self.assertGreater(max_inflight, 1)
+        self.assertEqual(progress.counters["chunks_embedded"], 50)
+        self.assertEqual(progress.counters["vectors_written"], 50)
+        report = stats.to_dict()
+        self.assertEqual(report["stages"]["embed"]["items"], 50)
+        self.assertEqual(report["stages"]["write"]["items"], 50)
+
+    def test_bounded_queue(self):
+        # a stalled writer holds back the embedding
+        release = threading.Event()
+        embedded = []
+
+        def embed(texts):
+            embedded.extend(texts)
+            return [[0.0]] * len(texts)
+
+        def write(texts, vectors):
+            release.wait(5)
+
+        thread = threading.Thread(
+            target=embed_and_write,
+            args=([str(i) for i in range(100)], embed, write),
+            kwargs={"batch_size": 1, "max_inflight": 2, "queue_size": 2},
+        )
+        thread.start()
+        time.sleep(0.2)
+        # one batch in the writer, 2 in the queue, 2 in flight and one waiting for the queue
+        self.assertLessEqual(len(embedded), 7)
+        release.set()
+        thread.join(5)
+        self.assertEqual(len(embedded), 100)
+
+    def test_errors(self):
+        def write(texts, vectors):
+            if texts[0] == "8":
+                raise ConnectionError("vector store down")
+
+        with self.assertRaises(ConnectionError):
+            embed_and_write([str(i) for i in range(100)], lambda texts: [[0.0]] * len(texts), write, batch_size=4)
+
+        progress = JobProgress()
+        progress.cancel_event.set()
+        with self.assertRaises(JobCancelled):
+            embed_and_write(["a", "b"], lambda texts: [[0.0]] * len(texts), lambda *_: None, progress=progress)
+
+    def test_parse_document(self):
+        stats = PipelineStats()
+        chunks = parse_document(split_words, "one two three four five", 2, stats=stats)
+        self.assertEqual([chunk.split(" (")[0] for chunk in chunks], ["one two", "three four", "five"])
+        # parsed in the parse pool
+        self.assertNotIn(f"({os.getpid()})", chunks[0])
+        self.assertEqual(stats["parse"].items, 3)
+
+    def test_ordered_map(self):
+        tasks = [(i, 0.05 if i < 2 else 0.0) for i in range(6)]
+        results = list(ordered_map(parse_pool(), parse_part, tasks, max_inflight=3))
+        self.assertEqual(results, [(i, True) for i in range(6)])
+        self.assertFalse(in_parse_worker())
+
+        # at most max_inflight parts ahead, none submitted once the stream is closed
+        submitted = []
+
+        class Executor:
+            def submit(self, fn, *args):
+                submitted.append(args)
+                return parse_pool().submit(fn, *args)
+
+        stream = ordered_map(Executor(), parse_part, tasks, max_inflight=2)
+        self.assertEqual(next(stream), (0, True))
+        stream.close()
+        self.assertEqual(len(submitted), 2)
+
+    def test_split_stream(self):
+        def split(text):
+            # chunks of 3 words
+            words = text.split()
+            return [" ".join(words[i : i + 3]) + " " for i in range(0, len(words), 3)]
+
+        pages = ["one two three four ", "five ", "", "six seven eight nine ten "]
+        chunks = list(split_stream(pages, split))
+        self.assertEqual(chunks, split("".join(pages)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import unittest
+
+import aiohttp
+
+from comps import AdmissionController, AdmissionRejected, TextDoc, opea_microservices, register_microservice
+
+
+@register_microservice(
+    name="admission_slow",
+    host="0.0.0.0",
+    port=8088,
+    endpoint="/v1/slow",
+    admission_control=AdmissionController(max_concurrency=1, max_queue_size=1),
+)
+async def slow(request: TextDoc) -> TextDoc:
+    await asyncio.sleep(0.5)
+    return {"text": request.text}
+
+
+class TestAdmissionController(unittest.IsolatedAsyncioTestCase):
+    async def test_queue_and_reject(self):
+        controller = AdmissionController(max_concurrency=2, max_queue_size=1)
+        await controller.acquire()
+        await controller.acquire()
+        waiting = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        self.assertEqual(controller.queued, 1)
+        with self.assertRaises(AdmissionRejected) as cm:
+            await controller.acquire()
+        self.assertEqual(cm.exception.status_code, 429)
+        self.assertGreaterEqual(cm.exception.retry_after, 1)
+
+        controller.release(0.1)
+        await waiting
+        self.assertEqual((controller.inflight, controller.queued), (2, 0))
+        controller.release(0.1)
+        controller.release(0.1)
+        self.assertEqual(controller.inflight, 0)
+
+    async def test_priority(self):
+        controller = AdmissionController(
+            max_concurrency=1,
+            max_queue_size=2,
+            priority_classes={"interactive": 10, "batch": -10},
+            api_key_classes={"secret": "interactive"},
+        )
+        self.assertEqual(controller.priority({"authorization": "Bearer secret"}), 10)
+        self.assertEqual(controller.priority({"x-priority-class": "batch"}), -10)
+        self.assertEqual(controller.priority({"x-priority-class": "unknown"}), 0)
+
+        await controller.acquire()
+        order = []
+
+        async def request(name, priority):
+            await controller.acquire(priority)
+            order.append(name)
+
+        batch = asyncio.create_task(request("batch", -10))
+        default = asyncio.create_task(request("default", 0))
+        await asyncio.sleep(0)
+        # the queue is full, the batch request is shed for the interactive one
+        interactive = asyncio.create_task(request("interactive", 10))
+        await asyncio.sleep(0)
+        with self.assertRaises(AdmissionRejected) as cm:
+            await batch
+        self.assertEqual(cm.exception.status_code, 503)
+
+        controller.release()
+        await interactive
+        controller.release()
+        await default
+        self.assertEqual(order, ["interactive", "default"])
+
+    async def test_queue_timeout(self):
+        controller = AdmissionController(max_concurrency=1, max_queue_size=1, queue_timeout=0.05)
+        await controller.acquire()
+        with self.assertRaises(AdmissionRejected) as cm:
+            await controller.acquire()
+        self.assertEqual(cm.exception.status_code, 503)
+        self.assertEqual(controller.queued, 0)
+        # the slot of the timed out request is not handed over
+        controller.release()
+        self.assertEqual(controller.inflight, 0)
+
+    async def test_cancelled_waiter(self):
+        controller = AdmissionController(max_concurrency=1, max_queue_size=1)
+        await controller.acquire()
+        waiting = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        controller.release()
+        self.assertEqual((controller.inflight, controller.queued), (0, 0))
+
+
+class TestAdmissionMiddleware(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.service = opea_microservices["admission_slow"]
+        cls.service.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service.stop()
+
+    async def test_load_shedding(self):
+        async with aiohttp.ClientSession() as session:
+
+            async def post():
+                async with session.post("http://localhost:8088/v1/slow", json={"text": "hi"}) as response:
+                    return response.status, response.headers.get("Retry-After")
+
+            results = await asyncio.gather(*[post() for _ in range(3)])
+            statuses = sorted(status for status, _ in results)
+            self.assertEqual(statuses, [200, 200, 429])
+            self.assertIn(("429", "1"), [(str(status), retry_after) for status, retry_after in results])
+
+            async with session.get("http://localhost:8088/metrics") as response:
+                metrics = await response.text()
+            self.assertIn('admission_requests_rejected_total{endpoint="/v1/slow"', metrics)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -16,6 +16,7 @@ from comps import (
     register_statistics,
     statistics_dict,
 )
+from comps.cores.mega.base_statistics import BaseStatistics, LatencySketch
 
 
 @register_microservice(name="s1", host="0.0.0.0", port=8083, endpoint="/v1/add")
@@ -55,5 +56,38 @@ class TestBaseStatistics(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(int(p50), int(p99))
 
 
+class TestLatencySketch(unittest.TestCase):
+    def test_quantiles(self):
+        sketch = LatencySketch()
+        for value in range(1, 1001):
+            sketch.add(value / 1000)
+        self.assertAlmostEqual(sketch.quantile(0.5), 0.5, delta=0.5 * 0.02)
+        self.assertAlmostEqual(sketch.quantile(0.99), 0.99, delta=0.99 * 0.02)
+        self.assertEqual(sketch.quantile(1), 1.0)
+        self.assertAlmostEqual(sketch.average(), 0.5005)
+        # memory grows with the range of the values, not with their count
+        self.assertLess(len(sketch.buckets), 400)
+
+    def test_windows_and_merge(self):
+        statistic = BaseStatistics()
+        now = time.time()
+        statistic.response_times.add(10.0, now - 600)
+        statistic.append_latency(1.0, 0.1, [0.01, 0.03])
+        windows = statistic.calculate_window_statistics(now)
+        self.assertEqual(windows["1m"]["requests"], 1)
+        self.assertEqual(windows["1h"]["requests"], 2)
+        self.assertEqual(windows["1h"]["max_latency"], 10.0)
+        self.assertAlmostEqual(windows["1m"]["throughput"], 1 / 60)
+        self.assertEqual(windows["1m"]["max_latency_inter_token"], 0.03)
+
+        # the JSON state shared between workers merges into the same statistics
+        merged = BaseStatistics()
+        merged.merge(json.loads(json.dumps(statistic.state())))
+        merged.merge(statistic.state())
+        self.assertEqual(merged.calculate_window_statistics(now)["1h"]["requests"], 4)
+        self.assertEqual(merged.calculate_statistics()["average_latency"], 5.5)
+        self.assertEqual(merged.calculate_first_token_statistics()["p50_latency_first_token"], 0.1)
+
+
 if __name__ == "__main__":
     unittest.main()
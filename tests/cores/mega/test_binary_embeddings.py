@@ -0,0 +1,98 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+
+import aiohttp
+
+from comps import EmbedDoc, ServiceOrchestrator, ServiceType, TextDoc, opea_microservices, register_microservice
+from comps.cores.proto.api_protocol import RetrievalRequest
+from comps.cores.proto.embedding_encoding import (
+    EMBEDDING_MEDIA_TYPE,
+    accept_header,
+    accepted_dtype,
+    decode_embedding,
+    encode_base64,
+    encode_embedding,
+)
+
+VECTOR = [0.5, -0.25, 0.125, 1.0]
+
+
+@register_microservice(
+    name="binary_embedding", host="0.0.0.0", port=8091, endpoint="/v1/embeddings", service_type=ServiceType.EMBEDDING
+)
+async def embed(request: TextDoc) -> EmbedDoc:
+    return EmbedDoc(text=request.text, embedding=VECTOR)
+
+
+@register_microservice(
+    name="binary_retriever", host="0.0.0.0", port=8092, endpoint="/v1/retrieval", service_type=ServiceType.RETRIEVER
+)
+async def retrieve(request: EmbedDoc) -> TextDoc:
+    return TextDoc(text=f"{request.text} {request.embedding}")
+
+
+class TestEmbeddingEncoding(unittest.TestCase):
+    def test_round_trip(self):
+        for dtype in ("float32", "float16"):
+            encoded = encode_embedding(VECTOR, dtype)
+            self.assertEqual(encoded["shape"], [4])
+            self.assertEqual(decode_embedding(encoded), VECTOR)
+        batch = encode_embedding([VECTOR, VECTOR])
+        self.assertEqual(decode_embedding(batch), [VECTOR, VECTOR])
+        # OpenAI base64 strings are float32
+        self.assertEqual(decode_embedding(encode_base64(VECTOR)), VECTOR)
+        self.assertEqual(decode_embedding(VECTOR), VECTOR)
+
+    def test_negotiation(self):
+        self.assertIsNone(accepted_dtype("application/json"))
+        self.assertEqual(accepted_dtype(accept_header("float16")), "float16")
+        self.assertEqual(accepted_dtype(EMBEDDING_MEDIA_TYPE), "float32")
+
+    def test_models(self):
+        self.assertEqual(EmbedDoc(text="a", embedding=encode_embedding(VECTOR)).embedding, VECTOR)
+        self.assertEqual(RetrievalRequest(embedding=encode_embedding(VECTOR, "float16")).embedding, VECTOR)
+        # encoded only while serving a request which accepts it
+        self.assertEqual(EmbedDoc(text="a", embedding=VECTOR).model_dump(mode="json")["embedding"], VECTOR)
+
+
+class TestBinaryEmbeddingTransport(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.embedding = opea_microservices["binary_embedding"]
+        cls.retriever = opea_microservices["binary_retriever"]
+        cls.embedding.start()
+        cls.retriever.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.embedding.stop()
+        cls.retriever.stop()
+
+    async def test_content_negotiation(self):
+        async with aiohttp.ClientSession() as session:
+            url = "http://localhost:8091/v1/embeddings"
+            async with session.post(url, json={"text": "hi"}) as response:
+                self.assertEqual(response.content_type, "application/json")
+                self.assertEqual((await response.json())["embedding"], VECTOR)
+            async with session.post(url, json={"text": "hi"}, headers={"Accept": accept_header("float16")}) as response:
+                self.assertEqual(response.content_type, EMBEDDING_MEDIA_TYPE)
+                embedding = (await response.json())["embedding"]
+                self.assertEqual(embedding["dtype"], "float16")
+                self.assertEqual(decode_embedding(embedding), VECTOR)
+
+    async def test_orchestrator(self):
+        orchestrator = ServiceOrchestrator()
+        orchestrator.embedding_dtype = "float32"
+        orchestrator.add(self.embedding).add(self.retriever)
+        orchestrator.flow_to(self.embedding, self.retriever)
+        result_dict, _ = await orchestrator.schedule(initial_inputs={"text": "hi"})
+        # forwarded without being decoded
+        self.assertEqual(result_dict[self.embedding.name]["embedding"]["dtype"], "float32")
+        self.assertEqual(result_dict[self.retriever.name]["text"], f"hi {VECTOR}")
+        await orchestrator.connection_pool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
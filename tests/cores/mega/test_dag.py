@@ -4,7 +4,7 @@
 import unittest
 from collections import OrderedDict
 
-from comps.cores.mega.dag import DAG
+from comps.cores.mega.dag import DAG, RuntimeDAG
 
 
 class TestDAG(unittest.TestCase):
@@ -39,6 +39,36 @@ class TestDAG(unittest.TestCase):
         dag2.delete_node("c")
         self.assertEqual(dag2.graph, OrderedDict([("a", {"d"}), ("b", set()), ("d", set())]))
 
+    def test_add_edge_cycle(self):
+        dag = DAG()
+        dag.from_dict({"a": ["b"], "b": ["c"], "c": []})
+        self.assertRaises(Exception, dag.add_edge, "c", "a")
+        self.assertRaises(Exception, dag.add_edge, "b", "b")
+        self.assertEqual(dag.graph, OrderedDict([("a", {"b"}), ("b", {"c"}), ("c", set())]))
+
+    def test_runtime_dag(self):
+        dag = DAG()
+        dag.from_dict({"a": ["b", "c"], "b": ["d"], "c": ["d"], "d": [], "e": []})
+        plan = dag.compile()
+        self.assertIs(dag.compile(), plan)
+        self.assertEqual([plan.nodes[i] for i in plan.ind_nodes], ["a", "e"])
+        self.assertEqual(plan.in_degree, (0, 1, 1, 2, 0))
+
+        runtime_graph = RuntimeDAG(plan)
+        self.assertEqual(sorted(runtime_graph.downstream("a")), ["b", "c"])
+        self.assertEqual(sorted(runtime_graph.predecessors("d")), ["b", "c"])
+        runtime_graph.delete_edge("a", "b")
+        self.assertRaises(KeyError, runtime_graph.delete_edge, "a", "b")
+        self.assertEqual(runtime_graph.downstream("a"), ["c"])
+        runtime_graph.prune_unreachable()
+        self.assertEqual(runtime_graph.all_leaves(), ["d", "e"])
+        self.assertEqual(runtime_graph.graph, OrderedDict([("a", {"c"}), ("c", {"d"}), ("d", set()), ("e", set())]))
+        # the compiled graph is never modified by a request
+        self.assertEqual(dag.graph["a"], {"b", "c"})
+
+        dag.add_node("f")
+        self.assertIsNot(dag.compile(), plan)
+
 
 if __name__ == "__main__":
     unittest.main()
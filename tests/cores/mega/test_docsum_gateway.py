@@ -0,0 +1,109 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import time
+import unittest
+import zipfile
+from io import BytesIO
+
+import requests
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from comps import DocSumGateway, ServiceOrchestrator, ServiceType, opea_microservices, register_microservice
+from comps.cores.mega.gateway import split_text
+
+
+@register_microservice(name="llm", host="0.0.0.0", port=8087, endpoint="/v1/docsum", service_type=ServiceType.LLM)
+async def llm_summarize(request: Request):
+    data = await request.json()
+    summary = f"<{len(data['query'])}>"
+    if data["streaming"]:
+
+        async def token_generator():
+            yield f"data: {repr(summary.encode('utf-8'))}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(token_generator(), media_type="text/event-stream")
+    return {"text": summary}
+
+
+def docx(text):
+    document = (
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body><w:p><w:r><w:t>{text}</w:t></w:r></w:p></w:body></w:document>"
+    )
+    data = BytesIO()
+    with zipfile.ZipFile(data, "w") as f:
+        f.writestr("word/document.xml", document)
+    return data.getvalue()
+
+
+class TestDocSumGateway(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.llm = opea_microservices["llm"]
+        cls.llm.start()
+        cls.service_builder = ServiceOrchestrator()
+        cls.service_builder.add(cls.llm)
+        cls.gateway = DocSumGateway(cls.service_builder, port=9899)
+        cls.url = "http://localhost:9899/v1/docsum"
+        time.sleep(2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.llm.stop()
+        cls.gateway.stop()
+
+    def test_upload(self):
+        files = [
+            ("files", ("a.docx", docx("a" * 100), "application/octet-stream")),
+            ("files", ("b.docx", docx("b" * 200), "application/octet-stream")),
+        ]
+        response = requests.post(self.url, data={"messages": "", "stream": "false"}, files=files, timeout=20)
+        # both parsed documents are summarized together
+        self.assertEqual(response.json()["choices"][0]["message"]["content"], "<301>")
+
+    def test_map_reduce(self):
+        body = {
+            "type": "query",
+            "messages": "word " * 100,
+            "summary_type": "map_reduce",
+            "chunk_size": 100,
+            "stream": True,
+        }
+        with requests.post(self.url, json=body, stream=True) as response:
+            events = [line[len("data: ") :] for line in response.iter_lines(decode_unicode=True) if line]
+        progress = [json.loads(event)["progress"] for event in events if event.startswith("{")]
+        # 5 chunks of 100 characters are summarized, then their summaries together
+        self.assertEqual(progress[-1], {"level": 0, "done": 5, "total": 5})
+        self.assertEqual(events[-2:], ["b'<29>'", "[DONE]"])
+
+        body["stream"] = False
+        response = requests.post(self.url, json=body)
+        self.assertEqual(response.json()["choices"][0]["message"]["content"], "<29>")
+
+    def test_invalid_options(self):
+        body = {"type": "query", "messages": "word " * 100, "summary_type": "map_reduce", "stream": False}
+        for options in (
+            {"chunk_size": 100, "chunk_overlap": 100},
+            {"chunk_size": 100, "chunk_overlap": -1},
+            {"chunk_size": 0},
+            {"chunk_size": "many"},
+            {"summary_type": "refine"},
+        ):
+            response = requests.post(self.url, json={**body, **options})
+            self.assertEqual(response.status_code, 400, options)
+
+    def test_split_text(self):
+        text = "lorem ipsum " * 20
+        chunks = split_text(text, 50)
+        self.assertEqual("".join(chunks), text)
+        self.assertTrue(all(len(chunk) <= 50 and chunk.endswith(" ") for chunk in chunks))
+        overlapping = split_text(text, 50, 10)
+        self.assertEqual(overlapping[0][-10:], overlapping[1][:10])
+
+
+if __name__ == "__main__":
+    unittest.main()
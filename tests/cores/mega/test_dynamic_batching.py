@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import asyncio
+import time
 import unittest
 from enum import Enum
 
@@ -59,6 +60,36 @@ async def add2(request: TextDoc) -> dict:
     return result
 
 
+batch_sizes = []
+
+
+async def scheduled_batching_infer(service_type: Enum, batch: list[dict]):
+    batch_sizes.append(len(batch))
+    await asyncio.sleep(0.5)
+    if any(i["request"].text == "fail" for i in batch):
+        raise ValueError("inference failed")
+    results = [{"result": "processed: " + i["request"].text} for i in batch]
+    if any(i["request"].text == "short" for i in batch):
+        return results[:-1]
+    return results
+
+
+@register_microservice(
+    name="s2",
+    host="0.0.0.0",
+    port=8081,
+    endpoint="/v1/add",
+    dynamic_batching=True,
+    dynamic_batching_timeout=2,
+    dynamic_batching_max_batch_size=4,
+    dynamic_batching_max_queue_size=6,
+)
+async def add3(request: TextDoc) -> dict:
+    cur_microservice = opea_microservices["s2"]
+    cur_microservice.dynamic_batching_infer = scheduled_batching_infer
+    return await cur_microservice.dynamic_batching_submit(ServiceType.EMBEDDING, request)
+
+
 async def fetch(session, url, data):
     async with session.post(url, json=data) as response:
         # Await the response and return the JSON data
@@ -87,5 +118,42 @@ class TestMicroService(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(response2["result"], "processed: OPEA Project!")
 
 
+class TestBatchScheduler(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        opea_microservices["s2"].start()
+
+    @classmethod
+    def tearDownClass(cls):
+        opea_microservices["s2"].stop()
+
+    async def test_full_batch_and_backpressure(self):
+        url = "http://localhost:8081/v1/add"
+        # the server drops the connection of a request that failed with an exception, do not reuse it
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(force_close=True)) as session:
+            # a full batch is dispatched without waiting for the 2s timeout
+            start = time.monotonic()
+            responses = await asyncio.gather(*[fetch(session, url, {"text": str(i)}) for i in range(4)])
+            self.assertLess(time.monotonic() - start, 1.5)
+            self.assertEqual([r["result"] for r in responses], [f"processed: {i}" for i in range(4)])
+
+            # requests over the queue bound are rejected while a batch runs
+            async def status(data):
+                async with session.post(url, json=data) as response:
+                    return response.status, response.headers.get("Retry-After")
+
+            statuses = await asyncio.gather(*[status({"text": str(i)}) for i in range(14)])
+            self.assertIn((503, "1"), statuses)
+            self.assertEqual({s for s, _ in statuses}, {200, 503})
+
+            # failures are propagated instead of leaving the requests hanging
+            statuses = await asyncio.gather(*[status({"text": t}) for t in ["ok", "ok", "ok", "fail"]])
+            self.assertEqual({s for s, _ in statuses}, {500})
+
+            # a request left without result fails, the others get theirs
+            statuses = await asyncio.gather(*[status({"text": t}) for t in ["ok", "ok", "ok", "short"]])
+            self.assertEqual(sorted(s for s, _ in statuses), [200, 200, 200, 500])
+
+
 if __name__ == "__main__":
     unittest.main()
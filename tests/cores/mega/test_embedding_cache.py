@@ -0,0 +1,101 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import os
+import tempfile
+import unittest
+
+from prometheus_client import REGISTRY
+
+from comps import CachedEmbeddings, SQLiteEmbeddingCache
+from comps.cores.mega.embedding_cache import aembed_cached, cache_key
+
+
+class FakeEmbeddings:
+    """Embeds a text as [len(text), 1.0], a query as [len(text), 2.0]."""
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        self.embedded.append(text)
+        return [float(len(text)), 2.0]
+
+    async def aembed_documents(self, texts):
+        return self.embed_documents(texts)
+
+
+def metric(name, cache):
+    return REGISTRY.get_sample_value(name, {"cache": cache}) or 0
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "embeddings.db")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_keys(self):
+        self.assertEqual(cache_key("bge", "a  chunk\nof text "), cache_key("bge", "a chunk of text"))
+        self.assertNotEqual(cache_key("bge", "a chunk"), cache_key("bge", "A chunk"))
+        self.assertNotEqual(cache_key("bge", "a chunk"), cache_key("e5", "a chunk"))
+
+    def test_cached_embeddings(self):
+        fake = FakeEmbeddings()
+        embeddings = CachedEmbeddings(fake, SQLiteEmbeddingCache(self.path, name="test_cached"), "bge", "bge:query")
+        self.assertEqual(embeddings.embed_documents(["ab", "abc", "ab"]), [[2.0, 1.0], [3.0, 1.0], [2.0, 1.0]])
+        # the repeated text is embedded once, the cached texts are not embedded again
+        self.assertEqual(embeddings.embed_documents(["abc", "abcd"]), [[3.0, 1.0], [4.0, 1.0]])
+        self.assertEqual(fake.embedded, ["ab", "abc", "abcd"])
+        # queries are cached apart from the documents
+        self.assertEqual(embeddings.embed_query("ab"), [2.0, 2.0])
+        self.assertEqual(embeddings.embed_query("ab"), [2.0, 2.0])
+        self.assertEqual(fake.embedded, ["ab", "abc", "abcd", "ab"])
+        self.assertEqual(metric("megaservice_cache_hits_total", "test_cached"), 2)
+        self.assertEqual(metric("megaservice_cache_misses_total", "test_cached"), 5)
+
+        # persisted in the file
+        fake = FakeEmbeddings()
+        embeddings = CachedEmbeddings(fake, SQLiteEmbeddingCache(self.path, name="test_reopened"), "bge")
+        self.assertEqual(asyncio.run(embeddings.aembed_documents(["ab", "abcd"])), [[2.0, 1.0], [4.0, 1.0]])
+        self.assertEqual(fake.embedded, [])
+
+    def test_eviction(self):
+        # a vector of 2 float32 is 8 bytes
+        cache = SQLiteEmbeddingCache(self.path, max_bytes=40, name="test_eviction")
+        cache.set_many([f"k{i}" for i in range(4)], [[float(i), 0.0] for i in range(4)])
+        self.assertEqual(cache.nbytes, 32)
+        cache._conn.execute("UPDATE embeddings SET accessed = 0 WHERE key = 'k0'")
+        cache._conn.commit()
+        cache.get_many(["k0"])
+        cache.set_many(["k4", "k5"], [[4.0, 0.0], [5.0, 0.0]])
+        # down to 90% of max_bytes, the least recently used first
+        self.assertEqual(cache.nbytes, 32)
+        self.assertEqual(metric("megaservice_cache_evictions_total", "test_eviction"), 2)
+        self.assertEqual(metric("megaservice_cache_size_bytes", "test_eviction"), 32)
+        self.assertEqual(cache.get_many(["k0", "k1", "k2", "k5"]), [[0.0, 0.0], None, None, [5.0, 0.0]])
+
+    def test_unavailable_cache(self):
+        class BrokenCache(SQLiteEmbeddingCache):
+            def _get(self, keys):
+                raise ConnectionError("cache is down")
+
+        fake = FakeEmbeddings()
+
+        async def embed(texts):
+            return fake.embed_documents(texts)
+
+        cache = BrokenCache(self.path, name="test_broken")
+        self.assertEqual(asyncio.run(aembed_cached(cache, "bge", ["ab"], embed)), [[2.0, 1.0]])
+        self.assertEqual(fake.embedded, ["ab"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import unittest
+from typing import Union
+
+import aiohttp
+
+from comps import EmbedDoc, ServiceOrchestrator, ServiceType, TextDoc, opea_microservices, register_microservice
+from comps.cores.mega.serialization import json_dumps, json_loads
+from comps.cores.proto.embedding_encoding import EMBEDDING_MEDIA_TYPE, accept_header, decode_embedding
+
+VECTOR = [0.5, -0.25, 0.125, 1.0]
+
+
+@register_microservice(
+    name="fast_embedding",
+    host="0.0.0.0",
+    port=8093,
+    endpoint="/v1/embeddings",
+    service_type=ServiceType.EMBEDDING,
+    fast_serialization=True,
+)
+async def embed(request: Union[TextDoc, EmbedDoc]) -> EmbedDoc:
+    return EmbedDoc(text=request.text, embedding=VECTOR)
+
+
+@register_microservice(name="fast_embedding", port=8093, endpoint="/v1/echo")
+async def echo(request: TextDoc) -> dict:
+    return {"text": request.text, "id": request.id}
+
+
+class TestJson(unittest.TestCase):
+    def test_round_trip(self):
+        data = {"text": "é", "values": [1.5, None], 1: True}
+        self.assertEqual(json_loads(json_dumps(data)), {"text": "é", "values": [1.5, None], "1": True})
+        # beyond 64 bits, left to the json module
+        self.assertEqual(json_loads(json_dumps({"n": 2**70})), {"n": 2**70})
+
+
+class TestFastSerialization(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.service = opea_microservices["fast_embedding"]
+        cls.service.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service.stop()
+
+    async def test_endpoint(self):
+        async with aiohttp.ClientSession() as session:
+            async with session.post("http://localhost:8093/v1/embeddings", json={"text": "hi"}) as response:
+                self.assertEqual(response.status, 200)
+                self.assertEqual((await response.json())["embedding"], VECTOR)
+            async with session.post("http://localhost:8093/v1/echo", json={"text": "hi", "id": "1"}) as response:
+                self.assertEqual(await response.json(), {"text": "hi", "id": "1"})
+            # binary embeddings are still negotiated
+            headers = {"Accept": accept_header("float16")}
+            async with session.post(
+                "http://localhost:8093/v1/embeddings", json={"text": "hi"}, headers=headers
+            ) as response:
+                self.assertEqual(response.content_type, EMBEDDING_MEDIA_TYPE)
+                self.assertEqual(decode_embedding((await response.json())["embedding"]), VECTOR)
+
+    async def test_validation_error(self):
+        async with aiohttp.ClientSession() as session:
+            async with session.post("http://localhost:8093/v1/echo", json={"text": 1}) as response:
+                self.assertEqual(response.status, 422)
+                self.assertEqual((await response.json())["detail"][0]["loc"][:2], ["body", "text"])
+            async with session.post("http://localhost:8093/v1/echo", data=b"{") as response:
+                self.assertEqual(response.status, 422)
+
+    async def test_forward_model(self):
+        orchestrator = ServiceOrchestrator()
+        orchestrator.add(self.service)
+        # a validated model is sent as is
+        result_dict, _ = await orchestrator.schedule(initial_inputs=EmbedDoc(text="hi", embedding=[0.0]))
+        self.assertEqual(result_dict[self.service.name]["embedding"], VECTOR)
+        await orchestrator.connection_pool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import base64
+import tempfile
+import time
+import unittest
+from io import BytesIO
+
+from aiohttp import web
+from PIL import Image
+
+from comps import InMemoryCache
+from comps.cores.mega.gateway import ImageLoader
+
+
+def image_bytes(color, format):
+    data = BytesIO()
+    Image.new("RGB", (8, 8), color).save(data, format=format)
+    return data.getvalue()
+
+
+PNG = image_bytes("red", "PNG")
+JPEG = image_bytes("blue", "JPEG")
+
+
+class TestImageLoader(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.hits = []
+
+        async def serve(request):
+            self.hits.append(request.match_info["name"])
+            await asyncio.sleep(0.3)
+            return web.Response(body=PNG if request.match_info["name"].endswith(".png") else JPEG)
+
+        app = web.Application()
+        app.router.add_get("/{name}", serve)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "localhost", 8086).start()
+        self.loader = ImageLoader()
+
+    async def asyncTearDown(self):
+        await self.loader.close()
+        await self.runner.cleanup()
+
+    async def test_fetch(self):
+        urls = [f"http://localhost:8086/{name}" for name in ["a.png", "b.jpg", "c.png"]]
+        start = time.time()
+        images = await self.loader.load_all(urls)
+        # fetched concurrently
+        self.assertLess(time.time() - start, 0.6)
+        # PNG images are passed through, the others are converted to PNG
+        self.assertEqual(images[0], base64.b64encode(PNG).decode())
+        self.assertEqual(Image.open(BytesIO(base64.b64decode(images[1]))).format, "PNG")
+        self.assertEqual(images[2], images[0])
+
+        self.assertEqual(await self.loader.load_all(urls), images)
+        self.assertEqual(sorted(self.hits), ["a.png", "b.jpg", "c.png"])
+
+    async def test_path_and_base64(self):
+        with tempfile.NamedTemporaryFile(suffix=".jpg") as f:
+            f.write(JPEG)
+            f.flush()
+            image = await self.loader.load(f.name)
+        self.assertEqual(Image.open(BytesIO(base64.b64decode(image))).format, "PNG")
+        self.assertEqual(await self.loader.load("aGVsbG8="), "aGVsbG8=")
+
+    async def test_cache_bytes(self):
+        cache = InMemoryCache(name="test_bytes", max_bytes=10, ttl=None)
+        await cache.set("a", "a" * 6)
+        await cache.set("b", "b" * 6)
+        self.assertIsNone(await cache.get("a"))
+        self.assertEqual(cache.nbytes, 6)
+        await cache.set("b", "b" * 4)
+        await cache.set("c", "c" * 6)
+        self.assertEqual(await cache.get("b"), "b" * 4)
+        await cache.clear()
+        self.assertEqual(cache.nbytes, 0)
+
+
+class TestImageLoaderSession(unittest.TestCase):
+    def test_session_per_loop(self):
+        loader = ImageLoader()
+
+        async def session():
+            return loader.session()
+
+        async def next_session():
+            session = loader.session()
+            # let the session of the previous loop be closed
+            await asyncio.sleep(0.1)
+            return session
+
+        first = asyncio.run(session())
+        second = asyncio.run(next_session())
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertFalse(second.closed)
+        asyncio.run(loader.close())
+        self.assertTrue(second.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
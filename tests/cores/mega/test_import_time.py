@@ -0,0 +1,53 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import re
+import subprocess
+import sys
+import unittest
+
+# total import time budgets in ms, measured like benchmarks/mega/bench_import_time.py with ample headroom
+BUDGETS = {
+    "import comps": 50,
+    "from comps import CustomLogger": 50,
+    "from comps import ServiceOrchestrator": 1500,
+}
+HEAVY_MODULES = ("fastapi", "docarray", "aiohttp", "numpy", "opentelemetry")
+
+
+def import_times(statement: str) -> dict:
+    """Self import time in us of each module imported by `statement` in a fresh interpreter."""
+    code = f"import sys; sys.stderr.write('--\\n'); {statement}"
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True
+    ).stderr
+    stderr = stderr[stderr.index("--\n") + 3 :]
+    return {m.group(2): int(m.group(1)) for m in re.finditer(r"import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)", stderr)}
+
+
+class TestImportTime(unittest.TestCase):
+    def test_budgets(self):
+        for statement, budget in BUDGETS.items():
+            # best of 3 runs, the first one may read cold files
+            total = min(sum(import_times(statement).values()) for _ in range(3)) / 1000
+            self.assertLess(total, budget, statement)
+
+    def test_lazy_imports(self):
+        for statement in ("import comps", "from comps import CustomLogger"):
+            heavy = [m for m in import_times(statement) if m.split(".")[0] in HEAVY_MODULES]
+            self.assertEqual(heavy, [], statement)
+        # the telemetry exporters are set up on the first traced call
+        modules = import_times("from comps import ServiceOrchestrator")
+        self.assertNotIn("opentelemetry.exporter.otlp.proto.http.trace_exporter", modules)
+        self.assertNotIn("requests", modules)
+
+    def test_exports(self):
+        import comps
+
+        self.assertIn("TextDoc", dir(comps))
+        with self.assertRaises(AttributeError):
+            comps.NotAnExport
+
+
+if __name__ == "__main__":
+    unittest.main()
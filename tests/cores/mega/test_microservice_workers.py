@@ -0,0 +1,70 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from comps import TextDoc, opea_microservices, register_microservice, register_statistics, statistics_dict
+from comps.cores.mega.utils import get_numa_cpus, parse_cpu_list
+
+
+@register_microservice(name="s1", host="0.0.0.0", port=8083, endpoint="/v1/add", workers=2, cpu_affinity="numa")
+@register_statistics(names=["opea_service@s1_add"])
+async def s1_add(request: TextDoc) -> TextDoc:
+    # block the event loop so that concurrent requests are accepted by the other worker
+    time.sleep(0.2)
+    statistics_dict["opea_service@s1_add"].append_latency(float(request.text), None)
+    return {"text": str(os.getpid())}
+
+
+# no proper subset of these latencies has the same mean as the whole set
+LATENCIES = [1, 2, 4, 8, 16, 32, 64, 128]
+
+
+def post(latency):
+    return requests.post("http://localhost:8083/v1/add", json={"text": str(latency)}).json()["text"]
+
+
+class TestMicroServiceWorkers(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.s1 = opea_microservices["s1"]
+        cls.s1.start()
+        time.sleep(1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.s1.stop()
+
+    def send(self):
+        with ThreadPoolExecutor(len(LATENCIES)) as executor:
+            return set(executor.map(post, LATENCIES))
+
+    def average_latency(self):
+        # workers share their statistics every second
+        time.sleep(1.5)
+        return requests.get("http://localhost:8083/v1/statistics").json()["opea_service@s1_add"]["average_latency"]
+
+    def test_workers(self):
+        pids = self.send()
+        self.assertEqual(pids, {str(p.pid) for p in self.s1.processes})
+        self.assertEqual(self.average_latency(), sum(LATENCIES) / len(LATENCIES))
+
+        self.s1.restart()
+        new_pids = self.send()
+        self.assertEqual(new_pids, {str(p.pid) for p in self.s1.processes})
+        self.assertFalse(pids & new_pids)
+        # the statistics of the replaced workers are kept
+        self.assertEqual(self.average_latency(), sum(LATENCIES) / len(LATENCIES))
+
+    def test_cpu_list(self):
+        self.assertEqual(parse_cpu_list("0-3,8,10-11\n"), [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(sorted(sum(get_numa_cpus(), [])), sorted(os.sched_getaffinity(0)))
+
+
+if __name__ == "__main__":
+    unittest.main()
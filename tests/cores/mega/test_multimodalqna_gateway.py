@@ -144,7 +144,7 @@ class TestServiceOrchestrator(unittest.IsolatedAsyncioTestCase):
             "<image>\nUSER: hello, \nASSISTANT: opea project! \nUSER: chao, \n\nASSISTANT:",
         )
 
-    def test_handle_message(self):
+    async def test_handle_message(self):
         messages = [
             {
                 "role": "user",
@@ -159,10 +159,10 @@ class TestServiceOrchestrator(unittest.IsolatedAsyncioTestCase):
             {"role": "assistant", "content": "opea project! "},
             {"role": "user", "content": "chao, "},
         ]
-        prompt, images = self.gateway._handle_message(messages)
+        prompt, images = await self.gateway._handle_message(messages)
         self.assertEqual(prompt, "hello, \nASSISTANT: opea project! \nUSER: chao, \n")
 
-    def test_handle_message_with_system_prompt(self):
+    async def test_handle_message_with_system_prompt(self):
         messages = [
             {"role": "system", "content": "System Prompt"},
             {
@@ -178,7 +178,7 @@ class TestServiceOrchestrator(unittest.IsolatedAsyncioTestCase):
             {"role": "assistant", "content": "opea project! "},
             {"role": "user", "content": "chao, "},
         ]
-        prompt, images = self.gateway._handle_message(messages)
+        prompt, images = await self.gateway._handle_message(messages)
         self.assertEqual(prompt, "System Prompt\nhello, \nASSISTANT: opea project! \nUSER: chao, \n")
 
     async def test_handle_request(self):
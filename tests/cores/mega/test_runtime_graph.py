@@ -1,6 +1,7 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
 import unittest
 
 from fastapi.testclient import TestClient
@@ -46,30 +47,42 @@ async def add_s4(request: TextDoc) -> TextDoc:
     return TextDoc(text=text)
 
 
+@register_microservice(name="s5", host="0.0.0.0", port=8084, endpoint="/v1/add")
+async def add_s5(request: TextDoc) -> TextDoc:
+    # finish after s2 and skip every downstream node
+    await asyncio.sleep(0.5)
+    return TextDoc(text=request.text, downstream_black_list=[".*"])
+
+
 class TestMicroService(unittest.IsolatedAsyncioTestCase):
-    def setUp(self):
-        self.client1 = TestClient(opea_microservices["s1"].app)
-        self.s1 = opea_microservices["s1"]
-        self.s2 = opea_microservices["s2"]
-        self.s3 = opea_microservices["s3"]
-        self.s4 = opea_microservices["s4"]
-
-        self.s1.start()
-        self.s2.start()
-        self.s3.start()
-        self.s4.start()
-
-        self.service_builder = ServiceOrchestrator()
-        self.service_builder.add(self.s1).add(self.s2).add(self.s3).add(self.s4)
-        self.service_builder.flow_to(self.s1, self.s2)
-        self.service_builder.flow_to(self.s1, self.s3)
-        self.service_builder.flow_to(self.s3, self.s4)
-
-    def tearDown(self):
-        self.s1.stop()
-        self.s2.stop()
-        self.s3.stop()
-        self.s4.stop()
+    @classmethod
+    def setUpClass(cls):
+        cls.client1 = TestClient(opea_microservices["s1"].app)
+        cls.s1 = opea_microservices["s1"]
+        cls.s2 = opea_microservices["s2"]
+        cls.s3 = opea_microservices["s3"]
+        cls.s4 = opea_microservices["s4"]
+        cls.s5 = opea_microservices["s5"]
+
+        cls.s1.start()
+        cls.s2.start()
+        cls.s3.start()
+        cls.s4.start()
+        cls.s5.start()
+
+        cls.service_builder = ServiceOrchestrator()
+        cls.service_builder.add(cls.s1).add(cls.s2).add(cls.s3).add(cls.s4)
+        cls.service_builder.flow_to(cls.s1, cls.s2)
+        cls.service_builder.flow_to(cls.s1, cls.s3)
+        cls.service_builder.flow_to(cls.s3, cls.s4)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.s1.stop()
+        cls.s2.stop()
+        cls.s3.stop()
+        cls.s4.stop()
+        cls.s5.stop()
 
     async def test_add_route(self):
         result_dict, runtime_graph = await self.service_builder.schedule(initial_inputs={"text": "Hi!"})
@@ -86,6 +99,16 @@ class TestMicroService(unittest.IsolatedAsyncioTestCase):
         assert len(result_dict) == 2
         assert len(runtime_graph.all_leaves()) == 1
 
+    async def test_pruned_predecessor(self):
+        # s4 runs once s2 finished and s5 pruned its edge, with the output of s2 only
+        service_builder = ServiceOrchestrator()
+        service_builder.add(self.s2).add(self.s5).add(self.s4)
+        service_builder.flow_to(self.s2, self.s4)
+        service_builder.flow_to(self.s5, self.s4)
+        result_dict, runtime_graph = await service_builder.schedule(initial_inputs={"text": "Hi!"})
+        self.assertEqual(result_dict[self.s4.name]["text"], "Hi!add s2!add s4!")
+        self.assertEqual(runtime_graph.predecessors(self.s4.name), [self.s2.name])
+
 
 if __name__ == "__main__":
     unittest.main()
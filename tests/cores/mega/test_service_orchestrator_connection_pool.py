@@ -0,0 +1,71 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import unittest
+
+from prometheus_client import REGISTRY
+
+from comps import ServiceOrchestrator, TextDoc, opea_microservices, register_microservice
+
+
+@register_microservice(name="s1", host="0.0.0.0", port=8083, endpoint="/v1/add")
+async def s1_add(request: TextDoc) -> TextDoc:
+    req = request.model_dump_json()
+    req_dict = json.loads(req)
+    text = req_dict["text"]
+    text += "opea "
+    return {"text": text}
+
+
+@register_microservice(name="s2", host="0.0.0.0", port=8084, endpoint="/v1/add")
+async def s2_add(request: TextDoc) -> TextDoc:
+    req = request.model_dump_json()
+    req_dict = json.loads(req)
+    text = req_dict["text"]
+    text += "project!"
+    return {"text": text}
+
+
+class TestServiceOrchestratorConnectionPool(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.s1 = opea_microservices["s1"]
+        cls.s2 = opea_microservices["s2"]
+        cls.s1.start()
+        cls.s2.start()
+
+        cls.service_builder = ServiceOrchestrator()
+
+        cls.service_builder.add(opea_microservices["s1"], connection_limit=4).add(opea_microservices["s2"])
+        cls.service_builder.flow_to(cls.s1, cls.s2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.s1.stop()
+        cls.s2.stop()
+
+    async def test_connection_reuse(self):
+        await self.service_builder.connection_pool.open()
+        for _ in range(3):
+            result_dict, _ = await self.service_builder.schedule(initial_inputs={"text": "hello, "})
+            self.assertEqual(result_dict[self.s2.name]["text"], "hello, opea project!")
+
+        pool = self.service_builder.connection_pool
+        self.assertEqual(pool.session(self.s1.name).connector.limit, 4)
+        # sequential requests share one keep-alive connection per microservice
+        self.assertEqual(pool.stats()[self.s1.name], {"created": 1, "reused": 2})
+        self.assertEqual(pool.stats()[self.s2.name], {"created": 1, "reused": 2})
+        self.assertEqual(
+            REGISTRY.get_sample_value("megaservice_connections_reused_total", {"service": self.s1.name}), 2
+        )
+        self.assertEqual(
+            REGISTRY.get_sample_value("megaservice_connection_wait_latency_count", {"service": self.s1.name}), 3
+        )
+
+        await pool.close()
+        self.assertEqual(pool.stats(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+import time
+import unittest
+
+import requests
+from prometheus_client import REGISTRY
+
+from comps import (
+    InMemoryCache,
+    MicroService,
+    ServiceOrchestrator,
+    ServiceType,
+    TextDoc,
+    opea_microservices,
+    register_microservice,
+)
+from comps.cores.mega.gateway import Gateway
+from comps.cores.proto.docarray import LLMParams
+
+
+@register_microservice(
+    name="s1",
+    host="0.0.0.0",
+    port=8083,
+    endpoint="/v1/add",
+    service_type=ServiceType.EMBEDDING,
+    cache=InMemoryCache(name="test_s1"),
+)
+async def s1_add(request: TextDoc) -> TextDoc:
+    return {"text": request.text + f" {time.time_ns()}"}
+
+
+@register_microservice(name="s2", host="0.0.0.0", port=8084, endpoint="/v1/add", service_type=ServiceType.RETRIEVER)
+async def s2_add(request: TextDoc) -> TextDoc:
+    return {"text": request.text + f" {time.time_ns()}"}
+
+
+class TestServiceOrchestratorNodeCache(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.s1 = opea_microservices["s1"]
+        cls.s2 = opea_microservices["s2"]
+        cls.s1.start()
+        cls.s2.start()
+
+        # the remote definition does not carry the cache, it is declared when adding the node
+        cls.s1_remote = MicroService(
+            name="s1",
+            host="0.0.0.0",
+            port=8083,
+            endpoint="/v1/add",
+            use_remote_service=True,
+            service_type=ServiceType.EMBEDDING,
+        )
+        cls.service_builder = ServiceOrchestrator()
+        cls.service_builder.add(cls.s1).add(cls.s2, cache=InMemoryCache(name="test_s2"))
+        cls.service_builder.flow_to(cls.s1, cls.s2)
+
+        cls.remote_builder = ServiceOrchestrator()
+        cls.remote_builder.add(cls.s1_remote, cache=InMemoryCache(name="test_s1_remote"))
+        # the gateway process reads the token of its environment
+        os.environ["MEGASERVICE_CACHE_INVALIDATE_TOKEN"] = "secret"
+        cls.gateway = Gateway(cls.remote_builder, port=9898)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.s1.stop()
+        cls.s2.stop()
+        cls.gateway.stop()
+
+    async def schedule(self, text):
+        result_dict, _ = await self.service_builder.schedule(
+            initial_inputs={"text": text}, llm_parameters=LLMParams(streaming=False)
+        )
+        return result_dict[self.s1.name]["text"], result_dict[self.s2.name]["text"]
+
+    async def test_node_cache(self):
+        first = await self.schedule("hello")
+        # both nodes hit since the embedding output and thus the retriever input are the same
+        self.assertEqual(await self.schedule("hello"), first)
+        self.assertNotEqual(await self.schedule("bye"), first)
+        self.assertEqual(REGISTRY.get_sample_value("megaservice_cache_hits_total", {"cache": "test_s1"}), 1)
+        self.assertEqual(REGISTRY.get_sample_value("megaservice_cache_misses_total", {"cache": "test_s2"}), 2)
+
+        # new documents only invalidate the retriever
+        cleared = await self.service_builder.invalidate_cache(service_types=[ServiceType.RETRIEVER])
+        self.assertEqual(cleared, [self.s2.name])
+        embedding, retrieval = await self.schedule("hello")
+        self.assertEqual(embedding, first[0])
+        self.assertNotEqual(retrieval, first[1])
+
+    def test_default_cache_name(self):
+        service_builder = ServiceOrchestrator()
+        service_builder.add(self.s1_remote, cache=InMemoryCache())
+        self.assertEqual(service_builder.node_caches[self.s1_remote.name].name, self.s1_remote.name)
+
+    def test_invalidate_endpoint(self):
+        time.sleep(2)
+        url = "http://0.0.0.0:9898/v1/invalidate_cache"
+        headers = {"Authorization": "Bearer secret"}
+        response = requests.post(url, data=json.dumps({"service_types": ["embedding"]}), headers=headers)
+        self.assertEqual(response.json(), {"cleared": [self.s1_remote.name]})
+        response = requests.post(url, data=json.dumps({"nodes": ["unknown"]}), headers=headers)
+        self.assertEqual(response.json(), {"cleared": []})
+        for body in ['{"service_types": ["unknown"]}', '{"service_types": [1]}', '{"nodes": "s1"}', "[]", "{"]:
+            response = requests.post(url, data=body, headers=headers)
+            self.assertEqual(response.status_code, 400, body)
+        response = requests.post(url, data=json.dumps({}), headers={"Authorization": "Bearer wrong"})
+        self.assertEqual(response.status_code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
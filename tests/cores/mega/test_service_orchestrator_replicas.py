@@ -0,0 +1,105 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import time
+import unittest
+
+from aiohttp import web
+
+from comps import MicroService, ReplicaSet, ServiceOrchestrator, ServiceType
+from comps.cores.mega.load_balancer import LatencyEWMAPolicy, LeastOutstandingPolicy, Replica
+
+PORTS = [8089, 8090]
+
+
+class TestBalancingPolicies(unittest.TestCase):
+    def test_least_outstanding(self):
+        replicas = [Replica("a"), Replica("b")]
+        replicas[0].outstanding = 2
+        self.assertIs(LeastOutstandingPolicy().choose(replicas), replicas[1])
+
+    def test_latency_ewma(self):
+        replicas = [Replica("a"), Replica("b")]
+        replicas[0].latency, replicas[1].latency = 0.1, 0.3
+        self.assertIs(LatencyEWMAPolicy().choose(replicas), replicas[0])
+        # 0.1 * 4 > 0.3 * 1
+        replicas[0].outstanding = 3
+        self.assertIs(LatencyEWMAPolicy().choose(replicas), replicas[1])
+
+
+class TestServiceOrchestratorReplicas(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.hits = {port: 0 for port in PORTS}
+        self.delay = {port: 0.01 for port in PORTS}
+        self.status = {port: 200 for port in PORTS}
+        self.runners = []
+        for port in PORTS:
+
+            async def embed(request, port=port):
+                self.hits[port] += 1
+                await asyncio.sleep(self.delay[port])
+                data = await request.json()
+                return web.json_response({"text": data["text"], "replica": port}, status=self.status[port])
+
+            app = web.Application()
+            app.router.add_post("/v1/embed", embed)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, "localhost", port).start()
+            self.runners.append(runner)
+        self.service = MicroService(
+            "embed",
+            host="localhost",
+            port=PORTS[0],
+            endpoint="/v1/embed",
+            use_remote_service=True,
+            service_type=ServiceType.EMBEDDING,
+        )
+
+    async def asyncTearDown(self):
+        await self.orchestrator.connection_pool.close()
+        for runner in self.runners:
+            await runner.cleanup()
+
+    def build(self, replicas: ReplicaSet):
+        self.orchestrator = ServiceOrchestrator()
+        self.orchestrator.add(self.service, replicas=replicas)
+
+    async def request(self):
+        result_dict, runtime_graph = await self.orchestrator.schedule(initial_inputs={"text": "hello"})
+        return result_dict[self.service.name], runtime_graph.status[self.service.name]
+
+    async def test_round_robin(self):
+        self.build(ReplicaSet([f"http://localhost:{port}/v1/embed" for port in PORTS]))
+        replies = [(await self.request())[0]["replica"] for _ in range(4)]
+        self.assertEqual(replies, PORTS * 2)
+
+    async def test_ejection(self):
+        self.build(ReplicaSet([f"http://localhost:{port}/v1/embed" for port in PORTS], max_failures=2))
+        self.status[PORTS[1]] = 500
+        statuses = [(await self.request())[1] for _ in range(8)]
+        # the failing replica is ejected after 2 failures
+        self.assertEqual(statuses.count(500), 2)
+        self.assertEqual(self.hits[PORTS[1]], 2)
+        self.assertEqual(self.orchestrator.replica_sets[self.service.name].replicas[1].outstanding, 0)
+
+    async def test_hedging(self):
+        self.build(ReplicaSet([f"http://localhost:{port}/v1/embed" for port in PORTS], hedge=True, hedge_min_samples=4))
+        for _ in range(4):
+            await self.request()
+        self.delay[PORTS[0]] = 1
+        start = time.time()
+        # sent to the slow replica first, hedged to the other one after the p95 latency
+        reply, status = await self.request()
+        self.assertEqual((reply["replica"], status), (PORTS[1], 200))
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(self.hits[PORTS[0]], 3)
+        await asyncio.sleep(0)
+        self.assertEqual(
+            [replica.outstanding for replica in self.orchestrator.replica_sets[self.service.name].replicas], [0, 0]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import time
+import unittest
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from prometheus_client import REGISTRY
+
+from comps import InMemoryCache, ServiceOrchestrator, ServiceType, TextDoc, opea_microservices, register_microservice
+from comps.cores.proto.docarray import LLMParams
+
+
+@register_microservice(name="s1", host="0.0.0.0", port=8083, endpoint="/v1/add")
+async def s1_add(request: TextDoc) -> TextDoc:
+    if request.text == "fail":
+        raise HTTPException(status_code=503, detail="overloaded")
+    return {"text": request.text + f" {time.time_ns()}"}
+
+
+@register_microservice(name="s2", host="0.0.0.0", port=8084, endpoint="/v1/add", service_type=ServiceType.LLM)
+async def s2_add(request: TextDoc) -> TextDoc:
+    stamp = time.time_ns()
+
+    async def token_generator():
+        for token in [" OPEA", " 你好", f" {stamp}"]:
+            yield f"data: {repr(token.encode('utf-8'))}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(token_generator(), media_type="text/event-stream")
+
+
+async def read_stream(response):
+    return [chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk async for chunk in response.body_iterator]
+
+
+class TestServiceOrchestratorResponseCache(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.s1 = opea_microservices["s1"]
+        cls.s2 = opea_microservices["s2"]
+        cls.s1.start()
+        cls.s2.start()
+
+        cls.s1_builder = ServiceOrchestrator(response_cache=InMemoryCache(name="test_s1", max_size=2))
+        cls.s1_builder.add(cls.s1)
+        cls.s2_builder = ServiceOrchestrator(response_cache=InMemoryCache(name="test_s2"))
+        cls.s2_builder.add(cls.s2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.s1.stop()
+        cls.s2.stop()
+
+    async def test_cache(self):
+        params = LLMParams(streaming=False)
+        result_dict, _ = await self.s1_builder.schedule(initial_inputs={"text": "hello  opea"}, llm_parameters=params)
+        first = result_dict[self.s1.name]["text"]
+        # whitespace-normalized prompt hits the cache
+        result_dict, runtime_graph = await self.s1_builder.schedule(
+            initial_inputs={"text": " hello opea "}, llm_parameters=params
+        )
+        self.assertEqual(result_dict[self.s1.name]["text"], first)
+        self.assertEqual(runtime_graph.all_leaves(), [self.s1.name])
+        # different parameters miss
+        result_dict, _ = await self.s1_builder.schedule(
+            initial_inputs={"text": "hello opea"}, llm_parameters=LLMParams(streaming=False, top_k=1)
+        )
+        self.assertNotEqual(result_dict[self.s1.name]["text"], first)
+        self.assertEqual(REGISTRY.get_sample_value("megaservice_cache_hits_total", {"cache": "test_s1"}), 1)
+        self.assertEqual(REGISTRY.get_sample_value("megaservice_cache_misses_total", {"cache": "test_s1"}), 2)
+
+    async def test_error_not_cached(self):
+        cache = InMemoryCache(name="test_error")
+        builder = ServiceOrchestrator(response_cache=cache)
+        builder.add(self.s1)
+        for _ in range(2):
+            result_dict, runtime_graph = await builder.schedule(
+                initial_inputs={"text": "fail"}, llm_parameters=LLMParams(streaming=False)
+            )
+            self.assertEqual(result_dict[self.s1.name], {"detail": "overloaded"})
+            self.assertEqual(runtime_graph.status, {self.s1.name: 503})
+        self.assertIsNone(REGISTRY.get_sample_value("megaservice_cache_hits_total", {"cache": "test_error"}))
+        self.assertEqual(REGISTRY.get_sample_value("megaservice_cache_misses_total", {"cache": "test_error"}), 2)
+
+    async def test_stream_replay(self):
+        result_dict, _ = await self.s2_builder.schedule(initial_inputs={"text": "hi"})
+        chunks = await read_stream(result_dict[self.s2.name])
+        self.assertEqual(chunks[-1], "data: [DONE]\n\n")
+
+        result_dict, _ = await self.s2_builder.schedule(initial_inputs={"text": "hi"})
+        response = result_dict[self.s2.name]
+        self.assertIsInstance(response, StreamingResponse)
+        self.assertEqual(await read_stream(response), chunks)
+
+        # non-streaming clients get the text of the cached stream
+        result_dict, _ = await self.s2_builder.schedule(
+            initial_inputs={"text": "hi"}, llm_parameters=LLMParams(streaming=False)
+        )
+        self.assertTrue(result_dict[self.s2.name]["text"].startswith(" OPEA 你好 "))
+
+    async def test_in_memory_cache(self):
+        cache = InMemoryCache(name="test_lru", max_size=2, ttl=0.2)
+        await cache.set("a", 1)
+        await cache.set("b", 2)
+        self.assertEqual(await cache.get("a"), 1)
+        await cache.set("c", 3)  # evicts the least recently used "b"
+        self.assertIsNone(await cache.get("b"))
+        self.assertEqual(await cache.get("c"), 3)
+        await asyncio.sleep(0.3)
+        self.assertIsNone(await cache.get("a"))
+        self.assertEqual(REGISTRY.get_sample_value("megaservice_cache_evictions_total", {"cache": "test_lru"}), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -60,6 +60,22 @@ class TestServiceOrchestratorStreaming(unittest.IsolatedAsyncioTestCase):
             self.assertEqual(self.service_builder.extract_chunk_str(k).strip(), res_expected[idx])
             idx += 1
 
+    async def test_sync_align_generator(self):
+        class LegacyOrchestrator(ServiceOrchestrator):
+            # overrides written before the stream became async iterate it with a plain for loop
+            def align_generator(self, gen, *args, **kwargs):
+                for line in gen:
+                    yield line.upper()
+
+        service_builder = LegacyOrchestrator()
+        service_builder.add(opea_microservices["s0"]).add(opea_microservices["s1"])
+        service_builder.flow_to(self.s0, self.s1)
+        result_dict, _ = await service_builder.schedule(initial_inputs={"text": "hello, "})
+        chunks = [k async for k in result_dict["s1/MicroService"].body_iterator]
+        self.assertEqual(chunks[0], "DATA: B' OPEA '\n\n")
+        self.assertEqual(chunks[-1], "DATA: B'~~~'\n\n")
+        await service_builder.connection_pool.close()
+
     def test_extract_chunk_str(self):
         res = self.service_builder.extract_chunk_str("data: [DONE]\n\n")
         self.assertEqual(res, "")
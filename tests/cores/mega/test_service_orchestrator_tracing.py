@@ -0,0 +1,138 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from fastapi.responses import StreamingResponse
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+
+from comps import ServiceOrchestrator, ServiceType, TextDoc, opea_microservices, register_microservice
+from comps.cores.proto.docarray import LLMParams
+from comps.cores.telemetry import opea_telemetry
+
+
+@register_microservice(name="s1", host="0.0.0.0", port=8083, endpoint="/v1/add")
+async def s1_add(request: TextDoc) -> TextDoc:
+    time.sleep(0.1)
+    return {"text": request.text + " ~~~"}
+
+
+@register_microservice(name="s2", host="0.0.0.0", port=8084, endpoint="/v1/add", service_type=ServiceType.LLM)
+async def s2_add(request: TextDoc) -> TextDoc:
+    async def token_generator():
+        for token in [" OPEA", " is", " great."]:
+            yield token
+
+    return StreamingResponse(token_generator(), media_type="text/event-stream")
+
+
+@register_microservice(name="s3", host="0.0.0.0", port=8095, endpoint="/v1/add", service_type=ServiceType.LLM)
+async def s3_add(request: TextDoc) -> TextDoc:
+    async def token_generator():
+        # several chunks before the end of the first sentence
+        for token in [" OPEA", " is", " great."]:
+            yield f"data: b'{token}'\n\n"
+            await asyncio.sleep(0.05)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(token_generator(), media_type="text/event-stream")
+
+
+@register_microservice(name="s4", host="0.0.0.0", port=8096, endpoint="/v1/add")
+async def s4_add(request: TextDoc) -> TextDoc:
+    return {"text": request.text.upper()}
+
+
+class TestServiceOrchestratorTracing(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.trace_file = tempfile.NamedTemporaryFile(suffix=".jsonl", delete=False).name
+        # the microservice processes inherit the tracing settings
+        opea_telemetry.request_tracing = True
+        opea_telemetry.traceProvider.add_span_processor(
+            SimpleSpanProcessor(opea_telemetry.FileSpanExporter(cls.trace_file))
+        )
+        cls.s1 = opea_microservices["s1"]
+        cls.s2 = opea_microservices["s2"]
+        cls.s3 = opea_microservices["s3"]
+        cls.s4 = opea_microservices["s4"]
+        for service in (cls.s1, cls.s2, cls.s3, cls.s4):
+            service.start()
+
+        cls.service_builder = ServiceOrchestrator()
+        cls.service_builder.add(cls.s1).add(cls.s2)
+        cls.service_builder.flow_to(cls.s1, cls.s2)
+        # an LLM streaming to a downstream service, e.g. TTS
+        cls.downstream_builder = ServiceOrchestrator()
+        cls.downstream_builder.add(cls.s3).add(cls.s4)
+        cls.downstream_builder.flow_to(cls.s3, cls.s4)
+
+    @classmethod
+    def tearDownClass(cls):
+        for service in (cls.s1, cls.s2, cls.s3, cls.s4):
+            service.stop()
+        opea_telemetry.request_tracing = False
+        os.remove(cls.trace_file)
+
+    def setUp(self):
+        open(self.trace_file, "w").close()
+
+    def spans(self):
+        with open(self.trace_file) as f:
+            return [json.loads(line) for line in f]
+
+    async def test_request_trace(self):
+        result_dict, _ = await self.service_builder.schedule(
+            initial_inputs={"text": "hello"}, llm_parameters=LLMParams(streaming=True)
+        )
+        chunks = [chunk async for chunk in result_dict[self.s2.name].body_iterator]
+        self.assertTrue(chunks)
+        time.sleep(0.5)
+
+        all_spans = self.spans()
+        spans = {span["name"]: span for span in all_spans}
+        schedule = spans["schedule"]
+        trace_id = schedule["context"]["trace_id"]
+        for node in [self.s1, self.s2]:
+            execute = spans[f"execute {node.name}"]
+            self.assertEqual(execute["parent_id"], schedule["context"]["span_id"])
+            self.assertEqual(execute["context"]["trace_id"], trace_id)
+            attributes = execute["attributes"]
+            self.assertEqual(attributes["opea.http.status_code"], 200)
+            self.assertGreaterEqual(attributes["opea.total_time_ms"], attributes["opea.server_time_ms"])
+            self.assertAlmostEqual(
+                attributes["opea.network_time_ms"],
+                attributes["opea.total_time_ms"] - attributes["opea.server_time_ms"],
+                places=3,
+            )
+        self.assertGreaterEqual(spans[f"execute {self.s1.name}"]["attributes"]["opea.server_time_ms"], 100)
+        self.assertIn("opea.time_to_first_token_ms", spans[f"execute {self.s2.name}"]["attributes"])
+        self.assertIn("align_inputs", spans)
+        self.assertIn("align_generator", spans)
+
+        # the microservices continue the trace of the megaservice
+        servers = [span for span in all_spans if span["kind"] == "SpanKind.SERVER"]
+        self.assertEqual(len(servers), 2)
+        execute_ids = {spans[f"execute {node.name}"]["context"]["span_id"] for node in [self.s1, self.s2]}
+        for server in servers:
+            self.assertEqual(server["context"]["trace_id"], trace_id)
+            self.assertIn(server["parent_id"], execute_ids)
+
+    async def test_first_token_recorded_once(self):
+        result_dict, _ = await self.downstream_builder.schedule(
+            initial_inputs={"text": "hello"}, llm_parameters=LLMParams(streaming=True)
+        )
+        # the stream of the LLM goes through its downstream service
+        response = next(value for value in result_dict.values() if isinstance(value, StreamingResponse))
+        chunks = [chunk async for chunk in response.body_iterator]
+        self.assertTrue(chunks)
+        time.sleep(0.5)
+
+        execute = [span for span in self.spans() if span["name"] == f"execute {self.s3.name}"][-1]
+        self.assertIn("opea.time_to_first_token_ms", execute["attributes"])
+        self.assertEqual([event["name"] for event in execute["events"]].count("first_token"), 1)
@@ -1,10 +1,16 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
 import json
+import time
 import unittest
 
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
 from comps import ServiceOrchestratorWithYaml, TextDoc, opea_microservices, register_microservice
+from comps.cores.proto.docarray import LLMParams
 
 
 @register_microservice(name="s1", host="0.0.0.0", port=8081, endpoint="/v1/add")
@@ -25,23 +31,80 @@ async def s2_add(request: TextDoc) -> TextDoc:
     return {"text": text}
 
 
+# texts s3 already failed once for
+failed = set()
+
+
+@register_microservice(name="s3", host="0.0.0.0", port=8083, endpoint="/v1/add")
+async def s3_add(request: TextDoc) -> TextDoc:
+    await asyncio.sleep(0.5)
+    if request.text not in failed:
+        failed.add(request.text)
+        raise HTTPException(status_code=503, detail="busy")
+    return {"text": request.text + " s3"}
+
+
+@register_microservice(name="s4", host="0.0.0.0", port=8084, endpoint="/v1/add")
+async def s4_add(request: TextDoc) -> TextDoc:
+    await asyncio.sleep(0.5)
+    return {"text": request.text + " s4"}
+
+
+@register_microservice(name="s5", host="0.0.0.0", port=8085, endpoint="/v1/add")
+async def s5_add(request: TextDoc) -> TextDoc:
+    async def token_generator():
+        for token in request.text.split():
+            yield f"data: {repr(token.encode('utf-8'))}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(token_generator(), media_type="text/event-stream")
+
+
+@register_microservice(name="s6", host="0.0.0.0", port=8086, endpoint="/v1/add")
+async def s6_add(request: TextDoc) -> TextDoc:
+    await asyncio.sleep(1)
+    return {"text": request.text}
+
+
 class TestYAMLOrchestrator(unittest.IsolatedAsyncioTestCase):
-    def setUp(self) -> None:
-        self.s1 = opea_microservices["s1"]
-        self.s2 = opea_microservices["s2"]
-        self.s1.start()
-        self.s2.start()
+    @classmethod
+    def setUpClass(cls):
+        cls.services = [opea_microservices[f"s{i}"] for i in range(1, 7)]
+        for service in cls.services:
+            service.start()
 
-    def tearDown(self):
-        self.s1.stop()
-        self.s2.stop()
+    @classmethod
+    def tearDownClass(cls):
+        for service in cls.services:
+            service.stop()
 
     async def test_schedule(self):
         service_builder = ServiceOrchestratorWithYaml(yaml_file_path="megaservice.yaml")
-        await service_builder.schedule(initial_inputs={"text": "Hello, "})
-        result_dict = service_builder.result_dict
+        result_dict, _ = await service_builder.schedule(initial_inputs={"text": "Hello, "})
         self.assertEqual(result_dict["s2"]["text"], "Hello, opea project!")
 
+    async def test_concurrent_requests(self):
+        service_builder = ServiceOrchestratorWithYaml(yaml_file_path="megaservice.yaml")
+        results = await asyncio.gather(*[service_builder.schedule(initial_inputs={"text": f"{i} "}) for i in range(10)])
+        self.assertEqual([r[0]["s2"]["text"] for r in results], [f"{i} opea project!" for i in range(10)])
+
+    async def test_parallel_branches(self):
+        service_builder = ServiceOrchestratorWithYaml(yaml_file_path="megaservice_parallel.yaml")
+        start = time.time()
+        result_dict, runtime_graph = await service_builder.schedule(
+            initial_inputs={"text": "hello"}, llm_parameters=LLMParams(streaming=True)
+        )
+        # s3 and s4 run concurrently, s3 is retried once after its 503
+        self.assertLess(time.time() - start, 1.5)
+        self.assertEqual(runtime_graph.status, {"s3": 200, "s4": 200, "s5": 200})
+        chunks = [chunk async for chunk in result_dict["s5"].body_iterator]
+        self.assertTrue(chunks)
+
+    async def test_timeout(self):
+        service_builder = ServiceOrchestratorWithYaml(yaml_file_path="megaservice_timeout.yaml")
+        with self.assertRaises(asyncio.TimeoutError):
+            await service_builder.schedule(initial_inputs={"text": "hello"})
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,77 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import json
+import time
+import unittest
+
+from comps import ServiceOrchestrator
+from comps.cores.mega.streaming import DONE_EVENT, SSEEncoder, StreamingMetrics, coalesce, pack_tokens, sse_events
+
+
+async def generate(delays):
+    """Yield "t<i>" after each delay (seconds)."""
+    for i, delay in enumerate(delays):
+        await asyncio.sleep(delay)
+        yield f"t{i} "
+
+
+class TestSSEEncoding(unittest.TestCase):
+    def test_formats(self):
+        self.assertEqual(SSEEncoder("bytes").event("héllo"), f"data: {'héllo'.encode('utf-8')!r}\n\n")
+        self.assertEqual(SSEEncoder("json").event("a\nb"), 'data: {"text":"a\\nb"}\n\n')
+        chunk = json.loads(SSEEncoder("openai", model="m").event("hi")[len("data: ") :])
+        self.assertEqual((chunk["object"], chunk["model"]), ("chat.completion.chunk", "m"))
+        self.assertEqual(chunk["choices"][0]["delta"]["content"], "hi")
+        with self.assertRaises(ValueError):
+            SSEEncoder("xml")
+
+    def test_extract_chunk_str(self):
+        orchestrator = ServiceOrchestrator()
+        for event_format in ("json", "openai"):
+            self.assertEqual(orchestrator.extract_chunk_str(SSEEncoder(event_format).event("a b\n")), "a b\n")
+        self.assertEqual(orchestrator.extract_chunk_str("data: b'a b'\n\n"), "a b")
+
+    def test_pack_tokens(self):
+        self.assertEqual(pack_tokens(["a ", "b ", "c ", "d"], max_bytes=4, is_first=True), ["a ", "b c ", "d"])
+        self.assertEqual(pack_tokens(["a ", "b "], max_bytes=256), ["a b "])
+
+    def test_token_generator(self):
+        orchestrator = ServiceOrchestrator()
+        events = list(orchestrator.token_generator("I think so.", time.time(), is_first=True, is_last=True))
+        self.assertEqual(events, ["data: b'I '\n\n", "data: b'think '\n\n", "data: b'so.'\n\n", DONE_EVENT])
+
+
+class TestCoalescing(unittest.IsolatedAsyncioTestCase):
+    async def test_time_window(self):
+        start = time.monotonic()
+        frames = []
+        # t0 at once, t1-t3 within the window, a stall, then t4
+        async for frame in coalesce(generate([0, 0.001, 0.001, 0.001, 0.2]), window=0.03, max_bytes=256):
+            frames.append((frame, time.monotonic() - start))
+        self.assertEqual([frame for frame, _ in frames], ["t0 ", "t1 t2 t3 ", "t4 "])
+        # the first token is not delayed, the frame before the stall is flushed when its window is over
+        self.assertLess(frames[0][1], 0.02)
+        self.assertLess(frames[1][1], 0.15)
+
+    async def test_max_bytes(self):
+        frames = [frame async for frame in coalesce(generate([0] * 5), window=10, max_bytes=6)]
+        self.assertEqual(frames, ["t0 ", "t1 t2 ", "t3 t4 "])
+
+    async def test_sse_events(self):
+        events_counter = StreamingMetrics("test_sse").events_counter
+        before = events_counter._value.get()
+        # sync generators are iterated in a threadpool
+        events = [
+            event
+            async for event in sse_events(
+                iter(["a ", "b ", "c"]), "test_sse", event_format="json", coalesce_window_ms=50
+            )
+        ]
+        self.assertEqual(events, ['data: {"text":"a "}\n\n', 'data: {"text":"b c"}\n\n', DONE_EVENT])
+        self.assertEqual(events_counter._value.get() - before, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
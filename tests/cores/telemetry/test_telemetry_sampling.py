@@ -0,0 +1,79 @@
+# Copyright (C) 2024 Intel Corporation
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+from fastapi.testclient import TestClient
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.trace import Status, StatusCode
+
+from comps.cores.mega.http_service import HTTPService
+from comps.cores.telemetry.opea_telemetry import RingBufferSpanExporter, TailSamplingSpanProcessor, tracer
+
+
+class TestTailSampling(unittest.TestCase):
+    def setUp(self):
+        self.exporter = RingBufferSpanExporter()
+        self.sampler = TailSamplingSpanProcessor(sample_rate=0, keep_slow_ms=50)
+        self.sampler.add_span_processor(SimpleSpanProcessor(self.exporter))
+        provider = TracerProvider()
+        provider.add_span_processor(self.sampler)
+        self.tracer = provider.get_tracer(__name__)
+
+    def names(self):
+        return sorted(span.name for span in self.exporter.get_finished_spans())
+
+    def test_keep_slow(self):
+        with self.tracer.start_as_current_span("fast"):
+            with self.tracer.start_as_current_span("fast_child"):
+                pass
+        self.assertEqual(self.names(), [])
+        with self.tracer.start_as_current_span("slow"):
+            with self.tracer.start_as_current_span("slow_child"):
+                time.sleep(0.06)
+        self.assertEqual(self.names(), ["slow", "slow_child"])
+        self.assertEqual(len(self.sampler._pending), 0)
+
+    def test_keep_errors_and_late_spans(self):
+        with self.tracer.start_as_current_span("failed") as span:
+            late = self.tracer.start_span("stream")
+            span.set_status(Status(StatusCode.ERROR))
+        # ends after its root, follows the decision of the trace
+        late.end()
+        self.assertEqual(self.names(), ["failed", "stream"])
+
+    def test_ring_buffer(self):
+        exporter = RingBufferSpanExporter(max_spans=2)
+        for name in ("a", "b", "c"):
+            span = self.tracer.start_span(name)
+            span.end()
+            exporter.export([span])
+        self.assertEqual([span.name for span in exporter.get_finished_spans()], ["b", "c"])
+
+
+class TestTracingConfig(unittest.TestCase):
+    def test_debug_endpoint(self):
+        with tracer.start_as_current_span("debug_span") as span:
+            trace_id = format(span.get_span_context().trace_id, "032x")
+        client = TestClient(HTTPService(runtime_args={"title": "test", "description": ""}).app)
+        spans = client.get("/v1/debug/traces", params={"trace_id": trace_id}).json()
+        self.assertEqual([span["name"] for span in spans], ["debug_span"])
+
+    def test_disabled(self):
+        code = (
+            "from comps import opea_telemetry\n"
+            "from comps.cores.telemetry.opea_telemetry import recent_spans\n"
+            "f = lambda: 1\n"
+            "assert opea_telemetry(f) is f and recent_spans() is None\n"
+        )
+        env = {**os.environ, "TELEMETRY_ENABLED": "false"}
+        subprocess.run([sys.executable, "-c", code], env=env, check=True)
+
+
+if __name__ == "__main__":
+    unittest.main()